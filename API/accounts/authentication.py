@@ -0,0 +1,54 @@
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+
+class ClaimsUser(TokenUser):
+    # Request user built from the token claims alone (no DB row)
+
+    @cached_property
+    def is_med_user(self):
+        return bool(self.token.get("is_med_user", False))
+
+    @cached_property
+    def email(self):
+        return self.token.get("user_email", "")
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    # Resolves `request.user` from the `user_id` / `is_med_user` claims so
+    # authenticated reads cost no user query. Tokens issued before the role
+    # claim existed still go through the regular DB lookup. Writes check that
+    # the account still exists and is active (one EXISTS query); reads trust
+    # the token until it expires, see ACCESS_TOKEN_LIFETIME.
+
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is not None and request.method not in SAFE_METHODS:
+            self.check_active(result[0])
+        return result
+
+    def check_active(self, user):
+        if not isinstance(user, ClaimsUser):
+            # Loaded from the database, is_active already checked
+            return
+        active = self.user_model.objects.filter(
+            **{api_settings.USER_ID_FIELD: user.id}, is_active=True
+        ).exists()
+        if not active:
+            raise AuthenticationFailed(
+                _("User not found or inactive"), code="user_inactive"
+            )
+
+    def get_user(self, validated_token):
+        if "is_med_user" not in validated_token:
+            return super().get_user(validated_token)
+
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        return ClaimsUser(validated_token)
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class CalibratedHasherMixin:
+    # Reads the work factors for this algorithm from
+    # settings.PASSWORD_HASHER_COSTS (see `manage.py calibrate_hashers`).
+    # The algorithm name is unchanged, so existing hashes keep verifying and
+    # are re-encoded with the new cost on the next successful login.
+    def __init__(self):
+        costs = getattr(settings, "PASSWORD_HASHER_COSTS", {})
+        for name, value in costs.get(self.algorithm, {}).items():
+            setattr(self, name, value)
+
+
+class BCryptSHA256PasswordHasher(
+    CalibratedHasherMixin, hashers.BCryptSHA256PasswordHasher
+):
+    pass
+
+
+class PBKDF2PasswordHasher(CalibratedHasherMixin, hashers.PBKDF2PasswordHasher):
+    pass
+
+
+class PBKDF2SHA1PasswordHasher(CalibratedHasherMixin, hashers.PBKDF2SHA1PasswordHasher):
+    pass
+
+
+class Argon2PasswordHasher(CalibratedHasherMixin, hashers.Argon2PasswordHasher):
+    pass
+
+
+class ScryptPasswordHasher(CalibratedHasherMixin, hashers.ScryptPasswordHasher):
+    pass
@@ -0,0 +1,48 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password
+
+# Bounded pool for password hashing. Only enabled from the ASGI entry point:
+# there every sync request gets its own thread, so a burst of logins would
+# otherwise run an unbounded number of CPU-heavy hash checks at once and
+# starve every other request. Under WSGI the check runs inline.
+_executor = None
+
+
+def use_hashing_pool(max_workers=None):
+    global _executor
+    if _executor is None:
+        max_workers = (
+            max_workers
+            or getattr(settings, "PASSWORD_HASH_WORKERS", None)
+            or os.cpu_count()
+        )
+        _executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="password-hash"
+        )
+    return _executor
+
+
+def _run(func, *args):
+    if _executor is None:
+        return func(*args)
+    return _executor.submit(func, *args).result()
+
+
+def check_user_password(user, raw_password):
+    # Same contract as user.check_password(), but the hashing runs on the
+    # bounded pool when enabled. The rehash save stays on the calling thread
+    # because DB connections are per-thread.
+    upgraded = []
+
+    def setter(raw_password):
+        user.set_password(raw_password)
+        upgraded.append(True)
+
+    is_correct = _run(check_password, raw_password, user.password, setter)
+    if upgraded:
+        user._password = None
+        user.save(update_fields=["password"])
+    return is_correct
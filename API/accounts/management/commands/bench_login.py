@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+
+from accounts.models import MedUser, RegUser
+
+
+class Command(BaseCommand):
+    help = "Measure logins/sec through the full login view stack."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=20)
+        parser.add_argument("--med", action="store_true", help="bench med-login")
+
+    def handle(self, *args, **options):
+        email = "bench-login@example.com"
+        password = "bench-login-password"
+        url = "/api/account/med-login/" if options["med"] else "/api/account/login/"
+
+        # Everything, including any session rows, is rolled back at the end
+        with transaction.atomic():
+            if options["med"]:
+                MedUser.objects.create_meduser(
+                    email,
+                    "Bench",
+                    password,
+                    is_med_user=True,
+                    qualification="Bench",
+                    specialization="Bench",
+                )
+            else:
+                RegUser.objects.create_reguser(
+                    email, "Bench", password, is_med_user=False
+                )
+
+            client = Client(HTTP_HOST="localhost")
+            payload = {"email": email, "password": password}
+            # Warm up (imports, hasher setup) outside the timed loop
+            response = client.post(url, payload)
+            if response.status_code != 200:
+                self.stderr.write(f"login failed: {response.status_code}")
+                transaction.set_rollback(True)
+                return
+
+            start = time.perf_counter()
+            for _ in range(options["count"]):
+                client.post(url, payload)
+            elapsed = time.perf_counter() - start
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(
+            f"{options['count']} logins in {elapsed:.2f}s: "
+            f"{options['count'] / elapsed:.2f} logins/sec "
+            f"({elapsed / options['count'] * 1000:.1f} ms/login)"
+        )
@@ -0,0 +1,103 @@
+import math
+import pprint
+import time
+
+from django.contrib.auth.hashers import get_hashers
+from django.core.management.base import BaseCommand
+
+# algorithm -> (work factor attribute, how the cost scales with it)
+COST_PARAMS = {
+    "bcrypt_sha256": ("rounds", "log2"),
+    "bcrypt": ("rounds", "log2"),
+    "pbkdf2_sha256": ("iterations", "linear"),
+    "pbkdf2_sha1": ("iterations", "linear"),
+    "argon2": ("time_cost", "linear"),
+    "scrypt": ("work_factor", "power2"),
+}
+
+# OpenSSL refuses scrypt above 32 MiB unless maxmem is raised
+SCRYPT_DEFAULT_MAXMEM = 32 * 1024 * 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the configured password hashers on this machine and "
+        "recommend PASSWORD_HASHER_COSTS for a target verification time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--target-ms",
+            type=float,
+            default=100.0,
+            help="wanted time for one password check (default: 100)",
+        )
+        parser.add_argument("--samples", type=int, default=3)
+
+    def handle(self, *args, **options):
+        target = options["target_ms"] / 1000
+        self.samples = options["samples"]
+        recommended = {}
+
+        for hasher in get_hashers():
+            algorithm = hasher.algorithm
+            if algorithm not in COST_PARAMS:
+                self.stdout.write(f"{algorithm:<15} skipped (no tunable cost)")
+                continue
+            if getattr(hasher, "library", None):
+                try:
+                    hasher._load_library()
+                except ValueError:
+                    self.stdout.write(f"{algorithm:<15} skipped (library missing)")
+                    continue
+
+            param, scale = COST_PARAMS[algorithm]
+            current = getattr(hasher, param)
+            elapsed = self.measure(hasher, param, current)
+            value = self.estimate(current, scale, target / elapsed)
+            new_elapsed = self.measure(hasher, param, value)
+
+            self.stdout.write(
+                f"{algorithm:<15} {f'{param}={current}':<20} {elapsed * 1000:8.1f} ms"
+                f"  ->  {f'{param}={value}':<20} {new_elapsed * 1000:8.1f} ms"
+            )
+            recommended[algorithm] = {param: value}
+            if algorithm == "scrypt":
+                maxmem = self.scrypt_maxmem(hasher, value)
+                if maxmem:
+                    recommended[algorithm]["maxmem"] = maxmem
+
+        self.stdout.write("")
+        self.stdout.write("PASSWORD_HASHER_COSTS = " + pprint.pformat(recommended))
+
+    def estimate(self, current, scale, ratio):
+        if scale == "linear":
+            value = max(1, round(current * ratio))
+            # keep iteration counts readable
+            if value >= 10000:
+                value = round(value, -3)
+            return value
+        steps = round(math.log2(ratio))
+        if scale == "log2":
+            return min(31, max(4, current + steps))
+        # power2: the value itself is a power of two (scrypt N)
+        return max(2, 2 ** (int(math.log2(current)) + steps))
+
+    def scrypt_maxmem(self, hasher, work_factor):
+        needed = 128 * work_factor * hasher.block_size * 2
+        return needed if needed > SCRYPT_DEFAULT_MAXMEM else 0
+
+    def measure(self, hasher, param, value):
+        probe = type(hasher)()
+        setattr(probe, param, value)
+        if probe.algorithm == "scrypt":
+            probe.maxmem = self.scrypt_maxmem(probe, value)
+        password = "calibrate-password"
+        best = None
+        for _ in range(self.samples):
+            salt = probe.salt()
+            start = time.perf_counter()
+            probe.encode(password, salt)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
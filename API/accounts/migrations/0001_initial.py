@@ -0,0 +1,58 @@
+# Generated by Django 4.0.10 on 2026-10-18 06:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='User',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('password', models.CharField(max_length=128, verbose_name='password')),
+                ('last_login', models.DateTimeField(blank=True, null=True, verbose_name='last login')),
+                ('email', models.EmailField(max_length=255, unique=True, verbose_name='email address')),
+                ('name', models.CharField(max_length=200)),
+                ('is_med_user', models.BooleanField(default=False)),
+                ('is_active', models.BooleanField(default=True)),
+                ('is_admin', models.BooleanField(default=False)),
+                ('created_at', models.DateField(auto_now_add=True)),
+                ('updated_at', models.DateField(auto_now=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='MedUser',
+            fields=[
+                ('user_ptr', models.OneToOneField(auto_created=True, on_delete=django.db.models.deletion.CASCADE, parent_link=True, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('qualification', models.CharField(max_length=200)),
+                ('specialization', models.CharField(max_length=200)),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=('accounts.user',),
+        ),
+        migrations.CreateModel(
+            name='RegUser',
+            fields=[
+                ('user_ptr', models.OneToOneField(auto_created=True, on_delete=django.db.models.deletion.CASCADE, parent_link=True, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('date_of_birth', models.DateField(blank=True, null=True)),
+                ('gender', models.CharField(blank=True, choices=[('M', 'Male'), ('F', 'Female'), ('O', 'Other')], max_length=1, null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=('accounts.user',),
+        ),
+    ]
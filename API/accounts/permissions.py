@@ -0,0 +1,17 @@
+from rest_framework.permissions import BasePermission
+
+
+class IsRegUser(BasePermission):
+    message = "Access Denied"
+
+    def has_permission(self, request, view):
+        user = request.user
+        return bool(user and user.is_authenticated and not user.is_med_user)
+
+
+class IsMedUser(BasePermission):
+    message = "Access Denied"
+
+    def has_permission(self, request, view):
+        user = request.user
+        return bool(user and user.is_authenticated and user.is_med_user)
@@ -16,6 +16,8 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
 
         token["user_email"] = user.email
         token["user_id"] = user.id
+        # Lets ClaimsJWTAuthentication resolve the role without a DB hit
+        token["is_med_user"] = user.is_med_user
 
         return token
 
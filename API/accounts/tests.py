@@ -1,3 +1,185 @@
-from django.test import TestCase
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 
-# Create your tests here.
+from django.contrib.auth.hashers import get_hashers, get_hashers_by_algorithm
+from django.test import TestCase, override_settings
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIRequestFactory
+
+from accounts.authentication import ClaimsJWTAuthentication, ClaimsUser
+from accounts.models import MedUser, RegUser, User
+from accounts.permissions import IsMedUser, IsRegUser
+from accounts.serializers import MyTokenObtainPairSerializer
+
+OPEN_LIST_URL = "/api/ticket/med-user-open-list/"
+
+
+def forge_claims(token, **claims):
+    # Rewrite the payload of a signed token, keeping the old signature
+    header, payload, signature = str(token).split(".")
+    data = json.loads(urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    data.update(claims)
+    payload = urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+    return ".".join([header, payload, signature])
+
+
+class ClaimsJWTAuthenticationTest(TestCase):
+    def setUp(self):
+        self.patient = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+        self.doctor = MedUser.objects.create_meduser(
+            "doc@example.com",
+            "Doc",
+            "pass1234",
+            is_med_user=True,
+            qualification="MBBS",
+            specialization="GP",
+        )
+
+    def authenticate(self, raw_token):
+        request = APIRequestFactory().get("/", HTTP_AUTHORIZATION=f"Bearer {raw_token}")
+        user, _ = ClaimsJWTAuthentication().authenticate(request)
+        request.user = user
+        return request
+
+    def token(self, user):
+        return MyTokenObtainPairSerializer.get_token(user).access_token
+
+    def test_role_comes_from_the_claims_without_a_query(self):
+        for user, med in ((self.patient, False), (self.doctor, True)):
+            raw_token = str(self.token(user))
+            with self.assertNumQueries(0):
+                request = self.authenticate(raw_token)
+                self.assertIsInstance(request.user, ClaimsUser)
+                self.assertEqual(request.user.id, user.id)
+                self.assertEqual(request.user.is_med_user, med)
+                self.assertEqual(IsMedUser().has_permission(request, None), med)
+                self.assertEqual(IsRegUser().has_permission(request, None), not med)
+
+    def test_token_without_role_claim_falls_back_to_the_database(self):
+        token = self.token(self.doctor)
+        del token["is_med_user"]
+        with self.assertNumQueries(1):
+            request = self.authenticate(str(token))
+        self.assertIsInstance(request.user, User)
+        self.assertTrue(IsMedUser().has_permission(request, None))
+
+    def test_role_claim_without_user_id_is_rejected(self):
+        token = self.token(self.patient)
+        del token["user_id"]
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(str(token))
+
+    def test_forged_role_claim_is_rejected(self):
+        forged = forge_claims(self.token(self.patient), is_med_user=True)
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(forged)
+
+        response = self.client.get(OPEN_LIST_URL, HTTP_AUTHORIZATION=f"Bearer {forged}")
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get(
+            OPEN_LIST_URL, HTTP_AUTHORIZATION=f"Bearer {self.token(self.patient)}"
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_writes_check_the_account_is_still_active(self):
+        raw_token = str(self.token(self.patient))
+        request = APIRequestFactory().post(
+            "/", HTTP_AUTHORIZATION=f"Bearer {raw_token}"
+        )
+        with self.assertNumQueries(1):
+            user, _ = ClaimsJWTAuthentication().authenticate(request)
+        self.assertEqual(user.id, self.patient.id)
+
+        User.objects.filter(pk=self.patient.pk).update(is_active=False)
+        with self.assertRaises(AuthenticationFailed):
+            ClaimsJWTAuthentication().authenticate(request)
+        # Reads still trust the token until it expires
+        with self.assertNumQueries(0):
+            self.authenticate(raw_token)
+
+    def test_deleted_user_cannot_create(self):
+        raw_token = str(self.token(self.patient))
+        self.patient.delete()
+        response = self.client.post(
+            "/api/ticket/create/",
+            {"description": "help"},
+            HTTP_AUTHORIZATION=f"Bearer {raw_token}",
+        )
+        self.assertEqual(response.status_code, 401)
+
+
+def reset_hashers():
+    # Hasher instances read PASSWORD_HASHER_COSTS once, when first built
+    get_hashers.cache_clear()
+    get_hashers_by_algorithm.cache_clear()
+
+
+class UserLoginTest(TestCase):
+    def setUp(self):
+        reset_hashers()
+        self.addCleanup(reset_hashers)
+        with override_settings(PASSWORD_HASHER_COSTS={"bcrypt_sha256": {"rounds": 4}}):
+            self.patient = RegUser.objects.create_reguser(
+                "patient@example.com", "Patient", "pass1234", is_med_user=False
+            )
+            self.doctor = MedUser.objects.create_meduser(
+                "doc@example.com",
+                "Doc",
+                "pass1234",
+                is_med_user=True,
+                qualification="MBBS",
+                specialization="GP",
+            )
+        reset_hashers()
+
+    def login(self, url, email, password="pass1234"):
+        return self.client.post(url, {"email": email, "password": password})
+
+    @override_settings(PASSWORD_HASHER_COSTS={"bcrypt_sha256": {"rounds": 4}})
+    def test_login_is_one_query(self):
+        for url, user in (
+            ("/api/account/login/", self.patient),
+            ("/api/account/med-login/", self.doctor),
+        ):
+            with self.assertNumQueries(1):
+                response = self.login(url, user.email)
+            self.assertEqual(response.status_code, 200)
+            request = APIRequestFactory().get(
+                "/", HTTP_AUTHORIZATION=f"Bearer {response.json()['token']}"
+            )
+            claims_user, _ = ClaimsJWTAuthentication().authenticate(request)
+            self.assertEqual(claims_user.id, user.id)
+            self.assertEqual(claims_user.is_med_user, user.is_med_user)
+
+        self.assertEqual(
+            self.login("/api/account/login/", "x@example.com").status_code, 404
+        )
+        # The patient is not a med user
+        self.assertEqual(
+            self.login("/api/account/med-login/", self.patient.email).status_code, 404
+        )
+
+    def test_hash_is_upgraded_when_the_cost_changes(self):
+        old_hash = self.patient.password
+        self.assertIn("$2b$04$", old_hash)
+
+        with override_settings(PASSWORD_HASHER_COSTS={"bcrypt_sha256": {"rounds": 5}}):
+            reset_hashers()
+            response = self.login("/api/account/login/", self.patient.email, "wrong")
+            self.assertEqual(response.status_code, 401)
+            self.patient.refresh_from_db()
+            self.assertEqual(self.patient.password, old_hash)
+
+            # Verify, then one UPDATE with the re-encoded hash
+            with self.assertNumQueries(2):
+                response = self.login("/api/account/login/", self.patient.email)
+            self.assertEqual(response.status_code, 200)
+            self.patient.refresh_from_db()
+            self.assertIn("$2b$05$", self.patient.password)
+            self.assertTrue(self.patient.check_password("pass1234"))
+
+            # Already at the new cost: no more writes
+            with self.assertNumQueries(1):
+                self.login("/api/account/login/", self.patient.email)
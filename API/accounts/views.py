@@ -2,15 +2,18 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.views import APIView
 from accounts.serializers import *
-from django.contrib.auth import authenticate, login
+from accounts.hashing import check_user_password
 from accounts.renderers import UserRenderer
+from api.conditional import ConditionalGet
 from rest_framework.permissions import IsAuthenticated
+from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.views import TokenObtainPairView
-from rest_framework_simplejwt.tokens import AccessToken
 
 
 class UserChangePasswordView(APIView):
     renderer_classes = [UserRenderer]
+    # needs the real user row to check and set the password
+    authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
 
     def post(self, request, format=None):
@@ -54,6 +57,8 @@ class PasswordResetView(APIView):
 
 
 class UserDeleteView(APIView):
+    # needs the real user row to check the password and delete it
+    authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
 
     def delete(self, request):
@@ -88,6 +93,47 @@ class UserDeleteView(APIView):
             )
 
 
+class UserLoginMixin:
+    # Shared login path for reg and med users: one query fetches the user by
+    # email and type, the password is verified directly and a JWT is issued
+    # without touching django.contrib.sessions.
+    user_model = None
+    not_found_message = None
+
+    def post(self, request, *args, **kwargs):
+        serializer = UserLoginSerializer(data=request.data)
+        if serializer.is_valid(raise_exception=True):
+            email = serializer.data.get("email")
+            password = serializer.data.get("password")
+            user = self.user_model.objects.filter(email=email).first()
+
+            if user is None:
+                return Response(
+                    {"message": self.not_found_message},
+                    status=status.HTTP_404_NOT_FOUND,
+                )
+
+            if user.is_active and check_user_password(user, password):
+                # Generate and return an access token carrying the role claims
+                access_token = str(
+                    MyTokenObtainPairSerializer.get_token(user).access_token
+                )
+                return Response(
+                    {
+                        "msg": "Login Successful",
+                        "token": access_token,
+                    },
+                    status=status.HTTP_200_OK,
+                )
+            else:
+                return Response(
+                    {"errors": {"password": "Password is not correct."}},
+                    status=status.HTTP_401_UNAUTHORIZED,
+                )
+
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
 ##### REG USER VIEWS #####
 
 
@@ -107,44 +153,9 @@ class RegUserRegistrationView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class RegUserLoginView(TokenObtainPairView):
-    def post(self, request, *args, **kwargs):
-        serializer = UserLoginSerializer(data=request.data)
-        if serializer.is_valid(raise_exception=True):
-            email = serializer.data.get("email")
-            password = serializer.data.get("password")
-            user_exists = RegUser.objects.filter(email=email).exists()
-
-            if user_exists:
-                user = authenticate(request, email=email, password=password)
-
-                if user is not None:
-                    # Log the user in
-                    login(request, user)
-
-                    # Generate and return an access token
-                    access_token = str(AccessToken.for_user(user))
-                    return Response(
-                        {
-                            "msg": "Login Successful",
-                            "token": access_token,
-                        },
-                        status=status.HTTP_200_OK,
-                    )
-                else:
-                    return Response(
-                        {
-                            "errors": {"password": "Password is not correct."},
-                        },
-                        status=status.HTTP_401_UNAUTHORIZED,
-                    )
-            else:
-                return Response(
-                    {"message": "User ID does not exist with this email."},
-                    status=status.HTTP_404_NOT_FOUND,
-                )
-
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+class RegUserLoginView(UserLoginMixin, TokenObtainPairView):
+    user_model = RegUser
+    not_found_message = "User ID does not exist with this email."
 
 
 class RegProfileView(APIView):
@@ -152,16 +163,25 @@ class RegProfileView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, format=None):
-        serializer = OnlyUserProfileSerializer(request.user)
-        user_id = serializer["id"].value
+        user_id = request.user.id
         try:
             # Query the RegUser table using the user's ID
             reg_user = RegUser.objects.get(id=user_id)
 
+            # 304 straight from the row, before any serialization
+            conditional = ConditionalGet.for_instance(
+                request, reg_user, RegProfileSerializer.Meta.fields
+            )
+            not_modified = conditional.not_modified_response()
+            if not_modified is not None:
+                return not_modified
+
             # Serialize the RegUser data
             serializer = RegProfileSerializer(reg_user)
 
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return conditional.finish(
+                Response(serializer.data, status=status.HTTP_200_OK)
+            )
         except RegUser.DoesNotExist:
             return Response(
                 {"detail": "User not found."}, status=status.HTTP_404_NOT_FOUND
@@ -171,77 +191,51 @@ class RegProfileView(APIView):
 ##### MED USER VIEWS #####
 
 
-# class MedUserRegistrationView(APIView):
-#     def post(self, request, format=None):
-#         data = request.data.copy()
-#         data["is_med_user"] = True
-
-#         serializer = MedUserRegistrationSerializer(data=data)
-#         if serializer.is_valid(raise_exception=True):
-#             user = serializer.save()
-#             return Response(
-#                 {"msg": "Registration Successful"},
-#                 status=status.HTTP_201_CREATED,
-#             )
-
-#         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
+class MedUserRegistrationView(APIView):
+    def post(self, request, format=None):
+        data = request.data.copy()
+        data["is_med_user"] = True
 
-class MedUserLoginView(TokenObtainPairView):
-    def post(self, request, *args, **kwargs):
-        serializer = UserLoginSerializer(data=request.data)
+        serializer = MedUserRegistrationSerializer(data=data)
         if serializer.is_valid(raise_exception=True):
-            email = serializer.data.get("email")
-            password = serializer.data.get("password")
-
-            # Check if the user ID exists in the table
-            user_exists = MedUser.objects.filter(email=email).exists()
-
-            if user_exists:
-                user = authenticate(request, email=email, password=password)
-
-                if user is not None:
-                    # Log the user in
-                    login(request, user)
-
-                    # Generate and return an access token
-                    access_token = str(AccessToken.for_user(user))
-                    return Response(
-                        {
-                            "msg": "Login Successful",
-                            "token": access_token,
-                        },
-                        status=status.HTTP_200_OK,
-                    )
-                else:
-                    return Response(
-                        {"errors": {"password": "Password is not correct."}},
-                        status=status.HTTP_401_UNAUTHORIZED,
-                    )
-            else:
-                return Response(
-                    {"message": "Medical User ID does not exist with this email."},
-                    status=status.HTTP_404_NOT_FOUND,
-                )
+            user = serializer.save()
+            return Response(
+                {"msg": "Registration Successful"},
+                status=status.HTTP_201_CREATED,
+            )
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class MedUserLoginView(UserLoginMixin, TokenObtainPairView):
+    user_model = MedUser
+    not_found_message = "Medical User ID does not exist with this email."
+
+
 class MedProfileView(APIView):
     renderer_classes = [UserRenderer]
     permission_classes = [IsAuthenticated]
 
     def get(self, request, format=None):
-        serializer = OnlyUserProfileSerializer(request.user)
-        user_id = serializer["id"].value
+        user_id = request.user.id
         try:
             # Query the MedUser table using the user's ID
             med_user = MedUser.objects.get(id=user_id)
 
+            # 304 straight from the row, before any serialization
+            conditional = ConditionalGet.for_instance(
+                request, med_user, MedUserProfileSerializer.Meta.fields
+            )
+            not_modified = conditional.not_modified_response()
+            if not_modified is not None:
+                return not_modified
+
             # Serialize the MedUser data
             serializer = MedUserProfileSerializer(med_user)
 
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return conditional.finish(
+                Response(serializer.data, status=status.HTTP_200_OK)
+            )
         except MedUser.DoesNotExist:
             return Response(
                 {"detail": "MedUser not found."}, status=status.HTTP_404_NOT_FOUND
@@ -0,0 +1,57 @@
+from rest_framework import status
+from rest_framework.response import Response
+
+# Items accepted by one batch request
+MAX_BATCH_SIZE = 100
+
+
+def batch_items(request):
+    # (items, None) for a JSON array of 1..MAX_BATCH_SIZE items, else
+    # (None, error response)
+    items = request.data
+    if not isinstance(items, list) or not items:
+        return None, Response(
+            {"detail": "Expected a non-empty JSON array."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if len(items) > MAX_BATCH_SIZE:
+        return None, Response(
+            {"detail": f"At most {MAX_BATCH_SIZE} items per request."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    return items, None
+
+
+def validate_batch(serializer):
+    # many=True validation that keeps the valid items when others fail:
+    # (validated data or None, errors or {}) per item, in request order
+    if serializer.is_valid():
+        return list(serializer.validated_data), [{}] * len(serializer.validated_data)
+    errors = serializer.errors
+    validated = [
+        None if error else serializer.child.run_validation(item)
+        for item, error in zip(serializer.initial_data, errors)
+    ]
+    return validated, errors
+
+
+def batch_response(errors, created):
+    # One result per item: 201 with the created object or 400 with its
+    # errors. The response is 201 if every item was created, 207 if only
+    # some were and 400 if none.
+    created = iter(created)
+    results = []
+    for index, error in enumerate(errors):
+        if error:
+            results.append({"index": index, "status": 400, "errors": error})
+        else:
+            results.append({"index": index, "status": 201, "data": next(created)})
+
+    failed = sum(1 for error in errors if error)
+    if not failed:
+        code = status.HTTP_201_CREATED
+    elif failed < len(errors):
+        code = status.HTTP_207_MULTI_STATUS
+    else:
+        code = status.HTTP_400_BAD_REQUEST
+    return Response({"results": results}, status=code)
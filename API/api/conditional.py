@@ -0,0 +1,63 @@
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+
+class ConditionalGet:
+    # Conditional GET for read endpoints: the view computes a cheap validator
+    # (e.g. max(updated_at) + count of the listed rows in one aggregate
+    # query), answers 304 from it before paginating or serializing anything,
+    # and stamps ETag / Last-Modified on the full response otherwise.
+    #
+    # The ETag is weak and covers the full path (page, cursor, ordering) and
+    # the Accept header, so every page and rendering gets its own tag.
+    # Lists send no Last-Modified: max(updated_at) does not move when a row
+    # is deleted, so If-Modified-Since alone would get a stale 304. Only
+    # reads that cannot lose rows (e.g. archived threads) pass last_modified.
+
+    def __init__(self, request, *parts, last_modified=None):
+        self.request = request
+        self.last_modified = last_modified
+        digest = hashlib.md5(
+            "|".join(
+                [request.get_full_path(), request.META.get("HTTP_ACCEPT", "")]
+                + [str(part) for part in parts]
+            ).encode()
+        ).hexdigest()
+        self.etag = f'W/"{digest}"'
+
+    @classmethod
+    def for_queryset(cls, request, queryset, *parts, field="updated_at"):
+        # One aggregate query over the filtered rows, whatever page is asked
+        validator = queryset.order_by().aggregate(
+            last_modified=Max(field), count=Count("pk")
+        )
+        return cls(request, validator["count"], validator["last_modified"], *parts)
+
+    @classmethod
+    def for_instance(cls, request, instance, fields):
+        # Single-row reads: the validator is the rendered field values
+        return cls(request, *[getattr(instance, field) for field in fields])
+
+    def not_modified_response(self):
+        # HttpResponseNotModified when the client's copy is current, else None
+        last_modified = None
+        if self.last_modified is not None:
+            last_modified = int(self.last_modified.timestamp())
+        response = get_conditional_response(
+            self.request, etag=self.etag, last_modified=last_modified
+        )
+        if response is not None:
+            self.finish(response)
+        return response
+
+    def finish(self, response):
+        response["ETag"] = self.etag
+        if self.last_modified is not None:
+            response["Last-Modified"] = http_date(self.last_modified.timestamp())
+        # Always revalidate; never share between users
+        response["Cache-Control"] = "private, no-cache"
+        patch_vary_headers(response, ("Authorization",))
+        return response
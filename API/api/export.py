@@ -0,0 +1,264 @@
+import csv
+import io
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from texts.models import Text
+from tickets.archive import unpack
+from tickets.models import ArchivedTicket, Ticket, TicketAttachment, TicketFollowUp
+
+# Rows fetched per round trip (server-side cursor on PostgreSQL)
+CHUNK_SIZE = 2000
+# Bytes collected before a chunk is handed to the response
+BUFFER_SIZE = 64 * 1024
+
+EXPORT_FIELDS = [
+    "record_type",
+    "id",
+    "ticket_id",
+    "followup_id",
+    "sequence_number",
+    "author_id",
+    "is_med_user",
+    "is_open",
+    "opened_by_med_id",
+    "body",
+    "reply",
+    "file",
+    "size",
+    "created_at",
+    "updated_at",
+]
+
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+}
+
+
+def history_records(user_id, chunk_size=CHUNK_SIZE):
+    # Everything a patient created: tickets, every follow-up on them (their
+    # own and the med user's), attachment metadata, archived tickets and
+    # chat texts. Rows are read as dicts through .iterator(), so no model
+    # instances are built and nothing is cached on the queryset.
+    tickets = (
+        Ticket.objects.filter(creator_id=user_id)
+        .order_by("id")
+        .values(
+            "id",
+            "creator_id",
+            "is_open",
+            "opened_by_med_id",
+            "description",
+            "files",
+            "created_at",
+            "updated_at",
+        )
+    )
+    for row in tickets.iterator(chunk_size=chunk_size):
+        yield {
+            "record_type": "ticket",
+            "id": row["id"],
+            "ticket_id": row["id"],
+            "author_id": row["creator_id"],
+            "is_open": row["is_open"],
+            "opened_by_med_id": row["opened_by_med_id"],
+            "body": row["description"],
+            "file": row["files"] or None,
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+
+    followups = (
+        TicketFollowUp.objects.filter(root__creator_id=user_id)
+        .order_by("root_id", "sequence_number")
+        .values(
+            "id",
+            "root_id",
+            "sequence_number",
+            "creator_id",
+            "is_medUser",
+            "description",
+            "files",
+            "created_at",
+            "updated_at",
+        )
+    )
+    for row in followups.iterator(chunk_size=chunk_size):
+        yield {
+            "record_type": "followup",
+            "id": row["id"],
+            "ticket_id": row["root_id"],
+            "followup_id": row["id"],
+            "sequence_number": row["sequence_number"],
+            "author_id": row["creator_id"],
+            "is_med_user": row["is_medUser"],
+            "body": row["description"],
+            "file": row["files"] or None,
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+
+    attachments = (
+        TicketAttachment.objects.filter(
+            Q(ticket__creator_id=user_id) | Q(followup__root__creator_id=user_id)
+        )
+        .order_by("id")
+        .values(
+            "id",
+            "ticket_id",
+            "followup_id",
+            "followup__root_id",
+            "name",
+            "file",
+            "size",
+            "created_at",
+        )
+    )
+    for row in attachments.iterator(chunk_size=chunk_size):
+        yield {
+            "record_type": "attachment",
+            "id": row["id"],
+            "ticket_id": row["ticket_id"] or row["followup__root_id"],
+            "followup_id": row["followup_id"],
+            "body": row["name"],
+            "file": row["file"],
+            "size": row["size"],
+            "created_at": row["created_at"],
+        }
+
+    archived = (
+        ArchivedTicket.objects.filter(creator_id=user_id)
+        .order_by("id")
+        .values_list("data", flat=True)
+    )
+    for data in archived.iterator(chunk_size=chunk_size):
+        yield from archived_records(unpack(data))
+
+    texts = (
+        Text.objects.filter(user_id=user_id)
+        .order_by("created_at", "id")
+        .values(
+            "id", "user_id", "user_input", "chatgpt_input", "created_at", "updated_at"
+        )
+    )
+    for row in texts.iterator(chunk_size=chunk_size):
+        yield {
+            "record_type": "text",
+            "id": row["id"],
+            "author_id": row["user_id"],
+            "body": row["user_input"],
+            "reply": row["chatgpt_input"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+
+
+def archived_time(value):
+    # Archived rows keep timestamps as ISO strings
+    return parse_datetime(value) if value else None
+
+
+def archived_records(ticket):
+    # The same records for a ticket moved to the archive (tickets.archive)
+    yield {
+        "record_type": "ticket",
+        "id": ticket["id"],
+        "ticket_id": ticket["id"],
+        "author_id": ticket["creator_id"],
+        "is_open": ticket["is_open"],
+        "opened_by_med_id": ticket["opened_by_med_id"],
+        "body": ticket["description"],
+        "file": ticket["files"] or None,
+        "created_at": archived_time(ticket["created_at"]),
+        "updated_at": archived_time(ticket["updated_at"]),
+    }
+    followups = sorted(
+        ticket.get("followups", []), key=lambda row: row["sequence_number"]
+    )
+    for row in followups:
+        yield {
+            "record_type": "followup",
+            "id": row["id"],
+            "ticket_id": row["root_id"],
+            "followup_id": row["id"],
+            "sequence_number": row["sequence_number"],
+            "author_id": row["creator_id"],
+            "is_med_user": row["is_medUser"],
+            "body": row["description"],
+            "file": row["files"] or None,
+            "created_at": archived_time(row["created_at"]),
+            "updated_at": archived_time(row["updated_at"]),
+        }
+    for owner in [ticket, *followups]:
+        for row in owner.get("attachments", []):
+            yield {
+                "record_type": "attachment",
+                "id": row["id"],
+                "ticket_id": ticket["id"],
+                "followup_id": row["followup_id"],
+                "body": row["name"],
+                "file": row["file"],
+                "size": row["size"],
+                "created_at": archived_time(row["created_at"]),
+            }
+
+
+def ndjson_lines(records):
+    encoder = DjangoJSONEncoder()
+    for record in records:
+        yield encoder.encode(record) + "\n"
+
+
+def csv_lines(records):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, restval="")
+    writer.writeheader()
+    for record in records:
+        writer.writerow(
+            {
+                key: value.isoformat() if hasattr(value, "isoformat") else value
+                for key, value in record.items()
+            }
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def buffered(lines, size=BUFFER_SIZE):
+    # Fewer, larger writes than one per row
+    parts = []
+    pending = 0
+    for line in lines:
+        data = line.encode("utf-8")
+        parts.append(data)
+        pending += len(data)
+        if pending >= size:
+            yield b"".join(parts)
+            parts = []
+            pending = 0
+    if parts:
+        yield b"".join(parts)
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_history(user_id, output="ndjson", compress=False):
+    # Byte chunks of the user's history; memory use does not grow with it
+    lines = ndjson_lines if output == "ndjson" else csv_lines
+    chunks = buffered(lines(history_records(user_id)))
+    if compress:
+        chunks = gzipped(chunks)
+    return chunks
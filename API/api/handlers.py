@@ -0,0 +1,51 @@
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+
+_exhausted = object()
+
+
+def _next_part(iterator):
+    return next(iterator, _exhausted)
+
+
+class StreamingASGIHandler(ASGIHandler):
+    # Django 4.0 iterates streaming response bodies on the event loop, where
+    # a generator reading the database raises SynchronousOnlyOperation and
+    # file reads block every other connection. Pull each part in the
+    # request's sync thread instead; everything else is unchanged.
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        response_headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode("ascii")
+            if isinstance(value, str):
+                value = value.encode("latin1")
+            response_headers.append((bytes(header), bytes(value)))
+        for c in response.cookies.values():
+            response_headers.append(
+                (b"Set-Cookie", c.output(header="").encode("ascii").strip())
+            )
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": response_headers,
+            }
+        )
+
+        iterator = iter(response)
+        next_part = sync_to_async(_next_part, thread_sensitive=True)
+        while True:
+            part = await next_part(iterator)
+            if part is _exhausted:
+                break
+            for chunk, _ in self.chunk_bytes(part):
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+        await send({"type": "http.response.body"})
+        await sync_to_async(response.close, thread_sensitive=True)()
@@ -0,0 +1,114 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from accounts.models import MedUser
+from texts.models import Text
+from tickets.models import Ticket, TicketFollowUp
+from tickets.routing import (
+    ELSEWHERE,
+    MY_SPECIALIZATION,
+    OFFERED_TO_ME,
+    UNROUTED,
+    personal_segments,
+)
+
+SEGMENT_NAMES = {
+    OFFERED_TO_ME: "offered to me",
+    MY_SPECIALIZATION: "my specialization",
+    UNROUTED: "unrouted",
+    ELSEWHERE: "elsewhere",
+}
+
+
+class Command(BaseCommand):
+    help = "Print the EXPLAIN plan of every list endpoint query."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user-id", type=int, help="reg user to explain for")
+        parser.add_argument(
+            "--med-id",
+            type=int,
+            help="med user to explain for (closed list and personal open queue)",
+        )
+        parser.add_argument("--ticket-id", type=int, help="ticket to explain for")
+        parser.add_argument(
+            "--analyze",
+            action="store_true",
+            help="run the queries too (EXPLAIN ANALYZE, PostgreSQL only)",
+        )
+
+    def handle(self, *args, **options):
+        # Fall back to whatever rows exist so the command works out of the box
+        # on a copy of production data.
+        user_id = options["user_id"] or self.first(Ticket, "creator_id")
+        med_id = options["med_id"] or self.first(Ticket, "opened_by_med_id")
+        open_med_id = options["med_id"] or self.first(MedUser, "id")
+        ticket_id = options["ticket_id"] or self.first(TicketFollowUp, "root_id")
+
+        page = 10
+        queries = [
+            (
+                "reg-user-list",
+                Ticket.objects.filter(creator_id=user_id).order_by("created_at", "id"),
+            ),
+            (
+                "reg-user-list (activity)",
+                Ticket.objects.filter(creator_id=user_id).order_by(
+                    "-last_activity_at", "-id"
+                ),
+            ),
+            (
+                "med-user-close-list",
+                Ticket.objects.filter(opened_by_med_id=med_id).order_by(
+                    "created_at", "id"
+                ),
+            ),
+            (
+                "med-user-close-list (activity)",
+                Ticket.objects.filter(opened_by_med_id=med_id).order_by(
+                    "-last_activity_at", "-id"
+                ),
+            ),
+            (
+                "followup-list",
+                TicketFollowUp.objects.filter(root=ticket_id).order_by(
+                    "-sequence_number"
+                ),
+            ),
+            (
+                "followup-list (cursor)",
+                TicketFollowUp.objects.filter(root=ticket_id).order_by(
+                    "-created_at", "-id"
+                ),
+            ),
+            (
+                "paginated-text-list",
+                Text.objects.filter(user_id=user_id).order_by("-created_at", "-id"),
+            ),
+        ]
+        # The open list is read segment by segment, each on its own index
+        queries += [
+            (f"med-user-open-list ({SEGMENT_NAMES[rank]})", queryset)
+            for rank, queryset in personal_segments(open_med_id)
+        ]
+
+        explain_options = {}
+        if options["analyze"]:
+            if connection.vendor != "postgresql":
+                self.stderr.write("--analyze is only supported on PostgreSQL")
+            else:
+                explain_options = {"analyze": True, "buffers": True}
+
+        for name, queryset in queries:
+            queryset = queryset[: page + 1]
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(str(queryset.query))
+            self.stdout.write(queryset.explain(**explain_options))
+            self.stdout.write("")
+
+    def first(self, model, field):
+        return (
+            model.objects.exclude(**{f"{field}__isnull": True})
+            .values_list(field, flat=True)
+            .first()
+        ) or 0
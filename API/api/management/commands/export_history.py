@@ -0,0 +1,32 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import User
+from api.export import EXPORT_FORMATS, export_history
+
+
+class Command(BaseCommand):
+    help = "Write a user's tickets, follow-ups, attachments and chat texts."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user-id", type=int, required=True)
+        parser.add_argument(
+            "--output", choices=sorted(EXPORT_FORMATS), default="ndjson"
+        )
+        parser.add_argument("--gzip", action="store_true", help="gzip the output")
+        parser.add_argument("--file", help="write here instead of stdout")
+
+    def handle(self, *args, **options):
+        if not User.objects.filter(pk=options["user_id"]).exists():
+            raise CommandError(f"User {options['user_id']} does not exist")
+
+        chunks = export_history(options["user_id"], options["output"], options["gzip"])
+        if options["file"]:
+            with open(options["file"], "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
@@ -0,0 +1,261 @@
+import json
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    # Keyset (seek) pagination over a composite ordering such as
+    # ("created_at", "id"). Every page is a "WHERE (a, b) > (x, y) LIMIT n"
+    # lookup, so deep pages cost the same as the first one and no COUNT(*)
+    # is issued. Cursors are opaque base64 tokens.
+    cursor_query_param = "cursor"
+    mode_query_param = "pagination"
+    mode_value = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+    page_size = 10
+    ordering = ("created_at", "id")
+
+    @classmethod
+    def is_requested(cls, request):
+        params = request.query_params
+        return (
+            cls.cursor_query_param in params
+            or params.get(cls.mode_query_param) == cls.mode_value
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        position, reverse = self.decode_cursor(request)
+        results = self.get_rows(queryset, self.ordering, position, reverse)
+        return self.set_page(results, position, reverse)
+
+    def get_rows(self, queryset, ordering, position, reverse, limit=None):
+        # Up to `limit` (default: a page and one) rows after `position`
+        if limit is None:
+            limit = self.page_size + 1
+        fields = [field.lstrip("-") for field in ordering]
+        descending = ordering[0].startswith("-")
+        # Walking backwards flips the comparison and the sort direction
+        if reverse:
+            descending = not descending
+
+        if position is not None:
+            position = self.clean_position(queryset.model, fields, position)
+            queryset = queryset.filter(
+                self.get_keyset_filter(fields, position, descending)
+            )
+        prefix = "-" if descending else ""
+        queryset = queryset.order_by(*[prefix + field for field in fields])
+        return list(queryset[:limit])
+
+    def set_page(self, results, position, reverse):
+        has_more = len(results) > self.page_size
+        results = results[: self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.page = results
+        return results
+
+    def clean_position(self, model, fields, position):
+        # Cursor values through their model fields: a tampered cursor is an
+        # invalid cursor, not a failing query
+        cleaned = []
+        for field, value in zip(fields, position):
+            if value is None:
+                raise NotFound(self.invalid_cursor_message)
+            try:
+                value = model._meta.get_field(field).to_python(value)
+            except FieldDoesNotExist:
+                pass
+            except ValidationError:
+                raise NotFound(self.invalid_cursor_message)
+            cleaned.append(value)
+        return cleaned
+
+    def get_keyset_filter(self, fields, position, descending):
+        # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+        lookup = "lt" if descending else "gt"
+        condition = Q()
+        for index, field in enumerate(fields):
+            clause = Q(**{f"{field}__{lookup}": position[index]})
+            for prev_field, prev_value in zip(fields[:index], position[:index]):
+                clause &= Q(**{prev_field: prev_value})
+            condition |= clause
+        return condition
+
+    def get_position(self, item):
+        fields = [field.lstrip("-") for field in self.ordering]
+        if isinstance(item, dict):
+            values = [item[field] for field in fields]
+        else:
+            values = [getattr(item, field) for field in fields]
+        return [
+            value.isoformat() if hasattr(value, "isoformat") else value
+            for value in values
+        ]
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            data = json.loads(b64decode(encoded.encode("ascii")).decode("ascii"))
+            position = data["p"]
+            reverse = bool(data.get("r", False))
+            if len(position) != len(self.ordering):
+                raise ValueError
+            for index, field in enumerate(self.ordering):
+                if field.lstrip("-").endswith("_at"):
+                    position[index] = parse_datetime(position[index])
+                    if position[index] is None:
+                        raise ValueError
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def encode_cursor(self, position, reverse=False):
+        data = {"p": position}
+        if reverse:
+            data["r"] = 1
+        encoded = b64encode(json.dumps(data).encode("ascii")).decode("ascii")
+        url = remove_query_param(self.base_url, self.mode_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[-1]))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[0]), reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(
+            OrderedDict(
+                [
+                    ("next", self.get_next_link()),
+                    ("previous", self.get_previous_link()),
+                    ("results", data),
+                ]
+            )
+        )
+
+
+class SegmentedKeysetPagination(KeysetPagination):
+    # Keyset pagination over a list that is the concatenation of disjoint
+    # querysets, [(rank, queryset), ...] in rank order, each seekable on the
+    # rest of the ordering: ordering = ("rank field", "created_at", "id").
+    # The rank is set on every row and carried in the cursor, and a page
+    # reads at most one LIMIT query per segment, moving to the next segment
+    # when one runs out. Nothing ever sorts the union.
+    def paginate_queryset(self, segments, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        position, reverse = self.decode_cursor(request)
+        rank_field, ordering = self.ordering[0], self.ordering[1:]
+        if reverse:
+            segments = segments[::-1]
+
+        results = []
+        for rank, queryset in segments:
+            seek = None
+            if position is not None:
+                if rank == position[0]:
+                    seek = position[1:]
+                elif (rank > position[0]) if reverse else (rank < position[0]):
+                    continue
+            rows = self.get_rows(
+                queryset,
+                ordering,
+                seek,
+                reverse,
+                limit=self.page_size + 1 - len(results),
+            )
+            for row in rows:
+                setattr(row, rank_field, rank)
+            results += rows
+            if len(results) > self.page_size:
+                break
+        return self.set_page(results, position, reverse)
+
+    def decode_cursor(self, request):
+        position, reverse = super().decode_cursor(request)
+        if position is not None and type(position[0]) is not int:
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+
+class SegmentChain:
+    # [(rank, queryset), ...] as one sliceable sequence for Django's
+    # Paginator: a COUNT per segment, then a page reads only the segments it
+    # overlaps, with OFFSET/LIMIT inside each
+    def __init__(self, segments, rank_field):
+        self.segments = segments
+        self.rank_field = rank_field
+        self.counts = None
+
+    def count(self):
+        if self.counts is None:
+            self.counts = [queryset.count() for _, queryset in self.segments]
+        return sum(self.counts)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        start, stop = index.start or 0, index.stop
+        self.count()
+        results = []
+        offset = 0
+        for (rank, queryset), count in zip(self.segments, self.counts):
+            if stop is not None and offset >= stop:
+                break
+            if start < offset + count:
+                low = max(start - offset, 0)
+                high = count if stop is None else min(stop - offset, count)
+                rows = list(queryset[low:high])
+                for row in rows:
+                    setattr(row, self.rank_field, rank)
+                results += rows
+            offset += count
+        return results
+
+
+class SegmentedPageNumberPagination(PageNumberPagination):
+    # ?page=N over the same segments as SegmentedKeysetPagination
+    ordering = SegmentedKeysetPagination.ordering
+
+    def paginate_queryset(self, segments, request, view=None):
+        chain = SegmentChain(segments, self.ordering[0])
+        return super().paginate_queryset(chain, request, view)
+
+
+def select_paginator(request, ordering=KeysetPagination.ordering, segmented=False):
+    # ?pagination=cursor (or any ?cursor=) switches to keyset pagination,
+    # otherwise keep the classic ?page=N behaviour. Segmented paginators take
+    # a list of (rank, queryset) instead of a queryset.
+    if KeysetPagination.is_requested(request):
+        paginator = SegmentedKeysetPagination() if segmented else KeysetPagination()
+    else:
+        paginator = (
+            SegmentedPageNumberPagination() if segmented else PageNumberPagination()
+        )
+    paginator.ordering = ordering
+    return paginator
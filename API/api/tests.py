@@ -1,3 +1,299 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+from base64 import b64encode
+from datetime import timedelta
 
-# Create your tests here.
+from asgiref.testing import ApplicationCommunicator
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from accounts.models import MedUser, RegUser
+from accounts.serializers import MyTokenObtainPairSerializer
+from api.export import EXPORT_FIELDS
+from api.handlers import StreamingASGIHandler
+from texts.models import Text
+from tickets.archive import archive_tickets
+from tickets.models import Ticket, TicketAttachment, TicketFollowUp, claim_ticket
+
+LIST_URL = "/api/ticket/reg-user-list/"
+
+
+def cursor(data):
+    return b64encode(json.dumps(data).encode()).decode()
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        self.user = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+        token = MyTokenObtainPairSerializer.get_token(self.user).access_token
+        self.auth = {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+        self.tickets = [
+            Ticket.objects.create(creator=self.user, description=str(i))
+            for i in range(25)
+        ]
+
+    def walk(self, url, link="next"):
+        pages = []
+        while url:
+            response = self.client.get(url, **self.auth)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.json())
+            url = pages[-1][link]
+        return pages
+
+    def ids(self, pages):
+        return [row["id"] for page in pages for row in page["results"]]
+
+    def test_cursor_pages_round_trip(self):
+        pages = self.walk(f"{LIST_URL}?pagination=cursor")
+        self.assertEqual([len(page["results"]) for page in pages], [10, 10, 5])
+        self.assertEqual(self.ids(pages), [ticket.id for ticket in self.tickets])
+        self.assertIsNone(pages[0]["previous"])
+        self.assertNotIn("count", pages[0])  # no COUNT(*) in cursor mode
+
+        # Walking back from the last page gives the same pages
+        back = self.walk(pages[-1]["previous"], link="previous")
+        self.assertEqual(back[::-1], pages[:-1])
+
+    def test_equal_created_at_is_broken_by_id(self):
+        Ticket.objects.update(created_at=self.tickets[0].created_at)
+        pages = self.walk(f"{LIST_URL}?pagination=cursor")
+        self.assertEqual(self.ids(pages), sorted(ticket.id for ticket in self.tickets))
+
+    def test_invalid_cursors_are_not_found(self):
+        created_at = self.tickets[0].created_at.isoformat()
+        for value in (
+            "not base64!",
+            cursor([created_at, 1]),
+            cursor({"p": [created_at]}),
+            cursor({"p": ["yesterday", 1]}),
+            cursor({"p": [created_at, "abc"]}),
+            cursor({"p": [created_at, {"id": 1}]}),
+            cursor({"p": [created_at, None]}),
+        ):
+            with self.subTest(cursor=value):
+                response = self.client.get(f"{LIST_URL}?cursor={value}", **self.auth)
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.json(), {"detail": "Invalid cursor"})
+
+    def test_page_numbers_without_a_cursor(self):
+        response = self.client.get(f"{LIST_URL}?page=2", **self.auth)
+        data = response.json()
+        self.assertEqual(data["count"], 25)
+        self.assertEqual(
+            [row["id"] for row in data["results"]],
+            [ticket.id for ticket in self.tickets[10:20]],
+        )
+        self.assertIn("page=3", data["next"])
+        self.assertNotIn("cursor", data["next"])
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        self.user = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+        token = MyTokenObtainPairSerializer.get_token(self.user).access_token
+        self.auth = {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+        self.tickets = [
+            Ticket.objects.create(creator=self.user, description=str(i))
+            for i in range(3)
+        ]
+
+    def get(self, url=LIST_URL, **headers):
+        return self.client.get(url, **self.auth, **headers)
+
+    def test_unchanged_list_is_not_modified(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Last-Modified", response)
+        etag = response["ETag"]
+
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        # Other pages and orderings have their own tags
+        self.assertEqual(self.get(f"{LIST_URL}?page=1&ordering=id").status_code, 200)
+
+    def test_edit_invalidates(self):
+        etag = self.get()["ETag"]
+        self.tickets[1].description = "edited"
+        self.tickets[1].save()
+
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_delete_invalidates(self):
+        etag = self.get()["ETag"]
+        # Not the newest row: max(updated_at) stays the same
+        self.tickets[0].delete()
+
+        for headers in (
+            {"HTTP_IF_NONE_MATCH": etag},
+            {"HTTP_IF_MODIFIED_SINCE": "Fri, 01 Jan 2100 00:00:00 GMT"},
+        ):
+            with self.subTest(**headers):
+                response = self.get(**headers)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.json()["results"]), 2)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class HistoryExportTest(TestCase):
+    def setUp(self):
+        self.user = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+        self.other = RegUser.objects.create_reguser(
+            "other@example.com", "Other", "pass1234", is_med_user=False
+        )
+        self.med = MedUser.objects.create_meduser(
+            "doc@example.com",
+            "Doc",
+            "pass1234",
+            is_med_user=True,
+            qualification="MBBS",
+            specialization="GP",
+        )
+        self.ticket = Ticket.objects.create(creator=self.user, description="cough")
+        self.closed = Ticket.objects.create(creator=self.user, description="rash")
+        claim_ticket(self.closed.id, self.med.id)
+        self.reply = TicketFollowUp.objects.create(
+            root=self.closed, creator=self.med, is_medUser=True, description="cream"
+        )
+        TicketAttachment.objects.create(
+            followup=self.reply, file="ticket_files/ab/abc.pdf", name="dose.pdf", size=3
+        )
+        Text.objects.create(user=self.user, user_input="hi", chatgpt_input="hello")
+        other_ticket = Ticket.objects.create(creator=self.other, description="flu")
+        TicketFollowUp.objects.create(
+            root=other_ticket, creator=self.med, is_medUser=True, description="rest"
+        )
+        Text.objects.create(user=self.other, user_input="hey", chatgpt_input="yo")
+
+    def export(self, user=None, **params):
+        user = user or self.user
+        token = MyTokenObtainPairSerializer.get_token(user).access_token
+        return self.client.get(
+            "/api/export/", params, HTTP_AUTHORIZATION=f"Bearer {token}"
+        )
+
+    def content(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content)
+
+    def records(self, **params):
+        body = self.content(self.export(**params)).decode()
+        return [json.loads(line) for line in body.splitlines()]
+
+    def summary(self, records):
+        return [(row["record_type"], row["body"]) for row in records]
+
+    def test_ndjson(self):
+        response = self.export()
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(
+            response["Content-Disposition"],
+            f'attachment; filename="history-{self.user.id}.ndjson"',
+        )
+        records = self.records()
+        self.assertEqual(
+            self.summary(records),
+            [
+                ("ticket", "cough"),
+                ("ticket", "rash"),
+                ("followup", "cream"),
+                ("attachment", "dose.pdf"),
+                ("text", "hi"),
+            ],
+        )
+        followup = records[2]
+        self.assertEqual(followup["ticket_id"], self.closed.id)
+        self.assertEqual(followup["author_id"], self.med.id)
+        self.assertTrue(followup["is_med_user"])
+        self.assertEqual(records[3]["ticket_id"], self.closed.id)
+        self.assertEqual(records[4]["reply"], "hello")
+
+    def test_csv_and_gzip(self):
+        ndjson = self.records()
+        response = self.export(output="csv")
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        rows = list(csv.DictReader(io.StringIO(self.content(response).decode("utf-8"))))
+        self.assertEqual(list(rows[0]), EXPORT_FIELDS)
+        self.assertEqual(self.summary(rows), self.summary(ndjson))
+        self.assertEqual(
+            [row["id"] for row in rows], [str(row["id"]) for row in ndjson]
+        )
+
+        response = self.export(compress="gzip")
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        self.assertEqual(
+            gzip.decompress(self.content(response)), self.content(self.export())
+        )
+
+    def test_archived_tickets_are_exported(self):
+        before = self.records()
+        self.assertEqual(archive_tickets(timezone.now() + timedelta(days=1)), 1)
+        self.assertFalse(Ticket.objects.filter(pk=self.closed.id).exists())
+        self.assertCountEqual(self.records(), before)
+
+    def test_only_the_owner_history_is_exported(self):
+        records = self.records()
+        self.assertNotIn("flu", [row["body"] for row in records])
+        self.assertEqual(
+            self.summary(self.records(user=self.other)),
+            [("ticket", "flu"), ("followup", "rest"), ("text", "hey")],
+        )
+        # Med users have no patient history, anonymous users nothing at all
+        self.assertEqual(self.export(user=self.med).status_code, 403)
+        self.assertEqual(self.client.get("/api/export/").status_code, 401)
+        self.assertEqual(self.export(output="xml").status_code, 400)
+
+
+class StreamingASGIHandlerTest(TransactionTestCase):
+    def setUp(self):
+        self.user = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+        Ticket.objects.bulk_create(
+            [
+                Ticket(creator=self.user, description=f"{i} " + "x" * 1000)
+                for i in range(200)
+            ]
+        )
+
+    async def test_export_is_streamed_in_parts(self):
+        token = MyTokenObtainPairSerializer.get_token(self.user).access_token
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": "/api/export/",
+            "query_string": b"",
+            "headers": [
+                (b"host", b"testserver"),
+                (b"authorization", f"Bearer {token}".encode()),
+            ],
+        }
+        communicator = ApplicationCommunicator(StreamingASGIHandler(), scope)
+        await communicator.send_input({"type": "http.request"})
+        start = await communicator.receive_output(5)
+        self.assertEqual(start["status"], 200)
+        self.assertIn((b"X-Accel-Buffering", b"no"), start["headers"])
+
+        # The generator reads the database; it runs off the event loop
+        parts = []
+        while True:
+            message = await communicator.receive_output(5)
+            parts.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        self.assertGreater(len([part for part in parts if part]), 1)
+        lines = b"".join(parts).decode().splitlines()
+        self.assertEqual(len(lines), 200)
+        self.assertEqual(json.loads(lines[0])["body"], "0 " + "x" * 1000)
@@ -1,3 +1,7 @@
 from django.urls import path
 
-urlpatterns = []
+from .views import HistoryExportView
+
+urlpatterns = [
+    path("export/", HistoryExportView.as_view(), name="history-export"),
+]
@@ -0,0 +1,40 @@
+from django.http import StreamingHttpResponse
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from accounts.permissions import IsRegUser
+
+from .export import EXPORT_FORMATS, export_history
+
+
+class HistoryExportView(APIView):
+    permission_classes = [IsAuthenticated, IsRegUser]
+
+    def get(self, request):
+        # ?output=ndjson|csv, ?compress=gzip. Rows are written while they are
+        # read, so one request returns the whole history at flat memory.
+        output = request.query_params.get("output", "ndjson")
+        if output not in EXPORT_FORMATS:
+            return Response(
+                {"error": f"output must be one of {', '.join(EXPORT_FORMATS)}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        compress = request.query_params.get("compress") == "gzip"
+
+        content_type, extension = EXPORT_FORMATS[output]
+        filename = f"history-{request.user.id}.{extension}"
+        if compress:
+            content_type = "application/gzip"
+            filename += ".gz"
+
+        response = StreamingHttpResponse(
+            export_history(request.user.id, output, compress),
+            content_type=content_type,
+        )
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        response["Cache-Control"] = "no-store"
+        # keep nginx from buffering the whole export
+        response["X-Accel-Buffering"] = "no"
+        return response
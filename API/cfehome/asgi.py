@@ -9,8 +9,29 @@ https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cfehome.settings')
 
-application = get_asgi_application()
+# Same as get_asgi_application(), with streaming bodies pulled off the event
+# loop (see api.handlers)
+django.setup(set_prefix=False)
+
+from api.handlers import StreamingASGIHandler  # noqa: E402
+
+application = StreamingASGIHandler()
+
+# Run password hash checks on a bounded pool (see accounts.hashing)
+from accounts.hashing import use_hashing_pool  # noqa: E402
+
+use_hashing_pool()
+
+# Server-Sent Events for ticket threads (see tickets.sse)
+from tickets.sse import ticket_events_router  # noqa: E402
+
+application = ticket_events_router(application)
+
+# Token streams of text completions (see texts.sse)
+from texts.sse import text_stream_router  # noqa: E402
+
+application = text_stream_router(application)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -54,10 +55,15 @@ REST_FRAMEWORK = {
     # ],
     "DEFAULT_AUTHENTICATION_CLASSES": [
         # "rest_framework.authentication.SessionAuthentication",
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        # "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "accounts.authentication.ClaimsJWTAuthentication",
     ],
 }
 
+# ClaimsJWTAuthentication checks the account on writes only: a deactivated or
+# deleted user keeps read access until the access token expires. Shorten the
+# lifetime to narrow that window (no refresh endpoint is exposed, so users log
+# in again when it runs out).
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=120),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=2),
@@ -102,6 +108,10 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # In memory by default. Tests with concurrent writers need a file
+        # database, whose writers wait for each other's locks: run them with
+        # e.g. DJANGO_TEST_DATABASE_NAME=/tmp/test_db.sqlite3
+        "TEST": {"NAME": os.environ.get("DJANGO_TEST_DATABASE_NAME")},
     }
 }
 
@@ -142,6 +152,64 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+# Attachment downloads: set to "X-Accel-Redirect" (nginx) or "X-Sendfile"
+# (Apache/lighttpd) to let the front proxy send the file. With nginx, map
+# ATTACHMENT_ACCEL_REDIRECT_PREFIX to MEDIA_ROOT in an `internal` location.
+ATTACHMENT_SENDFILE_HEADER = None
+ATTACHMENT_ACCEL_REDIRECT_PREFIX = "/protected/"
+
+# Pub/sub behind the /api/ticket/<id>/events/ stream (served by asgi.py only).
+# The in-process broker reaches the SSE connections of the same process; run
+# a single ASGI worker or point this at a broker shared by all workers.
+TICKET_EVENTS_BROKER = "tickets.events.InProcessBroker"
+# Seconds between keepalive comments on an idle stream
+TICKET_EVENTS_HEARTBEAT = 15
+
+# Ticket routing: the classifier tags each new ticket with a specialization
+# and the ticket is offered to the least-loaded med user of it. Keywords are
+# matched as whole words, case-insensitively, against the description;
+# specializations are compared with MedUser.specialization ignoring case.
+TICKET_CLASSIFIER = "tickets.routing.KeywordClassifier"
+TICKET_SPECIALIZATION_KEYWORDS = {
+    "cardiology": ["heart", "chest pain", "palpitations", "blood pressure"],
+    "dermatology": ["skin", "rash", "acne", "eczema", "itching", "mole"],
+    "pediatrics": ["child", "baby", "infant", "toddler"],
+    "psychiatry": ["anxiety", "depression", "panic", "insomnia"],
+    "orthopedics": ["fracture", "joint", "back pain", "knee", "sprain"],
+}
+
+# Replies to texts (texts.completions): TextCreateView queues a job on a pool
+# of TEXT_COMPLETION_WORKERS threads and the tokens stream over
+# /api/texts/<id>/stream/ (asgi.py only). The stub echoes the prompt; use
+# "texts.completions.ChatCompletionsBackend" with TEXT_COMPLETION_API_URL,
+# TEXT_COMPLETION_MODEL and the TEXT_COMPLETION_API_KEY environment variable
+# for a real model. `manage.py run_completions` picks up texts left pending.
+TEXT_COMPLETION_BACKEND = "texts.completions.StubBackend"
+TEXT_COMPLETION_WORKERS = 4
+# Seconds before a running job is considered lost and requeued
+TEXT_COMPLETION_TIMEOUT = 300
+TEXT_COMPLETION_API_URL = "https://api.openai.com/v1/chat/completions"
+TEXT_COMPLETION_MODEL = "gpt-4o-mini"
+# Replies to repeated prompts (texts.prompt_cache): entries in the
+# per-process LRU, seconds an entry lives, and an optional CACHES alias
+# shared by every worker (e.g. a Redis or memcached backend)
+TEXT_PROMPT_CACHE_SIZE = 1024
+TEXT_PROMPT_CACHE_TTL = 24 * 60 * 60
+TEXT_PROMPT_CACHE_ALIAS = None
+# Conversation context sent with each completion (texts.context): the newest
+# exchanges within this many tokens / turns, cached per user in this alias
+# for this many seconds. Point the alias at a cache shared by every worker
+# (Redis, memcached); with the per-process default, other workers see a new
+# message only once their cached window expires.
+TEXT_CONTEXT_TOKEN_BUDGET = 2000
+TEXT_CONTEXT_MAX_TURNS = 20
+TEXT_CONTEXT_CACHE_ALIAS = "default"
+TEXT_CONTEXT_CACHE_TTL = 5 * 60
+
+# Closed tickets inactive for this many days are moved to the archive tables
+# by `manage.py archive_tickets` (run it periodically, e.g. --forever)
+TICKET_ARCHIVE_AFTER_DAYS = 365
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
@@ -149,9 +217,17 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 AUTH_USER_MODEL = "accounts.User"
 
 PASSWORD_HASHERS = [
-    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
-    "django.contrib.auth.hashers.PBKDF2PasswordHasher",
-    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
-    "django.contrib.auth.hashers.Argon2PasswordHasher",
-    "django.contrib.auth.hashers.ScryptPasswordHasher",
+    "accounts.hashers.BCryptSHA256PasswordHasher",
+    "accounts.hashers.PBKDF2PasswordHasher",
+    "accounts.hashers.PBKDF2SHA1PasswordHasher",
+    "accounts.hashers.Argon2PasswordHasher",
+    "accounts.hashers.ScryptPasswordHasher",
 ]
+
+# Work factors per hasher algorithm, e.g. {"bcrypt_sha256": {"rounds": 10}}.
+# Generate with `manage.py calibrate_hashers --target-ms <budget>`; stored
+# hashes are upgraded to these on the next successful login.
+PASSWORD_HASHER_COSTS = {}
+
+# Max concurrent password hash checks under ASGI (defaults to the CPU count)
+PASSWORD_HASH_WORKERS = None
@@ -0,0 +1,227 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from tickets.events import get_broker
+
+from . import context, prompt_cache
+from .models import Text
+
+logger = logging.getLogger(__name__)
+
+# Text.chatgpt_input is a CharField(max_length=2048)
+MAX_COMPLETION_CHARS = 2048
+
+
+def text_channel(text_id):
+    return f"text:{text_id}"
+
+
+class StubBackend:
+    # Deterministic local model for development and tests: answers with the
+    # prompt echoed back, one word per token. The history is ignored, so
+    # cached replies are shared whatever was said before.
+    delay = 0
+    uses_history = False
+
+    def stream(self, prompt, history=()):
+        words = f"You said: {prompt}".split()
+        for index, word in enumerate(words):
+            if self.delay:
+                time.sleep(self.delay)
+            yield word if index == len(words) - 1 else f"{word} "
+
+
+class ChatCompletionsBackend:
+    # Streams from an OpenAI-compatible /chat/completions endpoint, configured
+    # by TEXT_COMPLETION_API_URL, TEXT_COMPLETION_MODEL and the
+    # TEXT_COMPLETION_API_KEY environment variable
+    timeout = 60
+    uses_history = True
+
+    def __init__(self):
+        self.url = settings.TEXT_COMPLETION_API_URL
+        self.model = settings.TEXT_COMPLETION_MODEL
+        self.api_key = os.environ.get("TEXT_COMPLETION_API_KEY", "")
+
+    def stream(self, prompt, history=()):
+        import requests
+
+        messages = []
+        for user_input, reply in history:
+            messages.append({"role": "user", "content": user_input})
+            messages.append({"role": "assistant", "content": reply})
+        messages.append({"role": "user", "content": prompt})
+
+        response = requests.post(
+            self.url,
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            json={
+                "model": self.model,
+                "messages": messages,
+                "stream": True,
+            },
+            stream=True,
+            timeout=self.timeout,
+        )
+        with response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                payload = line[len("data:") :].strip()
+                if payload == "[DONE]":
+                    return
+                choices = json.loads(payload).get("choices") or [{}]
+                token = choices[0].get("delta", {}).get("content")
+                if token:
+                    yield token
+
+
+_backend = None
+_executor = None
+_lock = threading.Lock()
+
+# Tokens generated so far by the jobs running in this process, so a stream
+# opened mid-completion starts from the beginning
+_partials = {}
+
+
+def get_backend():
+    global _backend
+    with _lock:
+        if _backend is None:
+            _backend = import_string(settings.TEXT_COMPLETION_BACKEND)()
+        return _backend
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "TEXT_COMPLETION_WORKERS", 4),
+                thread_name_prefix="completion",
+            )
+        return _executor
+
+
+def reset_backend():
+    # Drop the cached backend, e.g. after overriding TEXT_COMPLETION_BACKEND
+    global _backend
+    with _lock:
+        _backend = None
+
+
+def partial_tokens(text_id):
+    with _lock:
+        return list(_partials.get(text_id, ()))
+
+
+def queue_completion(text_id):
+    # Hand the text to the worker pool once the row is committed
+    transaction.on_commit(lambda: get_executor().submit(run_in_worker, text_id))
+
+
+def run_in_worker(text_id):
+    try:
+        run_completion(text_id)
+    finally:
+        # Pool threads outlive requests; don't keep their connections open
+        close_old_connections()
+
+
+def publish(text_id, event, event_id, data):
+    try:
+        get_broker().publish(
+            text_channel(text_id), {"event": event, "id": event_id, "data": data}
+        )
+    except Exception:
+        # Streams fall back to the stored row; never fail the job
+        logger.exception("Could not publish %s for text %s", event, text_id)
+
+
+def save_reply(text_id, user_id, prompt, reply):
+    tokens = context.count_tokens(prompt, reply)
+    Text.objects.filter(pk=text_id).update(
+        chatgpt_input=reply,
+        token_count=tokens,
+        status=Text.DONE,
+        updated_at=timezone.now(),
+    )
+    context.forget_window(user_id)
+
+
+def run_completion(text_id):
+    # Fill Text.chatgpt_input for a pending text. Each token is published as
+    # a "token" event (id = token index), then one "done" or "error" event.
+    # Returns False if another worker got to the text first.
+    claimed = Text.objects.filter(pk=text_id, status=Text.PENDING).update(
+        status=Text.RUNNING, updated_at=timezone.now()
+    )
+    if not claimed:
+        return False
+    prompt, user_id = Text.objects.values_list("user_input", "user_id").get(pk=text_id)
+
+    history = context.build_context(user_id, before_id=text_id)
+    cached = prompt_cache.get_reply(prompt, history)
+    if cached is not None:
+        # Answered before: no model call
+        save_reply(text_id, user_id, prompt, cached)
+        publish(text_id, "token", 0, cached)
+        publish(text_id, "done", 1, {"chatgpt_input": cached})
+        return True
+
+    tokens = []
+    with _lock:
+        _partials[text_id] = tokens
+    try:
+        length = 0
+        for token in get_backend().stream(prompt, history):
+            token = token[: MAX_COMPLETION_CHARS - length]
+            if not token:
+                break
+            with _lock:
+                tokens.append(token)
+            length += len(token)
+            publish(text_id, "token", len(tokens) - 1, token)
+        completion = "".join(tokens)
+        save_reply(text_id, user_id, prompt, completion)
+        prompt_cache.set_reply(prompt, completion, history)
+        publish(text_id, "done", len(tokens), {"chatgpt_input": completion})
+    except Exception:
+        logger.exception("Completion failed for text %s", text_id)
+        Text.objects.filter(pk=text_id).update(
+            status=Text.FAILED, updated_at=timezone.now()
+        )
+        publish(text_id, "error", len(tokens), {"error": "Completion failed."})
+    finally:
+        with _lock:
+            _partials.pop(text_id, None)
+    return True
+
+
+def requeue_stale(timeout=None):
+    # Texts left running by a worker that died go back to pending
+    if timeout is None:
+        timeout = getattr(settings, "TEXT_COMPLETION_TIMEOUT", 300)
+    return Text.objects.filter(
+        status=Text.RUNNING, updated_at__lt=timezone.now() - timedelta(seconds=timeout)
+    ).update(status=Text.PENDING, updated_at=timezone.now())
+
+
+def pending_text_ids(limit):
+    return list(
+        Text.objects.filter(status=Text.PENDING)
+        .order_by("created_at", "id")
+        .values_list("id", flat=True)[:limit]
+    )
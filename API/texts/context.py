@@ -0,0 +1,114 @@
+import re
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+# Conversation context for a completion: a user's newest exchanges that fit
+# a token budget. Every Text stores its token count (computed on write), so
+# a window is assembled from one narrow, index-backed LIMIT query. Windows
+# are cached per user under a version that every write bumps, and expire
+# after TEXT_CONTEXT_CACHE_TTL. TEXT_CONTEXT_CACHE_ALIAS should be shared by
+# all workers; with a per-process cache a write is only seen by the other
+# workers once their copy expires.
+TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+CACHE_KEY = "text-context:v2:{user_id}:{version}"
+VERSION_KEY = "text-context-version:{user_id}"
+
+
+def count_tokens(*texts):
+    # Word and punctuation pieces: close enough to BPE counts for budgeting,
+    # and stable, so stored counts never need recomputing
+    return sum(len(TOKEN_RE.findall(text or "")) for text in texts)
+
+
+def token_budget():
+    return getattr(settings, "TEXT_CONTEXT_TOKEN_BUDGET", 2000)
+
+
+def max_turns():
+    return getattr(settings, "TEXT_CONTEXT_MAX_TURNS", 20)
+
+
+def window_cache():
+    return caches[getattr(settings, "TEXT_CONTEXT_CACHE_ALIAS", "default")]
+
+
+def trim(turns):
+    # Newest turns first until the budget or the turn limit is reached;
+    # returned oldest first
+    budget, limit = token_budget(), max_turns()
+    kept, used = [], 0
+    for turn in reversed(turns):
+        if len(kept) >= limit or used + turn["tokens"] > budget:
+            break
+        kept.append(turn)
+        used += turn["tokens"]
+    kept.reverse()
+    return kept
+
+
+def load_window(user_id):
+    # Newest-first LIMIT on text_user_created_idx, four columns only
+    from .models import Text
+
+    rows = list(
+        Text.objects.filter(user_id=user_id)
+        .order_by("-created_at", "-id")
+        .values_list("id", "user_input", "chatgpt_input", "token_count")[: max_turns()]
+    )
+    turns = [
+        {"id": text_id, "user_input": user_input, "reply": reply, "tokens": tokens}
+        for text_id, user_input, reply, tokens in reversed(rows)
+    ]
+    return trim(turns)
+
+
+def window_timeout():
+    return getattr(settings, "TEXT_CONTEXT_CACHE_TTL", 5 * 60)
+
+
+def window_version(cache, user_id):
+    key = VERSION_KEY.format(user_id=user_id)
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock, so a lost counter never brings back the
+        # windows of an earlier version
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def get_window(user_id):
+    cache = window_cache()
+    key = CACHE_KEY.format(user_id=user_id, version=window_version(cache, user_id))
+    turns = cache.get(key)
+    if turns is None:
+        turns = load_window(user_id)
+        cache.set(key, turns, window_timeout())
+    return turns
+
+
+def forget_window(user_id):
+    # Every committed insert, reply, edit and delete: readers move on to a
+    # new version and rebuild the window from one LIMIT query. incr() is
+    # atomic on shared caches, so concurrent writes never lose a turn.
+    try:
+        window_cache().incr(VERSION_KEY.format(user_id=user_id))
+    except ValueError:
+        # No counter: nothing cached for this user can be read back
+        pass
+
+
+def exchanges(turns):
+    # [(user_input, reply), ...] of the answered turns, in order
+    return [(turn["user_input"], turn["reply"]) for turn in turns if turn["reply"]]
+
+
+def build_context(user_id, before_id=None):
+    # The answered exchanges preceding `before_id` that fit the token budget,
+    # oldest first
+    turns = get_window(user_id)
+    if before_id is not None:
+        turns = [turn for turn in turns if turn["id"] < before_id]
+    return exchanges(turns)
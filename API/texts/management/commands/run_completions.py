@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from texts.completions import pending_text_ids, requeue_stale, run_completion
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate the replies of pending texts, e.g. those queued before a "
+        "restart, and put texts stuck in running back in the queue."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--forever", action="store_true", help="keep polling every --interval"
+        )
+        parser.add_argument("--interval", type=int, default=5)
+
+    def handle(self, *args, **options):
+        while True:
+            requeued = requeue_stale()
+            if requeued:
+                self.stdout.write(f"Requeued {requeued} stale text(s)")
+            completed = 0
+            while True:
+                text_ids = pending_text_ids(options["batch_size"])
+                for text_id in text_ids:
+                    completed += run_completion(text_id)
+                if len(text_ids) < options["batch_size"]:
+                    break
+            self.stdout.write(f"Completed {completed} text(s)")
+
+            if not options["forever"]:
+                break
+            time.sleep(options["interval"])
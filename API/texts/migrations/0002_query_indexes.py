@@ -0,0 +1,17 @@
+# Generated by Django 4.0.10 on 2026-10-18 06:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('texts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='text',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='text_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.0.10 on 2026-10-18 07:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('texts', '0002_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='text',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='done', max_length=16),
+        ),
+        migrations.AddIndex(
+            model_name='text',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['created_at', 'id'], name='text_pending_idx'),
+        ),
+    ]
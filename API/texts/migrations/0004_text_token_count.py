@@ -0,0 +1,35 @@
+# Generated by Django 4.0.10 on 2026-10-18 07:27
+
+from django.db import migrations, models
+
+from texts.context import count_tokens
+
+
+def backfill_token_counts(apps, schema_editor):
+    Text = apps.get_model("texts", "Text")
+    batch = []
+    rows = Text.objects.values_list("id", "user_input", "chatgpt_input")
+    for text_id, user_input, chatgpt_input in rows.iterator(chunk_size=2000):
+        batch.append(
+            Text(id=text_id, token_count=count_tokens(user_input, chatgpt_input))
+        )
+        if len(batch) >= 2000:
+            Text.objects.bulk_update(batch, ["token_count"])
+            batch = []
+    Text.objects.bulk_update(batch, ["token_count"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('texts', '0003_text_completion_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='text',
+            name='token_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_token_counts, migrations.RunPython.noop),
+    ]
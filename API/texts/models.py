@@ -1,13 +1,60 @@
-from django.db import models
+from django.db import models, transaction
 from accounts.models import User
 
+from . import context
+
 # from django.contrib.auth.models import User
 
 
 # Create your models here.
 class Text(models.Model):
+    # Completion state of chatgpt_input (see texts.completions)
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
     user_input = models.CharField(max_length=2048)
     chatgpt_input = models.CharField(max_length=2048, blank=True, null=True)
+    status = models.CharField(
+        max_length=16,
+        choices=(
+            (PENDING, "Pending"),
+            (RUNNING, "Running"),
+            (DONE, "Done"),
+            (FAILED, "Failed"),
+        ),
+        default=DONE,
+    )
+    # count_tokens(user_input, chatgpt_input), kept on write (texts.context)
+    token_count = models.PositiveIntegerField(default=0)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True, db_column="timestamp")
     updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # chat history: user_id = ? ORDER BY created_at DESC
+            models.Index(
+                fields=["user", "created_at", "id"],
+                name="text_user_created_idx",
+            ),
+            # run_completions picks up pending texts oldest first
+            models.Index(
+                fields=["created_at", "id"],
+                name="text_pending_idx",
+                condition=models.Q(status="pending"),
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.token_count = context.count_tokens(self.user_input, self.chatgpt_input)
+        super().save(*args, **kwargs)
+        # The user's cached context window follows the committed rows
+        transaction.on_commit(lambda: context.forget_window(self.user_id))
+
+    def delete(self, *args, **kwargs):
+        user_id = self.user_id
+        result = super().delete(*args, **kwargs)
+        transaction.on_commit(lambda: context.forget_window(user_id))
+        return result
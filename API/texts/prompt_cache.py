@@ -0,0 +1,143 @@
+import hashlib
+import json
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+# Replies to prompts already answered, keyed by a hash of the normalized
+# prompt and the completion backend, plus the conversation history it was
+# answered with when the backend sends history to the model (`uses_history`).
+# With such a backend a reply is only reused after the very same history,
+# which in practice means prompts asked with no earlier exchanges (e.g. a
+# patient's first question). Two tiers: a bounded in-process LRU and, with
+# TEXT_PROMPT_CACHE_ALIAS set, a Django cache shared by all workers. Both
+# expire entries after TEXT_PROMPT_CACHE_TTL seconds.
+KEY_PREFIX = "prompt:v2:"
+TRAILING_PUNCTUATION = "?!.,;: "
+
+_lock = threading.Lock()
+_entries = OrderedDict()
+_metrics = Counter()
+
+
+def normalize_prompt(prompt):
+    # "What is a  normal Blood Pressure?" == "what is a normal blood pressure"
+    prompt = unicodedata.normalize("NFKC", prompt or "").casefold()
+    return " ".join(prompt.split()).rstrip(TRAILING_PUNCTUATION)
+
+
+def history_digest(history):
+    # The reply depends on the exchanges sent along with the prompt (see
+    # texts.context), so a reply is only reused for the very same history:
+    # one patient's chat never shapes the answer another one gets
+    return hashlib.sha256(
+        json.dumps([list(turn) for turn in history]).encode()
+    ).hexdigest()
+
+
+def backend_uses_history():
+    # Backends that answer from the prompt alone set uses_history = False
+    backend = import_string(settings.TEXT_COMPLETION_BACKEND)
+    return getattr(backend, "uses_history", True)
+
+
+def prompt_key(prompt, history=()):
+    # Different backends or models must not share replies
+    identity = "|".join(
+        [
+            settings.TEXT_COMPLETION_BACKEND,
+            getattr(settings, "TEXT_COMPLETION_MODEL", ""),
+            history_digest(history) if backend_uses_history() else "",
+            normalize_prompt(prompt),
+        ]
+    )
+    return KEY_PREFIX + hashlib.sha256(identity.encode()).hexdigest()
+
+
+def ttl():
+    return getattr(settings, "TEXT_PROMPT_CACHE_TTL", 24 * 60 * 60)
+
+
+def shared_cache():
+    alias = getattr(settings, "TEXT_PROMPT_CACHE_ALIAS", None)
+    return caches[alias] if alias else None
+
+
+def remember_locally(key, reply, expires_at):
+    max_entries = getattr(settings, "TEXT_PROMPT_CACHE_SIZE", 1024)
+    with _lock:
+        _entries[key] = (reply, expires_at)
+        _entries.move_to_end(key)
+        while len(_entries) > max_entries:
+            _entries.popitem(last=False)
+            _metrics["evictions"] += 1
+
+
+def get_reply(prompt, history=()):
+    # The cached reply to `prompt` asked after `history` (build_context()), or
+    # None
+    key = prompt_key(prompt, history)
+    now = time.time()
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            if entry[1] > now:
+                _entries.move_to_end(key)
+                _metrics["local_hits"] += 1
+                return entry[0]
+            del _entries[key]
+
+    cache = shared_cache()
+    entry = cache.get(key) if cache is not None else None
+    if entry is None or entry[1] <= now:
+        with _lock:
+            _metrics["misses"] += 1
+        return None
+    # Promoted with the shared entry's own expiry
+    reply = entry[0]
+    remember_locally(key, reply, entry[1])
+    with _lock:
+        _metrics["shared_hits"] += 1
+    return reply
+
+
+def set_reply(prompt, reply, history=()):
+    key = prompt_key(prompt, history)
+    timeout = ttl()
+    expires_at = time.time() + timeout
+    remember_locally(key, reply, expires_at)
+    cache = shared_cache()
+    if cache is not None:
+        cache.set(key, (reply, expires_at), timeout)
+    with _lock:
+        _metrics["stores"] += 1
+
+
+def metrics():
+    # Counters of this process since start (or clear())
+    with _lock:
+        result = {
+            name: _metrics[name]
+            for name in ("local_hits", "shared_hits", "misses", "stores", "evictions")
+        }
+        result["entries"] = len(_entries)
+    lookups = result["local_hits"] + result["shared_hits"] + result["misses"]
+    result["hit_rate"] = (
+        round((result["local_hits"] + result["shared_hits"]) / lookups, 4)
+        if lookups
+        else None
+    )
+    return result
+
+
+def clear():
+    # Empties the local tier and resets the metrics (the shared tier is left
+    # to its TTL)
+    with _lock:
+        _entries.clear()
+        _metrics.clear()
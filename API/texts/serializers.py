@@ -10,7 +10,25 @@ class TextSerializer(serializers.ModelSerializer):
             "user_input",
             "chatgpt_input",
             "user_id",
+            "status",
         ]
+        read_only_fields = ["status"]
 
     chatgpt_input = serializers.CharField(required=False)
     user_id = serializers.CharField(required=True)
+
+
+# Columns read by the list view's values() path
+TEXT_ROW_FIELDS = ("id", "user_input", "chatgpt_input", "user_id", "status")
+
+
+def text_row(row):
+    # TextSerializer's output for a values() row, without building a model
+    # instance or running field serializers per message
+    return {
+        "id": row["id"],
+        "user_input": row["user_input"],
+        "chatgpt_input": row["chatgpt_input"],
+        "user_id": str(row["user_id"]),
+        "status": row["status"],
+    }
@@ -0,0 +1,171 @@
+import asyncio
+import re
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from accounts.authentication import ClaimsJWTAuthentication
+from tickets.events import SubscriberOverflow, get_broker
+from tickets.sse import (
+    RETRY_MS,
+    database_sync_to_async,
+    encode_event,
+    last_event_id,
+    request_token,
+    send_json,
+    wait_for_disconnect,
+)
+
+from .completions import partial_tokens, text_channel
+from .models import Text
+
+STREAM_PATH_RE = re.compile(r"^/api/texts/(?P<text_id>\d+)/stream/$")
+ERRORS = {
+    401: {"detail": "Given token not valid for any token type"},
+    403: {"error": "Access Denied"},
+    404: {"error": "Text not found."},
+}
+
+
+def authorize(raw_token, text_id):
+    # Only the text's owner may follow its completion
+    authentication = ClaimsJWTAuthentication()
+    try:
+        user = authentication.get_user(authentication.get_validated_token(raw_token))
+    except (InvalidToken, AuthenticationFailed):
+        return 401
+
+    owner_id = Text.objects.filter(pk=text_id).values_list("user_id", flat=True).first()
+    if owner_id is None:
+        return 404
+    if user.id != owner_id:
+        return 403
+    return None
+
+
+def completion_state(text_id):
+    # (tokens generated so far in this process, final event or None)
+    tokens = partial_tokens(text_id)
+    text = Text.objects.filter(pk=text_id).values("status", "chatgpt_input").first()
+    if text is None or text["status"] == Text.FAILED:
+        return tokens, {"event": "error", "data": {"error": "Completion failed."}}
+    if text["status"] == Text.DONE:
+        return tokens, {
+            "event": "done",
+            "data": {"chatgpt_input": text["chatgpt_input"] or ""},
+        }
+    return tokens, None
+
+
+async def text_stream(scope, receive, send, text_id):
+    # GET /api/texts/<id>/stream/ -- the reply to a text as it is generated:
+    # one "token" event per token (id = token index), then "done" with the
+    # whole reply, or "error". Reconnecting with Last-Event-ID skips the
+    # tokens already received; a finished text answers with "done" at once.
+    if scope["method"] != "GET":
+        await send_json(
+            send, 405, {"detail": 'Method "%s" not allowed.' % scope["method"]}
+        )
+        return
+
+    headers = dict(scope["headers"])
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    raw_token = request_token(headers, query)
+    if not raw_token:
+        await send_json(
+            send, 401, {"detail": "Authentication credentials were not provided."}
+        )
+        return
+    error = await database_sync_to_async(authorize)(raw_token, text_id)
+    if error:
+        await send_json(send, error, ERRORS[error])
+        return
+
+    since = last_event_id(headers, query)
+    last_sent = -1 if since is None else since
+    heartbeat = settings.TICKET_EVENTS_HEARTBEAT
+
+    async def send_body(body, more_body=True):
+        await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+    # Subscribe before reading the state so no token falls in between; the
+    # token indexes drop the duplicates
+    async with get_broker().subscribe(text_channel(text_id)) as subscription:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no"),
+                ],
+            }
+        )
+        await send_body(f"retry: {RETRY_MS}\n\n".encode())
+
+        tokens, final = await database_sync_to_async(completion_state)(text_id)
+        if final is not None:
+            final["id"] = len(tokens)
+            await send_body(encode_event(final), more_body=False)
+            return
+        for index, token in enumerate(tokens):
+            if index > last_sent:
+                await send_body(
+                    encode_event({"event": "token", "id": index, "data": token})
+                )
+                last_sent = index
+
+        disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+        try:
+            while True:
+                get = asyncio.ensure_future(subscription.get())
+                done, _ = await asyncio.wait(
+                    {get, disconnect},
+                    timeout=heartbeat,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if disconnect in done:
+                    get.cancel()
+                    return
+                if get not in done:
+                    get.cancel()
+                    # The job may have run in a process this broker does not
+                    # reach; the row has the answer then
+                    _, final = await database_sync_to_async(completion_state)(text_id)
+                    if final is not None:
+                        final["id"] = last_sent + 1
+                        await send_body(encode_event(final), more_body=False)
+                        return
+                    await send_body(b": keepalive\n\n")
+                    continue
+
+                message = get.result()
+                if message["event"] == "token":
+                    if message["id"] <= last_sent:
+                        continue
+                    last_sent = message["id"]
+                    await send_body(encode_event(message))
+                else:
+                    await send_body(encode_event(message), more_body=False)
+                    return
+        except SubscriberOverflow:
+            # Reconnect with Last-Event-ID to resume
+            await send_body(b"", more_body=False)
+        finally:
+            disconnect.cancel()
+
+
+def text_stream_router(application):
+    # Serves the completion streams, passes everything else through
+    async def router(scope, receive, send):
+        if scope["type"] == "http":
+            match = STREAM_PATH_RE.match(scope["path"])
+            if match:
+                await text_stream(scope, receive, send, int(match["text_id"]))
+                return
+        await application(scope, receive, send)
+
+    return router
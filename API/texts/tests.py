@@ -1,3 +1,390 @@
-from django.test import TestCase
+import json
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.core.cache import caches
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from accounts.models import RegUser
+from accounts.serializers import MyTokenObtainPairSerializer
+from texts import prompt_cache
+from texts.completions import (
+    StubBackend,
+    get_backend,
+    reset_backend,
+    run_completion,
+)
+from texts.context import build_context, count_tokens
+from texts.models import Text
+from texts.serializers import TextSerializer
+from texts.views import CustomPagination
+from texts.sse import text_stream_router
+from tickets.events import reset_broker
+
+
+class HistoryStubBackend(StubBackend):
+    # A stub whose answers depend on the history, like a real model
+    uses_history = True
+
+
+class TextCompletionTest(TestCase):
+    def setUp(self):
+        reset_backend()
+        prompt_cache.clear()
+        self.user = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+        token = MyTokenObtainPairSerializer.get_token(self.user).access_token
+        self.auth = {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+
+    def test_create_queues_a_completion(self):
+        response = self.client.post(
+            "/api/texts/create/", {"user_input": "hello there"}, **self.auth
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["status"], Text.PENDING)
+
+        text_id = response.json()["id"]
+        self.assertTrue(run_completion(text_id))
+        self.assertFalse(run_completion(text_id))
+        text = Text.objects.get(pk=text_id)
+        self.assertEqual(text.status, Text.DONE)
+        self.assertEqual(text.chatgpt_input, "You said: hello there")
+
+    def test_client_supplied_reply_is_kept(self):
+        response = self.client.post(
+            "/api/texts/create/",
+            {"user_input": "hi", "chatgpt_input": "hello"},
+            **self.auth,
+        )
+        self.assertEqual(response.json()["status"], Text.DONE)
+        self.assertEqual(response.json()["chatgpt_input"], "hello")
+
+
+@override_settings(TEXT_PROMPT_CACHE_SIZE=2)
+class PromptCacheTest(TestCase):
+    def setUp(self):
+        caches["default"].clear()
+        reset_backend()
+        prompt_cache.clear()
+        self.addCleanup(prompt_cache.clear)
+        self.user = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+        token = MyTokenObtainPairSerializer.get_token(self.user).access_token
+        self.auth = {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+
+    def other_user(self):
+        user = RegUser.objects.create_reguser(
+            "other@example.com", "Other", "pass1234", is_med_user=False
+        )
+        token = MyTokenObtainPairSerializer.get_token(user).access_token
+        return user, {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+
+    def ask(self, prompt, auth):
+        # Commit hooks run (context window), the completion runs here
+        with mock.patch("texts.views.queue_completion"):
+            with self.captureOnCommitCallbacks(execute=True):
+                text = self.client.post(
+                    "/api/texts/create/", {"user_input": prompt}, **auth
+                ).json()
+        if text["status"] == Text.PENDING:
+            run_completion(text["id"])
+            text = TextSerializer(Text.objects.get(pk=text["id"])).data
+        return text
+
+    def test_repeated_prompt_is_answered_from_the_cache(self):
+        self.ask("Normal blood pressure?", self.auth)
+
+        _, auth = self.other_user()
+        response = self.client.post(
+            "/api/texts/create/", {"user_input": "normal  BLOOD pressure"}, **auth
+        )
+        self.assertEqual(response.json()["status"], Text.DONE)
+        self.assertEqual(
+            response.json()["chatgpt_input"], "You said: Normal blood pressure?"
+        )
+        self.assertEqual(prompt_cache.metrics()["local_hits"], 1)
+
+    def test_history_is_ignored_when_the_backend_ignores_it(self):
+        _, other_auth = self.other_user()
+        self.ask("I have a cough", self.auth)
+        self.ask("My knee hurts", other_auth)
+
+        self.ask("What is a normal blood pressure?", self.auth)
+        text = self.ask("what is a normal blood pressure", other_auth)
+        self.assertEqual(
+            text["chatgpt_input"], "You said: What is a normal blood pressure?"
+        )
+        self.assertEqual(prompt_cache.metrics()["local_hits"], 1)
+
+    @override_settings(TEXT_COMPLETION_BACKEND="texts.tests.HistoryStubBackend")
+    def test_first_questions_are_shared_with_a_history_backend(self):
+        _, other_auth = self.other_user()
+        self.ask("What is a normal blood pressure?", self.auth)
+        text = self.ask("What is a normal blood pressure?", other_auth)
+        self.assertEqual(text["status"], Text.DONE)
+        self.assertEqual(prompt_cache.metrics()["local_hits"], 1)
+
+    @override_settings(TEXT_COMPLETION_BACKEND="texts.tests.HistoryStubBackend")
+    def test_replies_are_not_shared_across_histories(self):
+        _, other_auth = self.other_user()
+        self.ask("I have diabetes", self.auth)
+        self.ask("I am pregnant", other_auth)
+
+        calls = []
+        backend = get_backend()
+        stream = backend.stream
+
+        def recording_stream(prompt, history=()):
+            calls.append(list(history))
+            return stream(prompt, history)
+
+        with mock.patch.object(backend, "stream", recording_stream):
+            first = self.ask("Is ibuprofen safe?", self.auth)
+            second = self.ask("Is ibuprofen safe?", other_auth)
+
+        self.assertEqual(first["status"], Text.DONE)
+        self.assertEqual(second["status"], Text.DONE)
+        # Both generated, each with its own patient's history
+        self.assertEqual(
+            calls,
+            [
+                [("I have diabetes", "You said: I have diabetes")],
+                [("I am pregnant", "You said: I am pregnant")],
+            ],
+        )
+        self.assertEqual(prompt_cache.metrics()["local_hits"], 0)
+
+        # The same user asking again after the same history is a hit
+        self.assertEqual(
+            prompt_cache.get_reply(
+                "is ibuprofen safe", [("I have diabetes", "You said: I have diabetes")]
+            ),
+            "You said: Is ibuprofen safe?",
+        )
+
+    def test_lru_and_ttl_eviction(self):
+        for prompt in ("a", "b", "c"):
+            prompt_cache.set_reply(prompt, prompt.upper())
+        self.assertIsNone(prompt_cache.get_reply("a"))
+        self.assertEqual(prompt_cache.get_reply("c"), "C")
+        self.assertEqual(prompt_cache.metrics()["evictions"], 1)
+
+        with override_settings(TEXT_PROMPT_CACHE_TTL=-1):
+            prompt_cache.set_reply("d", "D")
+        self.assertIsNone(prompt_cache.get_reply("d"))
+
+
+class TextBatchCreateTest(TestCase):
+    def setUp(self):
+        reset_backend()
+        prompt_cache.clear()
+        self.addCleanup(prompt_cache.clear)
+        self.user = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+        token = MyTokenObtainPairSerializer.get_token(self.user).access_token
+        self.auth = {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+
+    def test_batch_reports_each_item(self):
+        caches["default"].clear()
+        # Asked after the batch's first exchange
+        prompt_cache.set_reply("cached question", "cached answer", [("hi", "hello")])
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(
+                "/api/texts/batch-create/",
+                [
+                    {"user_input": "hi", "chatgpt_input": "hello"},
+                    {"chatgpt_input": "no prompt"},
+                    {"user_input": "Cached question?"},
+                    {"user_input": "new question"},
+                ],
+                content_type="application/json",
+                **self.auth,
+            )
+        self.assertEqual(response.status_code, 207)
+        results = response.json()["results"]
+        self.assertEqual([result["status"] for result in results], [201, 400, 201, 201])
+        self.assertIn("user_input", results[1]["errors"])
+        self.assertEqual(
+            [results[i]["data"]["status"] for i in (0, 2, 3)],
+            [Text.DONE, Text.DONE, Text.PENDING],
+        )
+        self.assertEqual(results[2]["data"]["chatgpt_input"], "cached answer")
+        # forget_window plus one completion job
+        self.assertEqual(len(callbacks), 2)
+
+        text = Text.objects.get(pk=results[0]["data"]["id"])
+        self.assertEqual(text.token_count, count_tokens("hi", "hello"))
+        self.assertTrue(run_completion(results[3]["data"]["id"]))
+
+    def test_all_invalid_batch_is_rejected(self):
+        response = self.client.post(
+            "/api/texts/batch-create/",
+            [{}],
+            content_type="application/json",
+            **self.auth,
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Text.objects.exists())
+
+
+class TextContextTest(TestCase):
+    def setUp(self):
+        caches["default"].clear()
+        prompt_cache.clear()
+        self.user = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+
+    def exchange(self, user_input):
+        with self.captureOnCommitCallbacks(execute=True):
+            text = Text.objects.create(
+                user=self.user, user_input=user_input, status=Text.PENDING
+            )
+        run_completion(text.id)
+        return text
+
+    def test_window_is_cached_until_the_next_write(self):
+        first = self.exchange("one")
+        self.assertEqual(first.token_count, 1)
+        self.assertEqual(build_context(self.user.id), [("one", "You said: one")])
+        with self.assertNumQueries(0):
+            build_context(self.user.id)
+
+        # Insert and reply each move the window to a new version
+        second = self.exchange("two")
+        with self.assertNumQueries(1):
+            context = build_context(self.user.id, before_id=second.id + 1)
+        self.assertEqual(context, [("one", "You said: one"), ("two", "You said: two")])
+        self.assertEqual(
+            Text.objects.get(pk=second.id).token_count,
+            count_tokens("two", context[1][1]),
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Text.objects.get(pk=first.id).delete()
+        self.assertEqual(build_context(self.user.id), [("two", "You said: two")])
+
+    def test_windows_expire(self):
+        cache = caches["default"]
+        with mock.patch.object(cache, "set", wraps=cache.set) as cache_set:
+            build_context(self.user.id)
+        self.assertEqual(cache_set.call_args.args[2], 5 * 60)
+
+    def test_interleaved_creates_keep_every_turn(self):
+        # Both inserts commit after the window was read; neither is lost
+        build_context(self.user.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            Text.objects.create(user=self.user, user_input="a", chatgpt_input="A")
+            Text.objects.create(user=self.user, user_input="b", chatgpt_input="B")
+        self.assertEqual(build_context(self.user.id), [("a", "A"), ("b", "B")])
+
+    @override_settings(TEXT_CONTEXT_TOKEN_BUDGET=12)
+    def test_budget_keeps_the_newest_exchanges(self):
+        for prompt in ("one", "two", "three"):
+            self.exchange(prompt)
+        self.assertEqual(
+            [user_input for user_input, _ in build_context(self.user.id)],
+            ["two", "three"],
+        )
+
+
+class TextListTest(TestCase):
+    def setUp(self):
+        self.user = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+        token = MyTokenObtainPairSerializer.get_token(self.user).access_token
+        self.auth = {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+        self.texts = [
+            Text.objects.create(user=self.user, user_input=str(i), chatgpt_input="ok")
+            for i in range(5)
+        ]
+
+    def test_rows_match_the_serializer(self):
+        response = self.client.get("/api/texts/user/", **self.auth)
+        expected = TextSerializer(reversed(self.texts), many=True).data
+        self.assertEqual(response.json()["results"], expected)
+
+    def test_page_size_is_bounded(self):
+        response = self.client.get("/api/texts/user/?perpage=100000", **self.auth)
+        self.assertEqual(len(response.json()["results"]), 5)
+        self.assertEqual(CustomPagination.max_page_size, 100)
+
+    def test_cursor_pages_walk_back_through_history(self):
+        url = "/api/texts/user/?pagination=cursor&perpage=2"
+        seen = []
+        while url:
+            with self.assertNumQueries(1):
+                data = self.client.get(url, **self.auth).json()
+            seen += [row["user_input"] for row in data["results"]]
+            url = data["next"]
+        self.assertEqual(seen, ["4", "3", "2", "1", "0"])
+
+
+class TextStreamTest(TransactionTestCase):
+    def setUp(self):
+        reset_broker()
+        reset_backend()
+        prompt_cache.clear()
+        self.addCleanup(reset_broker)
+        self.user = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+        self.text = Text.objects.create(
+            user=self.user, user_input="hello there", status=Text.PENDING
+        )
+        self.app = text_stream_router(None)
+
+    def open_stream(self):
+        token = str(MyTokenObtainPairSerializer.get_token(self.user).access_token)
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": f"/api/texts/{self.text.id}/stream/",
+            "query_string": f"token={token}".encode(),
+            "headers": [],
+        }
+        return ApplicationCommunicator(self.app, scope)
+
+    async def read_events(self, communicator):
+        events = []
+        while True:
+            message = await communicator.receive_output(2)
+            body = message["body"].decode()
+            if body.startswith("id:"):
+                lines = dict(line.split(": ", 1) for line in body.strip().split("\n"))
+                events.append((lines["event"], json.loads(lines["data"])))
+            if not message.get("more_body"):
+                return events
+
+    async def test_tokens_are_streamed_while_generated(self):
+        communicator = self.open_stream()
+        await communicator.send_input({"type": "http.request"})
+        start = await communicator.receive_output(2)
+        self.assertEqual(start["status"], 200)
+        await communicator.receive_output(2)  # retry hint
+
+        await sync_to_async(run_completion)(self.text.id)
+        events = await self.read_events(communicator)
+        self.assertEqual(
+            events,
+            [
+                ("token", "You "),
+                ("token", "said: "),
+                ("token", "hello "),
+                ("token", "there"),
+                ("done", {"chatgpt_input": "You said: hello there"}),
+            ],
+        )
+
+    async def test_finished_text_answers_at_once(self):
+        await sync_to_async(run_completion)(self.text.id)
+        communicator = self.open_stream()
+        await communicator.send_input({"type": "http.request"})
+        await communicator.receive_output(2)
+        events = await self.read_events(communicator)
+        self.assertEqual(events, [("done", {"chatgpt_input": "You said: hello there"})])
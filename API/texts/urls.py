@@ -7,4 +7,5 @@ urlpatterns = [
     path("<int:pk>/", TextDetailAPIView.as_view()),
     path("user/", TextListView.as_view(), name="paginated-text-list"),
     path("create/", TextCreateView.as_view()),
+    path("batch-create/", TextBatchCreateView.as_view()),
 ]
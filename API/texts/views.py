@@ -7,110 +7,175 @@ from rest_framework.views import APIView
 from rest_framework.generics import ListAPIView
 from rest_framework.pagination import PageNumberPagination
 from rest_framework import generics
-from django.db.models import F
-from accounts.serializers import OnlyUserProfileSerializer
+from accounts.permissions import IsRegUser
 from .serializers import *
 from .models import *
 from rest_framework.permissions import IsAuthenticated
+from django.db import transaction
+from api.batch import batch_items, batch_response, validate_batch
+from api.conditional import ConditionalGet
+from api.pagination import KeysetPagination, select_paginator
+from . import context, prompt_cache
+from .completions import queue_completion
 
 
 class TextCreateView(APIView):
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, IsRegUser]
 
     def post(self, request, format=None):
-        serializer = OnlyUserProfileSerializer(request.user)
-        if not serializer["is_med_user"].value:
-            user_id = serializer["id"].value
-            # Serialize the RegUser data
-            data = request.data.copy()
-            data["user_id"] = user_id
-
-            serializer = TextSerializer(data=data)
-
-            if serializer.is_valid():
+        user_id = request.user.id
+        # Serialize the RegUser data
+        data = request.data.copy()
+        data["user_id"] = user_id
+
+        serializer = TextSerializer(data=data)
+
+        if serializer.is_valid():
+            cached = None
+            if not serializer.validated_data.get("chatgpt_input"):
+                # Prompt answered before after the same conversation
+                # (texts.prompt_cache): done at once
+                cached = prompt_cache.get_reply(
+                    serializer.validated_data["user_input"],
+                    context.build_context(user_id),
+                )
+            if serializer.validated_data.get("chatgpt_input"):
+                # Reply supplied by the client, as before
                 serializer.save()
-                return Response(serializer.data, status=status.HTTP_201_CREATED)
+            elif cached is not None:
+                serializer.save(chatgpt_input=cached)
             else:
-                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
+                # The reply is generated by the completion workers; follow
+                # it on /api/texts/<id>/stream/ (ASGI only)
+                with transaction.atomic():
+                    text = serializer.save(status=Text.PENDING)
+                    queue_completion(text.id)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
         else:
-            return Response(
-                {"detail": "Access Denied"}, status=status.HTTP_403_FORBIDDEN
-            )
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class TextUpdateView(APIView):
-    permission_classes = [IsAuthenticated]
+class TextBatchCreateView(APIView):
+    permission_classes = [IsAuthenticated, IsRegUser]
 
-    def put(self, request, text_id, format=None):
-        serializer = OnlyUserProfileSerializer(request.user)
-        if not serializer["is_med_user"].value:
-            try:
-                text = Text.objects.get(pk=text_id)
-            except Text.DoesNotExist:
-                return Response(
-                    {"error": "Text not found."}, status=status.HTTP_404_NOT_FOUND
+    def post(self, request, format=None):
+        # A JSON array of TextCreateView bodies (at most MAX_BATCH_SIZE), e.g.
+        # messages queued while offline: one INSERT for the whole batch and a
+        # result per item
+        user_id = request.user.id
+        items, error = batch_items(request)
+        if error is not None:
+            return error
+
+        data = [
+            dict(item, user_id=user_id) if isinstance(item, dict) else item
+            for item in items
+        ]
+        validated, errors = validate_batch(TextSerializer(data=data, many=True))
+
+        texts = []
+        # The context window as each item will see it: the earlier items of
+        # the batch are part of its history
+        turns = context.get_window(user_id)
+        for item in validated:
+            if not item:
+                continue
+            text = Text(**dict(item, user_id=user_id))
+            if not text.chatgpt_input:
+                # Same as TextCreateView: cached reply, or generated later
+                text.chatgpt_input = prompt_cache.get_reply(
+                    text.user_input, context.exchanges(turns)
                 )
+                if text.chatgpt_input is None:
+                    text.status = Text.PENDING
+            # bulk_create skips Text.save()
+            text.token_count = context.count_tokens(text.user_input, text.chatgpt_input)
+            texts.append(text)
+            turns = context.trim(
+                turns
+                + [
+                    {
+                        "id": None,
+                        "user_input": text.user_input,
+                        "reply": text.chatgpt_input,
+                        "tokens": text.token_count,
+                    }
+                ]
+            )
+        if not texts:
+            return batch_response(errors, [])
 
-            user_id = serializer["id"].value
-            if text.user_id != user_id:
-                return Response(
-                    {"error": "User cannot update."},
-                    status=status.HTTP_403_FORBIDDEN,
-                )
+        with transaction.atomic():
+            texts = Text.objects.bulk_create(texts)
+            for text in texts:
+                if text.status == Text.PENDING:
+                    queue_completion(text.id)
+            transaction.on_commit(lambda: context.forget_window(user_id))
+        return batch_response(errors, TextSerializer(texts, many=True).data)
 
-            # Create the serializer with partial=True to allow partial updates
-            serializer = TextSerializer(text, data=request.data, partial=True)
 
-            if serializer.is_valid(raise_exception=True):
-                instance = serializer.save()
-                return Response(serializer.data)
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        else:
+class TextUpdateView(APIView):
+    permission_classes = [IsAuthenticated, IsRegUser]
+
+    def put(self, request, text_id, format=None):
+        try:
+            text = Text.objects.get(pk=text_id)
+        except Text.DoesNotExist:
             return Response(
-                {"detail": "Access Denied"}, status=status.HTTP_403_FORBIDDEN
+                {"error": "Text not found."}, status=status.HTTP_404_NOT_FOUND
             )
 
+        user_id = request.user.id
+        if text.user_id != user_id:
+            return Response(
+                {"error": "User cannot update."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
 
-class TextDeleteView(APIView):
-    permission_classes = [IsAuthenticated]
+        # Create the serializer with partial=True to allow partial updates
+        serializer = TextSerializer(text, data=request.data, partial=True)
 
-    def delete(self, request, text_id, format=None):
-        # Check if the user exists
-        serializer = OnlyUserProfileSerializer(request.user)
-
-        if not serializer["is_med_user"].value:
-            # Check if the ticket exists
-            try:
-                text = Text.objects.get(pk=text_id)
-            except Text.DoesNotExist:
-                return Response(
-                    {"error": "Text not found."}, status=status.HTTP_404_NOT_FOUND
-                )
+        if serializer.is_valid(raise_exception=True):
+            instance = serializer.save()
+            return Response(serializer.data)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-            # Ensure that the user is the owner of the ticket (if needed)
-            user_id = serializer["id"].value
-            if text.user_id != user_id:
-                return Response(
-                    {"error": "User cannot delete"},
-                    status=status.HTTP_403_FORBIDDEN,
-                )
 
-            text = Text.objects.get(pk=text_id)
+class TextDeleteView(APIView):
+    permission_classes = [IsAuthenticated, IsRegUser]
 
-            print("OK")
-            text.delete()
+    def delete(self, request, text_id, format=None):
+        # Check if the ticket exists
+        try:
+            text = Text.objects.get(pk=text_id)
+        except Text.DoesNotExist:
             return Response(
-                {"message": "Text deleted."}, status=status.HTTP_204_NO_CONTENT
+                {"error": "Text not found."}, status=status.HTTP_404_NOT_FOUND
             )
-        else:
+
+        # Ensure that the user is the owner of the ticket (if needed)
+        user_id = request.user.id
+        if text.user_id != user_id:
             return Response(
-                {"detail": "Access Denied"}, status=status.HTTP_403_FORBIDDEN
+                {"error": "User cannot delete"},
+                status=status.HTTP_403_FORBIDDEN,
             )
 
+        text = Text.objects.get(pk=text_id)
+
+        print("OK")
+        text.delete()
+        return Response({"message": "Text deleted."}, status=status.HTTP_204_NO_CONTENT)
+
 
 class CustomPagination(PageNumberPagination):
+    page_size = 20
     page_size_query_param = "perpage"  # Set the query parameter for page size
+    max_page_size = 100
+
+
+# newest first; also the keyset for ?pagination=cursor
+TEXT_LIST_ORDERING = ("-created_at", "-id")
 
 
 class TextListView(ListAPIView):
@@ -120,19 +185,41 @@ class TextListView(ListAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        serializer = OnlyUserProfileSerializer(self.request.user)
-        user_id = serializer.data["id"]
-        queryset = (
-            Text.objects.filter(user_id=user_id)
-            .annotate(timestamp=F("created_at"))
-            .order_by("-timestamp")
+        user_id = self.request.user.id
+        # text_user_created_idx serves both the filter and the ordering
+        return Text.objects.filter(user_id=user_id).order_by(*TEXT_LIST_ORDERING)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        if KeysetPagination.is_requested(request):
+            return self.list_cursor(request, queryset)
+
+        conditional = ConditionalGet.for_queryset(request, queryset)
+        not_modified = conditional.not_modified_response()
+        if not_modified is not None:
+            return not_modified
+
+        page = self.paginate_queryset(queryset.values(*TEXT_ROW_FIELDS))
+        response = self.get_paginated_response([text_row(row) for row in page])
+        return conditional.finish(response)
+
+    def list_cursor(self, request, queryset):
+        # Infinite scroll: a keyset page costs the same at any depth, and the
+        # validator comes from the page itself instead of the whole history
+        paginator = select_paginator(request, ordering=TEXT_LIST_ORDERING)
+        paginator.page_size = self.paginator.get_page_size(request)
+        page = paginator.paginate_queryset(
+            queryset.values(*TEXT_ROW_FIELDS, "created_at", "updated_at"), request
         )
 
-        # Assuming queryset is a list of objects, and each object has a 'results' attribute
-
-        # queryset.reverse()
-        print(queryset)
-        return queryset
+        conditional = ConditionalGet(
+            request, *[(row["id"], row["updated_at"]) for row in page]
+        )
+        not_modified = conditional.not_modified_response()
+        if not_modified is not None:
+            return not_modified
+        response = paginator.get_paginated_response([text_row(row) for row in page])
+        return conditional.finish(response)
 
 
 class TextDetailAPIView(generics.RetrieveAPIView):
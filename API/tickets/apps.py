@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class TicketsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tickets'
+
+    def ready(self):
+        from .search import ensure_search_index_after_migrate
+
+        post_migrate.connect(ensure_search_index_after_migrate, sender=self)
@@ -0,0 +1,201 @@
+import json
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, models, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import stats
+from .models import (
+    ArchivedFile,
+    ArchivedTicket,
+    Ticket,
+    TicketAttachment,
+    TicketFollowUp,
+)
+
+# Closed tickets without activity for this many days move to the archive
+DEFAULT_ARCHIVE_AFTER_DAYS = 365
+# Tickets moved per transaction
+DEFAULT_BATCH_SIZE = 200
+
+
+def archive_cutoff(days=None):
+    if days is None:
+        days = getattr(
+            settings, "TICKET_ARCHIVE_AFTER_DAYS", DEFAULT_ARCHIVE_AFTER_DAYS
+        )
+    return timezone.now() - timedelta(days=days)
+
+
+class ArchiveJSONEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder rounds datetimes to milliseconds; archived rows must
+    # read back exactly as they were
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def pack(document):
+    return zlib.compress(
+        json.dumps(document, cls=ArchiveJSONEncoder, separators=(",", ":")).encode()
+    )
+
+
+def unpack(data):
+    return json.loads(zlib.decompress(bytes(data)))
+
+
+def archive_tickets(cutoff=None, batch_size=DEFAULT_BATCH_SIZE):
+    # Move closed tickets whose last activity is older than `cutoff` into
+    # the archive, `batch_size` tickets per transaction, so the hot tables
+    # (and their indexes) only hold the working set. Returns the number of
+    # tickets archived.
+    if cutoff is None:
+        cutoff = archive_cutoff()
+    archived = 0
+    while True:
+        moved = archive_batch(cutoff, batch_size)
+        archived += moved
+        if moved < batch_size:
+            return archived
+
+
+def archive_batch(cutoff, batch_size):
+    with transaction.atomic():
+        candidates = Ticket.objects.filter(
+            is_open=False, last_activity_at__lt=cutoff
+        ).order_by("last_activity_at", "id")
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        ids = list(candidates.values_list("id", flat=True)[:batch_size])
+        if not ids:
+            return 0
+
+        tickets = {row["id"]: row for row in Ticket.objects.filter(pk__in=ids).values()}
+        followups = {}
+        for row in TicketFollowUp.objects.filter(root_id__in=ids).values():
+            followups[row["id"]] = row
+            tickets[row["root_id"]].setdefault("followups", []).append(row)
+        files = []
+        for row in TicketAttachment.objects.filter(
+            Q(ticket_id__in=ids) | Q(followup__root_id__in=ids)
+        ).values():
+            if row["ticket_id"]:
+                owner, ticket_id = tickets[row["ticket_id"]], row["ticket_id"]
+            else:
+                owner = followups[row["followup_id"]]
+                ticket_id = owner["root_id"]
+            owner.setdefault("attachments", []).append(row)
+            files.append(
+                ArchivedFile(
+                    ticket_id=ticket_id,
+                    followup_id=row["followup_id"],
+                    attachment_id=row["id"],
+                    name=row["file"],
+                )
+            )
+        for row in tickets.values():
+            if row["files"]:
+                files.append(ArchivedFile(ticket_id=row["id"], name=row["files"]))
+        for row in followups.values():
+            if row["files"]:
+                files.append(
+                    ArchivedFile(
+                        ticket_id=row["root_id"],
+                        followup_id=row["id"],
+                        name=row["files"],
+                    )
+                )
+
+        ArchivedTicket.objects.bulk_create(
+            [
+                ArchivedTicket(
+                    id=row["id"],
+                    creator_id=row["creator_id"],
+                    opened_by_med_id=row["opened_by_med_id"],
+                    created_at=row["created_at"],
+                    last_activity_at=row["last_activity_at"],
+                    data=pack(row),
+                )
+                for row in tickets.values()
+            ]
+        )
+        ArchivedFile.objects.bulk_create(files)
+
+        # The dashboard counts tickets in the hot table
+        claimed = Counter(
+            row["opened_by_med_id"]
+            for row in tickets.values()
+            if row["opened_by_med_id"]
+        )
+        for med_user_id, count in claimed.items():
+            stats.bump_counter(stats.claimed_counter(med_user_id), -count)
+
+        # A queryset delete: the files now belong to the archive, so nothing
+        # is queued for the sweeper (unlike Ticket.delete())
+        Ticket.objects.filter(pk__in=ids).delete()
+    return len(ids)
+
+
+def restore_instance(model, row):
+    # An unsaved model instance from an archived row. Columns the model no
+    # longer has are dropped; timestamps come back as datetimes.
+    values = {}
+    for field in model._meta.concrete_fields:
+        if field.attname not in row:
+            continue
+        value = row[field.attname]
+        if isinstance(field, models.DateTimeField) and value is not None:
+            value = parse_datetime(value)
+        values[field.attname] = value
+    instance = model(**values)
+    instance._state.adding = False
+    return instance
+
+
+def with_attachments(instance, rows):
+    # Serve instance.attachments.all() from the archived rows, so the regular
+    # serializers render archived threads unchanged
+    instance._prefetched_objects_cache = {
+        "attachments": [restore_instance(TicketAttachment, row) for row in rows]
+    }
+    return instance
+
+
+def archived_thread(archived):
+    # (ticket, follow-ups newest first) of an ArchivedTicket, as read-only
+    # model instances
+    document = unpack(archived.data)
+    ticket = with_attachments(
+        restore_instance(Ticket, document), document.get("attachments", [])
+    )
+    followups = [
+        with_attachments(
+            restore_instance(TicketFollowUp, row), row.get("attachments", [])
+        )
+        for row in document.get("followups", [])
+    ]
+    followups.sort(key=lambda followup: followup.sequence_number, reverse=True)
+    return ticket, followups
+
+
+def archived_file(name):
+    # A FieldFile on attachment storage for serve_attachment()
+    return TicketAttachment(file=name).file
+
+
+def archived_attachment_name(archived, attachment_id):
+    # Client-side name of an archived TicketAttachment, for downloads
+    document = unpack(archived.data)
+    for owner in [document, *document.get("followups", [])]:
+        for row in owner.get("attachments", []):
+            if row["id"] == attachment_id:
+                return row["name"]
+    return None
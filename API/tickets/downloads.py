@@ -0,0 +1,141 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import (
+    FileResponse,
+    HttpResponse,
+    HttpResponseNotModified,
+    StreamingHttpResponse,
+)
+from django.utils.http import parse_etags, quote_etag
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+CHUNK_SIZE = 64 * 1024
+
+
+def attachment_etag(field_file, stat):
+    # Content-addressed names already are the SHA-256 of the content
+    digest = os.path.splitext(os.path.basename(field_file.name))[0]
+    if DIGEST_RE.match(digest):
+        return quote_etag(digest)
+    return quote_etag(f"{stat.st_size:x}-{int(stat.st_mtime):x}")
+
+
+def parse_range(header, size):
+    # Single "bytes=start-end" range -> (start, end) inclusive, None when the
+    # header should be ignored, or False when it cannot be satisfied
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+
+def content_disposition(filename):
+    # Same quoting as FileResponse: escaped ASCII or RFC 5987 UTF-8
+    try:
+        filename.encode("ascii")
+        escaped = filename.replace("\\", "\\\\").replace('"', r"\"")
+        return f'attachment; filename="{escaped}"'
+    except UnicodeEncodeError:
+        return f"attachment; filename*=utf-8''{quote(filename)}"
+
+
+def iter_file_range(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_attachment(request, field_file, filename=None):
+    # Streams an attachment without loading it into memory: plain GETs go
+    # through FileResponse (wsgi.file_wrapper / sendfile), Range requests are
+    # read chunk by chunk, and with ATTACHMENT_SENDFILE_HEADER set the front
+    # proxy serves the bytes itself. `filename` is the name offered to the
+    # client; it defaults to the stored (content-addressed) name.
+    path = field_file.path
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return HttpResponse(status=404)
+
+    etag = attachment_etag(field_file, stat)
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if if_none_match and (
+        etag in parse_etags(if_none_match) or if_none_match.strip() == "*"
+    ):
+        response = HttpResponseNotModified()
+        response["ETag"] = etag
+        return response
+
+    stored_name = os.path.basename(field_file.name)
+    filename = filename or stored_name
+    content_type = mimetypes.guess_type(stored_name)[0] or "application/octet-stream"
+
+    sendfile_header = getattr(settings, "ATTACHMENT_SENDFILE_HEADER", None)
+    if sendfile_header:
+        response = HttpResponse(content_type=content_type)
+        if sendfile_header == "X-Accel-Redirect":
+            prefix = getattr(
+                settings, "ATTACHMENT_ACCEL_REDIRECT_PREFIX", "/protected/"
+            )
+            response[sendfile_header] = prefix.rstrip("/") + "/" + field_file.name
+        else:
+            response[sendfile_header] = path
+        response["Content-Disposition"] = content_disposition(filename)
+        response["ETag"] = etag
+        return response
+
+    byte_range = None
+    range_header = request.META.get("HTTP_RANGE")
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if range_header and (not if_range or if_range.strip() == etag):
+        byte_range = parse_range(range_header, stat.st_size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{stat.st_size}"
+        return response
+
+    if byte_range:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            iter_file_range(path, start, length),
+            status=206,
+            content_type=content_type,
+        )
+        response["Content-Length"] = str(length)
+        response["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+        response["Content-Disposition"] = content_disposition(filename)
+    else:
+        response = FileResponse(
+            open(path, "rb"),
+            as_attachment=True,
+            filename=filename,
+            content_type=content_type,
+        )
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    return response
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+def ticket_channel(ticket_id):
+    return f"ticket:{ticket_id}"
+
+
+class SubscriberOverflow(Exception):
+    # The subscriber fell too far behind; it should reconnect and catch up
+    # with Last-Event-ID instead of buffering without bound
+    pass
+
+
+class Subscription:
+    def __init__(self, loop, max_pending):
+        self.loop = loop
+        self.max_pending = max_pending
+        self.queue = asyncio.Queue()
+        self.overflowed = False
+
+    def deliver(self, message):
+        # Always runs on the subscriber's event loop
+        if self.overflowed:
+            return
+        if self.queue.qsize() >= self.max_pending:
+            self.overflowed = True
+            message = None
+        self.queue.put_nowait(message)
+
+    async def get(self):
+        message = await self.queue.get()
+        if message is None:
+            raise SubscriberOverflow()
+        return message
+
+
+class InProcessBroker:
+    # Fan-out to the SSE connections served by this process. publish() may be
+    # called from any thread (sync views run in a worker thread under ASGI);
+    # messages are handed to each subscriber's own event loop.
+    #
+    # Swap it via settings.TICKET_EVENTS_BROKER for a broker that reaches
+    # every process (e.g. one backed by Redis pub/sub) by implementing the
+    # same publish()/subscribe() pair.
+    max_pending = 100
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+
+    def publish(self, channel, message):
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, message)
+            except RuntimeError:
+                # Event loop already closed; its subscribe() block cleans up
+                pass
+
+    @asynccontextmanager
+    async def subscribe(self, channel):
+        subscription = Subscription(asyncio.get_running_loop(), self.max_pending)
+        with self.lock:
+            self.subscribers.setdefault(channel, set()).add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self.lock:
+                channel_subscribers = self.subscribers.get(channel)
+                if channel_subscribers is not None:
+                    channel_subscribers.discard(subscription)
+                    if not channel_subscribers:
+                        del self.subscribers[channel]
+
+
+class RecordingBroker(InProcessBroker):
+    # Local stand-in for tests: delivers like InProcessBroker and keeps every
+    # published (channel, message) pair for assertions
+    def __init__(self):
+        super().__init__()
+        self.published = []
+
+    def publish(self, channel, message):
+        self.published.append((channel, message))
+        super().publish(channel, message)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.TICKET_EVENTS_BROKER)()
+        return _broker
+
+
+def reset_broker():
+    # Drop the cached broker, e.g. after overriding TICKET_EVENTS_BROKER
+    global _broker
+    with _broker_lock:
+        _broker = None
+
+
+def followup_message(followup):
+    from .serializers import TicketFollowUpSerializer
+
+    data = dict(TicketFollowUpSerializer(followup).data)
+    data.update(
+        id=followup.pk,
+        sequence_number=followup.sequence_number,
+        created_at=followup.created_at,
+    )
+    # The sequence number doubles as the SSE event id (Last-Event-ID)
+    return {"event": "followup", "id": followup.sequence_number, "data": data}
+
+
+def publish_followup(followup):
+    try:
+        get_broker().publish(
+            ticket_channel(followup.root_id), followup_message(followup)
+        )
+    except Exception:
+        # Subscribers catch up through Last-Event-ID; never fail the write
+        logger.exception("Could not publish follow-up %s", followup.pk)
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tickets.archive import DEFAULT_BATCH_SIZE, archive_cutoff, archive_tickets
+
+
+class Command(BaseCommand):
+    help = (
+        "Move closed tickets without activity for TICKET_ARCHIVE_AFTER_DAYS "
+        "(or --days) into the archive, with their follow-ups and attachments."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, help="override the archive age")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument(
+            "--forever", action="store_true", help="keep archiving every --interval"
+        )
+        parser.add_argument("--interval", type=int, default=3600)
+
+    def handle(self, *args, **options):
+        while True:
+            archived = archive_tickets(
+                archive_cutoff(options["days"]), options["batch_size"]
+            )
+            self.stdout.write(f"Archived {archived} ticket(s)")
+
+            if not options["forever"]:
+                break
+            time.sleep(options["interval"])
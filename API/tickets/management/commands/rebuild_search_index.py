@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from tickets.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the ticket full-text index if it is missing and re-index every "
+        "ticket description and follow-up body."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        using = connections[options["database"]]
+        with transaction.atomic(using=using.alias):
+            if not rebuild_search_index(using):
+                raise CommandError(
+                    f"{using.vendor} has no supported full-text index; search "
+                    "falls back to icontains."
+                )
+        self.stdout.write("Search index rebuilt")
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tickets.stats import rebuild_response_time_sketch, reconcile_counters
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the dashboard counters from the ticket table and, with "
+        "--sketch, rebuild the first-response-time sketch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sketch",
+            action="store_true",
+            help="also rebuild the response-time sketch (full scan)",
+        )
+        parser.add_argument(
+            "--forever", action="store_true", help="keep reconciling every --interval"
+        )
+        parser.add_argument("--interval", type=int, default=3600)
+
+    def handle(self, *args, **options):
+        while True:
+            changed = reconcile_counters()
+            self.stdout.write(f"Corrected {changed} counter(s)")
+            if options["sketch"]:
+                samples = rebuild_response_time_sketch()
+                self.stdout.write(f"Rebuilt sketch from {samples} response time(s)")
+
+            if not options["forever"]:
+                break
+            time.sleep(options["interval"])
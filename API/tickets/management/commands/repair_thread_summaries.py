@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from tickets.models import Ticket, thread_summary_values
+
+
+def repaired_values():
+    # updated_at moves too so cached thread summaries are revalidated
+    return dict(thread_summary_values(), updated_at=timezone.now())
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute followup_count, last_followup_at, last_followup_by_med and "
+        "last_activity_at on tickets from their follow-ups."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--ticket-id",
+            type=int,
+            action="append",
+            dest="ticket_ids",
+            help="only repair this ticket (repeatable)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="tickets per UPDATE statement (default: 1000)",
+        )
+
+    def handle(self, *args, **options):
+        if options["ticket_ids"]:
+            with transaction.atomic():
+                repaired = Ticket.objects.filter(pk__in=options["ticket_ids"]).update(
+                    **repaired_values()
+                )
+            self.stdout.write(f"Repaired {repaired} ticket(s)")
+            return
+
+        # Walk the table in primary key ranges so no single statement holds
+        # locks on the whole table
+        batch_size = options["batch_size"]
+        last_id = Ticket.objects.aggregate(last=Max("id"))["last"] or 0
+        repaired = 0
+        for start in range(0, last_id + 1, batch_size):
+            with transaction.atomic():
+                repaired += Ticket.objects.filter(
+                    pk__gte=start, pk__lt=start + batch_size
+                ).update(**repaired_values())
+        self.stdout.write(f"Repaired {repaired} ticket(s)")
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tickets.sweeper import sweep_deletion_queue, sweep_orphans
+
+
+class Command(BaseCommand):
+    help = (
+        "Release queued attachment deletions and, with --orphans, remove "
+        "files under ticket_files/ that no row references."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--orphans", action="store_true", help="also scan for orphaned files"
+        )
+        parser.add_argument(
+            "--min-age",
+            type=int,
+            default=3600,
+            help="ignore files younger than this many seconds (default: 3600)",
+        )
+        parser.add_argument(
+            "--forever", action="store_true", help="keep sweeping every --interval"
+        )
+        parser.add_argument("--interval", type=int, default=60)
+
+    def handle(self, *args, **options):
+        while True:
+            released = sweep_deletion_queue(options["batch_size"])
+            self.stdout.write(f"Released {released} queued attachment(s)")
+            if options["orphans"]:
+                removed = sweep_orphans(options["min_age"], options["batch_size"])
+                self.stdout.write(f"Removed {removed} orphaned file(s)")
+
+            if not options["forever"]:
+                break
+            time.sleep(options["interval"])
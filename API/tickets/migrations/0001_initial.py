@@ -0,0 +1,45 @@
+# Generated by Django 4.0.10 on 2026-10-18 06:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import tickets.models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ticket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('description', models.TextField()),
+                ('files', models.FileField(blank=True, null=True, upload_to=tickets.models.custom_file_upload_path, validators=[tickets.models.validate_file_size])),
+                ('is_open', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_column='timestamp')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('opened_by_med_id', models.IntegerField(blank=True, null=True)),
+                ('creator', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TicketFollowUp',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence_number', models.IntegerField()),
+                ('is_medUser', models.BooleanField()),
+                ('description', models.TextField()),
+                ('files', models.FileField(blank=True, null=True, upload_to=tickets.models.custom_file_upload_path, validators=[tickets.models.validate_file_size])),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_column='timestamp')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('creator', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('root', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tickets.ticket')),
+            ],
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.0.10 on 2026-10-18 06:52
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def backfill_sequence_numbers(apps, schema_editor):
+    Ticket = apps.get_model("tickets", "Ticket")
+    TicketFollowUp = apps.get_model("tickets", "TicketFollowUp")
+
+    # Renumber threads that already hold duplicate sequence numbers (the old
+    # read-then-write allocation could race) so the constraint can be added.
+    duplicated = (
+        TicketFollowUp.objects.values("root_id", "sequence_number")
+        .annotate(n=models.Count("id"))
+        .filter(n__gt=1)
+        .values_list("root_id", flat=True)
+        .distinct()
+    )
+    for root_id in duplicated:
+        followups = TicketFollowUp.objects.filter(root_id=root_id).order_by(
+            "sequence_number", "created_at", "id"
+        )
+        for number, followup in enumerate(followups, start=1):
+            if followup.sequence_number != number:
+                followup.sequence_number = number
+                followup.save(update_fields=["sequence_number"])
+
+    last_numbers = TicketFollowUp.objects.values("root_id").annotate(
+        last=Max("sequence_number")
+    )
+    for row in last_numbers.iterator():
+        Ticket.objects.filter(pk=row["root_id"]).update(
+            last_sequence_number=row["last"]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='last_sequence_number',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(
+            backfill_sequence_numbers, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='ticketfollowup',
+            constraint=models.UniqueConstraint(fields=('root', 'sequence_number'), name='unique_followup_sequence_per_ticket'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.0.10 on 2026-10-18 06:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0002_ticket_last_sequence_number'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['creator', 'created_at', 'id'], name='ticket_creator_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['opened_by_med_id', 'created_at', 'id'], name='ticket_med_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(condition=models.Q(('is_open', True)), fields=['created_at', 'id'], name='ticket_open_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticketfollowup',
+            index=models.Index(fields=['root', 'created_at', 'id'], name='followup_root_created_idx'),
+        ),
+    ]
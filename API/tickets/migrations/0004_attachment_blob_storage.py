@@ -0,0 +1,35 @@
+# Generated by Django 4.0.10 on 2026-10-18 07:00
+
+from django.db import migrations, models
+import tickets.models
+import tickets.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0003_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttachmentBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='ticket',
+            name='files',
+            field=models.FileField(blank=True, null=True, storage=tickets.storage.ContentAddressedStorage(), upload_to=tickets.models.custom_file_upload_path, validators=[tickets.models.validate_file_size]),
+        ),
+        migrations.AlterField(
+            model_name='ticketfollowup',
+            name='files',
+            field=models.FileField(blank=True, null=True, storage=tickets.storage.ContentAddressedStorage(), upload_to=tickets.models.custom_file_upload_path, validators=[tickets.models.validate_file_size]),
+        ),
+    ]
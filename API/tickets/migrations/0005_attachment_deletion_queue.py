@@ -0,0 +1,21 @@
+# Generated by Django 4.0.10 on 2026-10-18 07:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0004_attachment_blob_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttachmentDeletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('queued_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.0.10 on 2026-10-18 07:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+import tickets.models
+import tickets.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0005_attachment_deletion_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketAttachment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(storage=tickets.storage.ContentAddressedStorage(), upload_to=tickets.models.custom_file_upload_path, validators=[tickets.models.validate_file_size])),
+                ('name', models.CharField(max_length=255)),
+                ('size', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('followup', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='attachments', to='tickets.ticketfollowup')),
+                ('ticket', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='attachments', to='tickets.ticket')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='ticketattachment',
+            constraint=models.CheckConstraint(check=models.Q(models.Q(('followup__isnull', True), ('ticket__isnull', False)), models.Q(('followup__isnull', False), ('ticket__isnull', True)), _connector='OR'), name='attachment_ticket_xor_followup'),
+        ),
+    ]
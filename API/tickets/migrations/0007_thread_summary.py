@@ -0,0 +1,71 @@
+# Generated by Django 4.0.10 on 2026-10-18 07:06
+
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.utils.timezone
+
+
+def backfill_thread_summaries(apps, schema_editor):
+    Ticket = apps.get_model("tickets", "Ticket")
+    TicketFollowUp = apps.get_model("tickets", "TicketFollowUp")
+
+    latest = TicketFollowUp.objects.filter(root=OuterRef("pk")).order_by(
+        "-created_at", "-id"
+    )
+    count = (
+        TicketFollowUp.objects.filter(root=OuterRef("pk"))
+        .order_by()
+        .values("root")
+        .annotate(n=Count("id"))
+        .values("n")
+    )
+    Ticket.objects.update(
+        followup_count=Coalesce(Subquery(count), 0),
+        last_followup_at=Subquery(latest.values("created_at")[:1]),
+        last_followup_by_med=Subquery(latest.values("is_medUser")[:1]),
+        last_activity_at=Coalesce(
+            Subquery(latest.values("created_at")[:1]), F("created_at")
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0006_ticket_attachments'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='followup_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='last_followup_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='last_followup_by_med',
+            field=models.BooleanField(blank=True, null=True),
+        ),
+        migrations.RunPython(
+            backfill_thread_summaries, migrations.RunPython.noop
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['creator', 'last_activity_at', 'id'], name='ticket_creator_activity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['opened_by_med_id', 'last_activity_at', 'id'], name='ticket_med_activity_idx'),
+        ),
+    ]
@@ -0,0 +1,107 @@
+# Generated by Django 4.0.10 on 2026-10-18 07:14
+
+from django.db import migrations
+
+# The DDL as of this migration, kept here so later changes to tickets.search
+# never change what this migration does
+
+FTS_TABLE = "tickets_search"
+
+SQLITE_CREATE = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "body, ticket_id UNINDEXED, tokenize='porter unicode61')",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ticket_ai
+    AFTER INSERT ON tickets_ticket BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, body, ticket_id)
+        VALUES (new.id * 2, new.description, new.id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ticket_au
+    AFTER UPDATE OF description ON tickets_ticket BEGIN
+        UPDATE {FTS_TABLE} SET body = new.description WHERE rowid = new.id * 2;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ticket_ad
+    AFTER DELETE ON tickets_ticket BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id * 2;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_followup_ai
+    AFTER INSERT ON tickets_ticketfollowup BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, body, ticket_id)
+        VALUES (new.id * 2 + 1, new.description, new.root_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_followup_au
+    AFTER UPDATE OF description ON tickets_ticketfollowup BEGIN
+        UPDATE {FTS_TABLE} SET body = new.description
+        WHERE rowid = new.id * 2 + 1;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_followup_ad
+    AFTER DELETE ON tickets_ticketfollowup BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id * 2 + 1;
+    END""",
+    f"DELETE FROM {FTS_TABLE}",
+    f"INSERT INTO {FTS_TABLE}(rowid, body, ticket_id) "
+    "SELECT id * 2, description, id FROM tickets_ticket",
+    f"INSERT INTO {FTS_TABLE}(rowid, body, ticket_id) "
+    "SELECT id * 2 + 1, description, root_id FROM tickets_ticketfollowup",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')",
+]
+SQLITE_DROP = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{name}"
+    for name in (
+        "ticket_ai",
+        "ticket_au",
+        "ticket_ad",
+        "followup_ai",
+        "followup_au",
+        "followup_ad",
+    )
+] + [f"DROP TABLE IF EXISTS {FTS_TABLE}"]
+
+POSTGRES_CREATE = [
+    "CREATE INDEX IF NOT EXISTS ticket_description_fts_idx ON tickets_ticket "
+    "USING gin (to_tsvector('english', description))",
+    "CREATE INDEX IF NOT EXISTS followup_description_fts_idx "
+    "ON tickets_ticketfollowup USING gin (to_tsvector('english', description))",
+]
+POSTGRES_DROP = [
+    "DROP INDEX IF EXISTS ticket_description_fts_idx",
+    "DROP INDEX IF EXISTS followup_description_fts_idx",
+]
+
+
+def sqlite_has_fts5(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        return "ENABLE_FTS5" in {row[0] for row in cursor.fetchall()}
+
+
+def execute(schema_editor, statements):
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def create_index(apps, schema_editor):
+    # Databases without full-text support fall back to icontains searches
+    connection = schema_editor.connection
+    if connection.vendor == "postgresql":
+        execute(schema_editor, POSTGRES_CREATE)
+    elif connection.vendor == "sqlite" and sqlite_has_fts5(connection):
+        execute(schema_editor, SQLITE_CREATE)
+
+
+def drop_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "postgresql":
+        execute(schema_editor, POSTGRES_DROP)
+    elif connection.vendor == "sqlite":
+        execute(schema_editor, SQLITE_DROP)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0007_thread_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
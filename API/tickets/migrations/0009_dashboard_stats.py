@@ -0,0 +1,91 @@
+# Generated by Django 4.0.10 on 2026-10-18 07:16
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+
+from tickets.stats import CLAIMED_PREFIX, OPEN_QUEUE, bucket_index
+
+
+def backfill_dashboard_stats(apps, schema_editor):
+    Ticket = apps.get_model("tickets", "Ticket")
+    TicketFollowUp = apps.get_model("tickets", "TicketFollowUp")
+    StatCounter = apps.get_model("tickets", "StatCounter")
+    ResponseTimeBucket = apps.get_model("tickets", "ResponseTimeBucket")
+
+    first_response = TicketFollowUp.objects.filter(
+        root=OuterRef("pk"), is_medUser=True
+    ).order_by("created_at", "id")
+    Ticket.objects.update(
+        first_response_at=Subquery(first_response.values("created_at")[:1])
+    )
+
+    counters = [
+        StatCounter(
+            name=OPEN_QUEUE, value=Ticket.objects.filter(is_open=True).count()
+        )
+    ]
+    claimed = (
+        Ticket.objects.filter(is_open=False, opened_by_med_id__isnull=False)
+        .values("opened_by_med_id")
+        .annotate(n=Count("id"))
+        .values_list("opened_by_med_id", "n")
+    )
+    for med_user_id, count in claimed:
+        counters.append(
+            StatCounter(name=f"{CLAIMED_PREFIX}{med_user_id}", value=count)
+        )
+    StatCounter.objects.bulk_create(counters)
+
+    buckets = Counter()
+    rows = Ticket.objects.filter(first_response_at__isnull=False).values_list(
+        "created_at", "first_response_at"
+    )
+    for created_at, first_response_at in rows.iterator(chunk_size=2000):
+        buckets[bucket_index((first_response_at - created_at).total_seconds())] += 1
+    ResponseTimeBucket.objects.bulk_create(
+        [
+            ResponseTimeBucket(index=index, count=count)
+            for index, count in buckets.items()
+        ]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0008_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResponseTimeBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.IntegerField(unique=True)),
+                ('count', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StatCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64)),
+                ('shard', models.PositiveSmallIntegerField(default=0)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='first_response_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='statcounter',
+            constraint=models.UniqueConstraint(fields=('name', 'shard'), name='unique_stat_counter_shard'),
+        ),
+        migrations.RunPython(
+            backfill_dashboard_stats, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.0.10 on 2026-10-18 07:19
+
+from django.db import migrations, models
+
+from tickets.routing import get_classifier
+
+
+def tag_open_tickets(apps, schema_editor):
+    # Existing open tickets get a specialization but no offer, so they stay
+    # in everyone's queue
+    Ticket = apps.get_model("tickets", "Ticket")
+    classifier = get_classifier()
+    rows = Ticket.objects.filter(is_open=True).values_list("id", "description")
+    for ticket_id, description in rows.iterator(chunk_size=2000):
+        specialization = classifier.classify(description)
+        if specialization:
+            Ticket.objects.filter(pk=ticket_id).update(specialization=specialization)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0009_dashboard_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='offered_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='offered_to_id',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='specialization',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(condition=models.Q(('is_open', True)), fields=['offered_to_id', 'created_at', 'id'], name='ticket_offered_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(condition=models.Q(('is_open', True)), fields=['specialization', 'created_at', 'id'], name='ticket_special_queue_idx'),
+        ),
+        migrations.RunPython(tag_open_tickets, migrations.RunPython.noop),
+    ]
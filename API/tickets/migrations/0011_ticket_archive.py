@@ -0,0 +1,50 @@
+# Generated by Django 4.0.10 on 2026-10-18 07:22
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('tickets', '0010_ticket_routing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('followup_id', models.BigIntegerField(blank=True, db_index=True, null=True)),
+                ('attachment_id', models.BigIntegerField(blank=True, null=True, unique=True)),
+                ('name', models.CharField(db_index=True, max_length=255)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedTicket',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('opened_by_med_id', models.IntegerField(blank=True, db_index=True, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('last_activity_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('data', models.BinaryField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(condition=models.Q(('is_open', False)), fields=['last_activity_at', 'id'], name='ticket_archive_scan_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedticket',
+            name='creator',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='archivedfile',
+            name='ticket',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='files', to='tickets.archivedticket'),
+        ),
+    ]
@@ -1,13 +1,20 @@
+import os
+
 from django.db import models
 
 # Create your models here.
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
 from accounts.models import User
 
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
 
-import os
+from . import routing, stats
+from .events import publish_followup
+from .storage import attachment_storage
 
 
 def custom_file_upload_path(instance, filename):
@@ -15,10 +22,14 @@ def custom_file_upload_path(instance, filename):
     return f"ticket_files/{filename}"
 
 
+MAX_ATTACHMENT_SIZE = 4 * 1024 * 1024  # 4MB in bytes
+# TicketAttachment files accepted in a single create request
+MAX_ATTACHMENTS_PER_REQUEST = 10
+
+
 # Custom validator to check file size
 def validate_file_size(value):
-    max_file_size = 4 * 1024 * 1024  # 4MB in bytes
-    if value.size > max_file_size:
+    if value.size > MAX_ATTACHMENT_SIZE:
         raise ValidationError(_("File size exceeds the maximum limit of 4MB."))
 
 
@@ -29,6 +40,7 @@ class Ticket(models.Model):
     # FileField for multiple files
     files = models.FileField(
         upload_to=custom_file_upload_path,
+        storage=attachment_storage,
         validators=[validate_file_size],
         blank=True,
         null=True,
@@ -37,25 +49,304 @@ class Ticket(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, db_column="timestamp")
     updated_at = models.DateTimeField(auto_now=True)
     opened_by_med_id = models.IntegerField(null=True, blank=True)
+    # Last sequence_number handed out to a follow-up of this ticket
+    last_sequence_number = models.PositiveIntegerField(default=0)
+    # Thread summary, kept in step by TicketFollowUp.save()/delete()
+    # (`manage.py repair_thread_summaries` recomputes it)
+    followup_count = models.PositiveIntegerField(default=0)
+    last_followup_at = models.DateTimeField(null=True, blank=True)
+    last_followup_by_med = models.BooleanField(null=True, blank=True)
+    # last_followup_at, or the creation time for a thread without replies
+    last_activity_at = models.DateTimeField(default=timezone.now)
+    # First follow-up written by a med user (time-to-first-response stats)
+    first_response_at = models.DateTimeField(null=True, blank=True)
+    # Routing (see tickets.routing): the specialization the ticket was tagged
+    # with ("" when none matched) and the med user it is offered to first
+    specialization = models.CharField(max_length=200, blank=True, default="")
+    offered_to_id = models.IntegerField(null=True, blank=True)
+    offered_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # reg-user list: creator_id = ? ORDER BY created_at, id
+            models.Index(
+                fields=["creator", "created_at", "id"],
+                name="ticket_creator_created_idx",
+            ),
+            # med-user close list: opened_by_med_id = ? ORDER BY created_at, id
+            models.Index(
+                fields=["opened_by_med_id", "created_at", "id"],
+                name="ticket_med_created_idx",
+            ),
+            # ?ordering=activity on the reg-user / med-user close lists
+            models.Index(
+                fields=["creator", "last_activity_at", "id"],
+                name="ticket_creator_activity_idx",
+            ),
+            models.Index(
+                fields=["opened_by_med_id", "last_activity_at", "id"],
+                name="ticket_med_activity_idx",
+            ),
+            # open queue and claim-next only ever touch open tickets
+            models.Index(
+                fields=["created_at", "id"],
+                name="ticket_open_queue_idx",
+                condition=models.Q(is_open=True),
+            ),
+            # per-med-user and per-specialization parts of the open queue
+            models.Index(
+                fields=["offered_to_id", "created_at", "id"],
+                name="ticket_offered_queue_idx",
+                condition=models.Q(is_open=True),
+            ),
+            models.Index(
+                fields=["specialization", "created_at", "id"],
+                name="ticket_special_queue_idx",
+                condition=models.Q(is_open=True),
+            ),
+            # archive_tickets: closed tickets by last activity
+            models.Index(
+                fields=["last_activity_at", "id"],
+                name="ticket_archive_scan_idx",
+                condition=models.Q(is_open=False),
+            ),
+        ]
 
     def save(self, *args, **kwargs):
         # Handle multiple files (if needed)
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            adding = self._state.adding
+            if adding and self.is_open:
+                routing.route_ticket(self)
+            super().save(*args, **kwargs)
+            if adding:
+                # Dashboard counters move with the row (see tickets.stats)
+                stats.ticket_opened(self)
 
     def delete(self, *args, **kwargs):
-        # Delete associated files from the "uploads" folder
-        if self.files:
-            file_path = os.path.join(settings.MEDIA_ROOT, self.files.name)
-            if os.path.exists(file_path):
-                print(f"Deleting file: {file_path}")  # Debugging statement
-                os.remove(file_path)
+        # One transaction and no filesystem work: the attachments of the
+        # ticket and of its follow-ups (the cascade does not call
+        # TicketFollowUp.delete) are queued for `manage.py sweep_attachments`.
+        with transaction.atomic():
+            names = list(
+                TicketFollowUp.objects.filter(root=self)
+                .exclude(files="")
+                .exclude(files__isnull=True)
+                .values_list("files", flat=True)
+            )
+            if self.files:
+                names.append(self.files.name)
+            stats.ticket_removed(self)
+            names += TicketAttachment.objects.filter(
+                models.Q(ticket=self) | models.Q(followup__root=self)
+            ).values_list("file", flat=True)
+            queue_attachment_deletions(names)
+
+            # Call the parent class's delete method to delete the database record
+            return super().delete(*args, **kwargs)
+
+
+class AttachmentBlob(models.Model):
+    # One row per content-addressed file in attachment_storage
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
+class StatCounter(models.Model):
+    # One shard of a dashboard counter (see tickets.stats)
+    name = models.CharField(max_length=64)
+    shard = models.PositiveSmallIntegerField(default=0)
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["name", "shard"], name="unique_stat_counter_shard"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name}[{self.shard}]"
+
+
+class ResponseTimeBucket(models.Model):
+    # Time-to-first-response sketch bucket (see tickets.stats)
+    index = models.IntegerField(unique=True)
+    count = models.BigIntegerField(default=0)
+
+
+class AttachmentDeletion(models.Model):
+    # Attachment references waiting to be released by the sweeper
+    name = models.CharField(max_length=255)
+    queued_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
+def queue_attachment_deletions(names):
+    AttachmentDeletion.objects.bulk_create(
+        [AttachmentDeletion(name=name) for name in names if name]
+    )
+
+
+def claim_ticket(ticket_id, med_user_id):
+    # Conditional UPDATE: only one med user can flip an open ticket to
+    # claimed, whatever the backend. Returns True if this call won.
+    with transaction.atomic():
+        claimed = Ticket.objects.filter(pk=ticket_id, is_open=True).update(
+            is_open=False, opened_by_med_id=med_user_id, updated_at=timezone.now()
+        )
+        if claimed:
+            stats.ticket_claimed(med_user_id)
+    return bool(claimed)
+
+
+# claim_next_ticket() result when open tickets remain but every attempt lost
+# the race for them
+CLAIM_CONTENDED = object()
+
+
+def claim_next_ticket(med_user_id, max_attempts=10, queues=None):
+    # Claim the first ticket of the first non-empty queue for a med user and
+    # return it, None when they are all empty, or CLAIM_CONTENDED when other
+    # claimers won `max_attempts` races in a row. `queues` defaults to the
+    # whole open queue, oldest first (see routing.personal_queues()).
+    if queues is None:
+        queues = [Ticket.objects.filter(is_open=True).order_by("created_at", "id")]
+    if connection.features.has_select_for_update_skip_locked:
+        # Concurrent claimers skip rows another transaction already holds
+        # instead of queueing behind it.
+        with transaction.atomic():
+            for queue in queues:
+                ticket = queue.select_for_update(skip_locked=True).first()
+                if ticket is not None:
+                    break
             else:
-                print(f"File not found: {file_path}")  # Debugging statement
+                return None
+            ticket.updated_at = timezone.now()
+            Ticket.objects.filter(pk=ticket.pk).update(
+                is_open=False,
+                opened_by_med_id=med_user_id,
+                updated_at=ticket.updated_at,
+            )
+            stats.ticket_claimed(med_user_id)
+    else:
+        # SQLite & co: optimistic pick + conditional UPDATE, retrying on the
+        # (rare) lost race.
+        for attempt in range(max_attempts):
+            ticket = next(
+                (head for head in (queue.first() for queue in queues) if head),
+                None,
+            )
+            if ticket is None:
+                return None
+            if claim_ticket(ticket.pk, med_user_id):
+                break
         else:
-            print("self.files is none")  # Debugging statement
+            return CLAIM_CONTENDED
+    ticket.is_open = False
+    ticket.opened_by_med_id = med_user_id
+    return ticket
+
+
+def allocate_sequence_numbers(ticket_id, count=1):
+    # Atomically reserve `count` follow-up sequence numbers on a ticket and
+    # return the first one. Must run inside a transaction: the UPDATE takes
+    # the row lock, so the read-back always sees our own increment.
+    if connection.vendor == "postgresql" or (
+        connection.vendor == "sqlite"
+        and connection.Database.sqlite_version_info >= (3, 35, 0)
+    ):
+        # Single round trip with UPDATE ... RETURNING
+        table = connection.ops.quote_name(Ticket._meta.db_table)
+        column = connection.ops.quote_name("last_sequence_number")
+        pk = connection.ops.quote_name(Ticket._meta.pk.column)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET {column} = {column} + %s "
+                f"WHERE {pk} = %s RETURNING {column}",
+                [count, ticket_id],
+            )
+            row = cursor.fetchone()
+        if row is None:
+            raise Ticket.DoesNotExist("Ticket matching query does not exist.")
+        last = row[0]
+    else:
+        updated = Ticket.objects.filter(pk=ticket_id).update(
+            last_sequence_number=F("last_sequence_number") + count
+        )
+        if not updated:
+            raise Ticket.DoesNotExist("Ticket matching query does not exist.")
+        last = (
+            Ticket.objects.filter(pk=ticket_id)
+            .values_list("last_sequence_number", flat=True)
+            .get()
+        )
+    return last - count + 1
+
+
+def record_followups(ticket_id, count, created_at, by_med):
+    # Bump the thread summary for `count` new follow-ups, the newest one
+    # created at `created_at`. Runs in the transaction that allocated their
+    # sequence numbers, so the ticket row is already locked by us.
+    Ticket.objects.filter(pk=ticket_id).update(
+        followup_count=F("followup_count") + count,
+        last_followup_at=created_at,
+        last_followup_by_med=by_med,
+        last_activity_at=created_at,
+        updated_at=timezone.now(),
+    )
+
+
+def record_first_response(ticket_id, created_at):
+    # The first med-user follow-up on a ticket feeds the response-time sketch
+    if Ticket.objects.filter(pk=ticket_id, first_response_at__isnull=True).update(
+        first_response_at=created_at
+    ):
+        opened_at = (
+            Ticket.objects.filter(pk=ticket_id)
+            .values_list("created_at", flat=True)
+            .get()
+        )
+        stats.record_response_time((created_at - opened_at).total_seconds())
+
+
+def thread_summary_values():
+    # Thread summary expressions recomputed from the follow-up table, for
+    # Ticket.objects.filter(...).update(**thread_summary_values())
+    latest = TicketFollowUp.objects.filter(root=OuterRef("pk")).order_by(
+        "-created_at", "-id"
+    )
+    count = (
+        TicketFollowUp.objects.filter(root=OuterRef("pk"))
+        .order_by()
+        .values("root")
+        .annotate(n=Count("id"))
+        .values("n")
+    )
+    return {
+        "followup_count": Coalesce(Subquery(count), 0),
+        "last_followup_at": Subquery(latest.values("created_at")[:1]),
+        "last_followup_by_med": Subquery(latest.values("is_medUser")[:1]),
+        "last_activity_at": Coalesce(
+            Subquery(latest.values("created_at")[:1]), F("created_at")
+        ),
+    }
 
-        # Call the parent class's delete method to delete the database record
-        super().delete(*args, **kwargs)
+
+def forget_followup(ticket_id):
+    # A follow-up of the ticket was deleted: one less reply, and the "last"
+    # fields fall back to whatever follow-up is now the newest
+    values = thread_summary_values()
+    values["followup_count"] = Greatest(F("followup_count") - 1, 0)
+    values["updated_at"] = timezone.now()
+    Ticket.objects.filter(pk=ticket_id).update(**values)
 
 
 # Create your models here.
@@ -68,6 +359,7 @@ class TicketFollowUp(models.Model):
     # FileField for multiple files
     files = models.FileField(
         upload_to=custom_file_upload_path,
+        storage=attachment_storage,
         validators=[validate_file_size],
         blank=True,
         null=True,
@@ -75,32 +367,181 @@ class TicketFollowUp(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, db_column="timestamp")
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        # The unique (root, sequence_number) constraint also serves the
+        # page-number listing ordered by -sequence_number.
+        constraints = [
+            models.UniqueConstraint(
+                fields=["root", "sequence_number"],
+                name="unique_followup_sequence_per_ticket",
+            ),
+        ]
+        indexes = [
+            # cursor listing: root = ? ORDER BY created_at DESC, id DESC
+            models.Index(
+                fields=["root", "created_at", "id"],
+                name="followup_root_created_idx",
+            ),
+        ]
+
     def save(self, *args, **kwargs):
-        # Calculate the sequence number based on the 'root' field and existing records
-        if not self.sequence_number:
-            last_record = (
-                TicketFollowUp.objects.filter(root=self.root)
-                .order_by("-sequence_number")
-                .first()
-            )
-            if last_record:
-                self.sequence_number = last_record.sequence_number + 1
-            else:
-                self.sequence_number = 1
-        # super(TicketFollowUp, self).save(*args, **kwargs)
-        super().save(*args, **kwargs)
+        # Allocate the sequence number from the per-ticket counter; the counter
+        # bump and the insert share one transaction so concurrent follow-ups
+        # on the same ticket never get the same number.
+        with transaction.atomic():
+            adding = self._state.adding
+            if not self.sequence_number:
+                self.sequence_number = allocate_sequence_numbers(self.root_id)
+            super().save(*args, **kwargs)
+            if adding:
+                record_followups(self.root_id, 1, self.created_at, self.is_medUser)
+                if self.is_medUser:
+                    record_first_response(self.root_id, self.created_at)
+                # Pushed to the ticket's event stream once the row is visible
+                transaction.on_commit(lambda: publish_followup(self))
 
     def delete(self, *args, **kwargs):
-        # Delete associated files from the "uploads" folder
-        if self.files:
-            file_path = os.path.join(settings.MEDIA_ROOT, self.files.name)
-            if os.path.exists(file_path):
-                print(f"Deleting file: {file_path}")  # Debugging statement
-                os.remove(file_path)
-            else:
-                print(f"File not found: {file_path}")  # Debugging statement
-        else:
-            print("self.files is none")  # Debugging statement
+        # The attachments are released by the background sweeper
+        with transaction.atomic():
+            names = list(self.attachments.values_list("file", flat=True))
+            if self.files:
+                names.append(self.files.name)
+            queue_attachment_deletions(names)
+
+            # Call the parent class's delete method to delete the database record
+            deleted = super().delete(*args, **kwargs)
+            forget_followup(self.root_id)
+            return deleted
+
+
+def create_followups(ticket_id, creator_id, is_med_user, descriptions):
+    # TicketFollowUp.save() for a whole batch: one sequence-number allocation,
+    # one bulk INSERT and one thread-summary update. Returns the follow-ups in
+    # order, without attachments (their prefetch cache is set to empty).
+    with transaction.atomic():
+        first = allocate_sequence_numbers(ticket_id, len(descriptions))
+        followups = TicketFollowUp.objects.bulk_create(
+            [
+                TicketFollowUp(
+                    root_id=ticket_id,
+                    creator_id=creator_id,
+                    is_medUser=is_med_user,
+                    description=description,
+                    sequence_number=first + index,
+                )
+                for index, description in enumerate(descriptions)
+            ]
+        )
+        record_followups(
+            ticket_id, len(followups), followups[-1].created_at, is_med_user
+        )
+        if is_med_user:
+            record_first_response(ticket_id, followups[0].created_at)
+
+        for followup in followups:
+            followup._prefetched_objects_cache = {
+                "attachments": TicketAttachment.objects.none()
+            }
+
+        def publish():
+            for followup in followups:
+                publish_followup(followup)
+
+        transaction.on_commit(publish)
+    return followups
+
+
+class TicketAttachment(models.Model):
+    # Any number of files per ticket or per follow-up (exactly one of the two
+    # is set). Rows are created with one bulk INSERT per request and listed
+    # through prefetch_related("attachments").
+    ticket = models.ForeignKey(
+        Ticket,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="attachments",
+    )
+    followup = models.ForeignKey(
+        TicketFollowUp,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="attachments",
+    )
+    file = models.FileField(
+        upload_to=custom_file_upload_path,
+        storage=attachment_storage,
+        validators=[validate_file_size],
+    )
+    # Client-side file name; `file` holds the content-addressed name
+    name = models.CharField(max_length=255)
+    size = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(ticket__isnull=False, followup__isnull=True)
+                | models.Q(ticket__isnull=True, followup__isnull=False),
+                name="attachment_ticket_xor_followup",
+            ),
+        ]
+
+    def __str__(self):
+        return self.name
+
+    def delete(self, *args, **kwargs):
+        # The file is released by the background sweeper
+        with transaction.atomic():
+            queue_attachment_deletions([self.file.name])
+            return super().delete(*args, **kwargs)
+
+
+def create_attachments(files, ticket=None, followup=None):
+    # FileField.pre_save stores each upload during the INSERT, so the whole
+    # batch costs one statement on top of the storage writes.
+    return TicketAttachment.objects.bulk_create(
+        [
+            TicketAttachment(
+                ticket=ticket,
+                followup=followup,
+                file=uploaded,
+                name=os.path.basename(uploaded.name)[:255],
+                size=uploaded.size,
+            )
+            for uploaded in files
+        ]
+    )
+
+
+class ArchivedTicket(models.Model):
+    # A closed ticket moved out of the hot tables by `manage.py
+    # archive_tickets` (see tickets.archive), with its follow-ups and
+    # attachment rows as one zlib-compressed JSON document. Keeps the
+    # ticket's id, so links to it keep resolving.
+    id = models.BigIntegerField(primary_key=True)
+    creator = models.ForeignKey(User, on_delete=models.CASCADE)
+    opened_by_med_id = models.IntegerField(null=True, blank=True, db_index=True)
+    created_at = models.DateTimeField()
+    last_activity_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    data = models.BinaryField()
+
+    def __str__(self):
+        return f"Archived ticket {self.id}"
+
+
+class ArchivedFile(models.Model):
+    # Attachment files still owned by an archived ticket: keeps them out of
+    # the orphan sweep and lets the download views find them by their old
+    # follow-up / attachment id
+    ticket = models.ForeignKey(
+        ArchivedTicket, on_delete=models.CASCADE, related_name="files"
+    )
+    followup_id = models.BigIntegerField(null=True, blank=True, db_index=True)
+    attachment_id = models.BigIntegerField(null=True, blank=True, unique=True)
+    name = models.CharField(max_length=255, db_index=True)
 
-        # Call the parent class's delete method to delete the database record
-        super().delete(*args, **kwargs)
+    def __str__(self):
+        return self.name
@@ -0,0 +1,161 @@
+import re
+import threading
+
+from django.apps import apps
+from django.conf import settings
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from accounts.models import MedUser
+
+# Queue ranks of an open ticket for one med user (lower comes first); the
+# personal list is ordered by PERSONAL_ORDERING
+OFFERED_TO_ME = 0
+MY_SPECIALIZATION = 1
+UNROUTED = 2
+ELSEWHERE = 3
+PERSONAL_ORDERING = ("queue_rank", "created_at", "id")
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def normalize_specialization(value):
+    return " ".join((value or "").lower().split())
+
+
+class KeywordClassifier:
+    # Tags a ticket with the specialization whose keywords occur most often
+    # in its description ("" when none do). Keywords come from
+    # settings.TICKET_SPECIALIZATION_KEYWORDS; ties go to the first listed.
+
+    def __init__(self, keywords=None):
+        if keywords is None:
+            keywords = getattr(settings, "TICKET_SPECIALIZATION_KEYWORDS", {})
+        self.patterns = [
+            (
+                normalize_specialization(specialization),
+                re.compile(
+                    r"\b(?:%s)\b" % "|".join(re.escape(word) for word in words),
+                    re.IGNORECASE,
+                ),
+            )
+            for specialization, words in keywords.items()
+            if words
+        ]
+
+    def classify(self, description):
+        best, best_hits = "", 0
+        for specialization, pattern in self.patterns:
+            hits = len(pattern.findall(description or ""))
+            if hits > best_hits:
+                best, best_hits = specialization, hits
+        return best
+
+
+def get_classifier():
+    global _classifier
+    with _classifier_lock:
+        if _classifier is None:
+            _classifier = import_string(settings.TICKET_CLASSIFIER)()
+        return _classifier
+
+
+def reset_classifier():
+    # Drop the cached classifier, e.g. after overriding its settings
+    global _classifier
+    with _classifier_lock:
+        _classifier = None
+
+
+def med_user_loads(specialization):
+    # Active med users of a specialization with their load: open tickets
+    # offered to them plus claimed tickets whose last word is the patient's
+    Ticket = apps.get_model("tickets", "Ticket")
+    offered = (
+        Ticket.objects.filter(is_open=True, offered_to_id=OuterRef("pk"))
+        .order_by()
+        .values("offered_to_id")
+        .annotate(n=Count("id"))
+        .values("n")
+    )
+    waiting = (
+        Ticket.objects.filter(
+            Q(last_followup_by_med=False) | Q(last_followup_by_med__isnull=True),
+            is_open=False,
+            opened_by_med_id=OuterRef("pk"),
+        )
+        .order_by()
+        .values("opened_by_med_id")
+        .annotate(n=Count("id"))
+        .values("n")
+    )
+    return (
+        MedUser.objects.filter(specialization__iexact=specialization, is_active=True)
+        .annotate(load=Coalesce(Subquery(offered), 0) + Coalesce(Subquery(waiting), 0))
+        .order_by("load", "id")
+    )
+
+
+def route_ticket(ticket):
+    # Tag a new ticket and offer it to the least-loaded med user with the
+    # matching specialization. Sets fields only; the caller saves.
+    if not ticket.specialization:
+        ticket.specialization = get_classifier().classify(ticket.description)
+    if ticket.specialization and ticket.offered_to_id is None:
+        ticket.offered_to_id = (
+            med_user_loads(ticket.specialization).values_list("id", flat=True).first()
+        )
+        if ticket.offered_to_id is not None:
+            ticket.offered_at = timezone.now()
+
+
+def med_user_specialization(med_user_id):
+    return normalize_specialization(
+        MedUser.objects.filter(pk=med_user_id)
+        .values_list("specialization", flat=True)
+        .first()
+    )
+
+
+def personal_segments(med_user_id, specialization=None):
+    # The open queue of one med user split by rank, [(rank, queryset), ...]
+    # lowest rank first: tickets offered to them, then untaken ones of their
+    # specialization, then untagged ones, then the rest. The parts are
+    # disjoint and each is ordered by ("created_at", "id") on one of the
+    # partial open-ticket indexes, so the personal list is read part by part
+    # (see api.pagination.SegmentedKeysetPagination) and never sorted whole.
+    Ticket = apps.get_model("tickets", "Ticket")
+    if specialization is None:
+        specialization = med_user_specialization(med_user_id)
+    open_tickets = Ticket.objects.filter(is_open=True).order_by("created_at", "id")
+    segments = [(OFFERED_TO_ME, open_tickets.filter(offered_to_id=med_user_id))]
+    if specialization:
+        segments.append(
+            (
+                MY_SPECIALIZATION,
+                open_tickets.filter(
+                    offered_to_id__isnull=True, specialization=specialization
+                ),
+            )
+        )
+    segments.append(
+        (UNROUTED, open_tickets.filter(offered_to_id__isnull=True, specialization=""))
+    )
+    segments.append(
+        (
+            ELSEWHERE,
+            open_tickets.exclude(offered_to_id=med_user_id).exclude(
+                offered_to_id__isnull=True, specialization__in=[specialization, ""]
+            ),
+        )
+    )
+    return segments
+
+
+def personal_queues(med_user_id, specialization=None):
+    # The querysets of personal_segments(): taking the head of the first
+    # non-empty one is O(log n)
+    return [queryset for _, queryset in personal_segments(med_user_id, specialization)]
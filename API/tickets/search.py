@@ -0,0 +1,262 @@
+import re
+
+from django.db import connection, connections
+from django.db.models import Exists, OuterRef, Q
+
+from .models import Ticket, TicketFollowUp
+
+# SQLite: one FTS5 table holding ticket descriptions (rowid = 2 * ticket id)
+# and follow-up bodies (rowid = 2 * follow-up id + 1), kept in sync by
+# triggers so every save, update() and cascade delete is covered. SQLite
+# migrations that rebuild a tickets table drop its triggers;
+# ensure_search_index() (run after every migrate) puts them back.
+# PostgreSQL: GIN expression indexes on to_tsvector(description) of both
+# tables, which the database maintains itself.
+# Anything else falls back to a (scanning) icontains filter.
+FTS_TABLE = "tickets_search"
+TS_CONFIG = "english"
+
+SQLITE_CREATE = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "body, ticket_id UNINDEXED, tokenize='porter unicode61')",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ticket_ai
+    AFTER INSERT ON tickets_ticket BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, body, ticket_id)
+        VALUES (new.id * 2, new.description, new.id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ticket_au
+    AFTER UPDATE OF description ON tickets_ticket BEGIN
+        UPDATE {FTS_TABLE} SET body = new.description WHERE rowid = new.id * 2;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ticket_ad
+    AFTER DELETE ON tickets_ticket BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id * 2;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_followup_ai
+    AFTER INSERT ON tickets_ticketfollowup BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, body, ticket_id)
+        VALUES (new.id * 2 + 1, new.description, new.root_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_followup_au
+    AFTER UPDATE OF description ON tickets_ticketfollowup BEGIN
+        UPDATE {FTS_TABLE} SET body = new.description
+        WHERE rowid = new.id * 2 + 1;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_followup_ad
+    AFTER DELETE ON tickets_ticketfollowup BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id * 2 + 1;
+    END""",
+]
+SQLITE_TRIGGERS = [
+    f"{FTS_TABLE}_{name}"
+    for name in (
+        "ticket_ai",
+        "ticket_au",
+        "ticket_ad",
+        "followup_ai",
+        "followup_au",
+        "followup_ad",
+    )
+]
+SQLITE_DROP = [f"DROP TRIGGER IF EXISTS {name}" for name in SQLITE_TRIGGERS] + [
+    f"DROP TABLE IF EXISTS {FTS_TABLE}"
+]
+SQLITE_REBUILD = [
+    f"DELETE FROM {FTS_TABLE}",
+    f"INSERT INTO {FTS_TABLE}(rowid, body, ticket_id) "
+    "SELECT id * 2, description, id FROM tickets_ticket",
+    f"INSERT INTO {FTS_TABLE}(rowid, body, ticket_id) "
+    "SELECT id * 2 + 1, description, root_id FROM tickets_ticketfollowup",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')",
+]
+
+POSTGRES_INDEXES = {
+    "ticket_description_fts_idx": "tickets_ticket",
+    "followup_description_fts_idx": "tickets_ticketfollowup",
+}
+POSTGRES_CREATE = [
+    f"CREATE INDEX IF NOT EXISTS {name} ON {table} "
+    f"USING gin (to_tsvector('{TS_CONFIG}', description))"
+    for name, table in POSTGRES_INDEXES.items()
+]
+POSTGRES_DROP = [f"DROP INDEX IF EXISTS {name}" for name in POSTGRES_INDEXES]
+POSTGRES_REBUILD = [f"REINDEX INDEX {name}" for name in POSTGRES_INDEXES]
+
+_backends = {}
+
+
+def search_backend(using=connection):
+    # "fts5", "postgres" or "fallback"; looked up once per database
+    key = (using.alias, using.settings_dict["NAME"])
+    if key not in _backends:
+        if using.vendor == "postgresql":
+            _backends[key] = "postgres"
+        elif (
+            using.vendor == "sqlite" and FTS_TABLE in using.introspection.table_names()
+        ):
+            _backends[key] = "fts5"
+        else:
+            _backends[key] = "fallback"
+    return _backends[key]
+
+
+def sqlite_has_fts5(using):
+    with using.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        options = {row[0] for row in cursor.fetchall()}
+    return "ENABLE_FTS5" in options
+
+
+def execute(using, statements):
+    with using.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def create_search_index(using=connection):
+    # Returns False when the database has no full-text support to offer
+    _backends.clear()
+    if using.vendor == "postgresql":
+        execute(using, POSTGRES_CREATE)
+        return True
+    if using.vendor == "sqlite" and sqlite_has_fts5(using):
+        execute(using, SQLITE_CREATE)
+        execute(using, SQLITE_REBUILD)
+        return True
+    return False
+
+
+def drop_search_index(using=connection):
+    _backends.clear()
+    if using.vendor == "postgresql":
+        execute(using, POSTGRES_DROP)
+    elif using.vendor == "sqlite":
+        execute(using, SQLITE_DROP)
+
+
+def ensure_search_index(using=connection):
+    # Restore SQLite triggers lost to a table rebuild and re-read the rows
+    # they may have missed
+    if using.vendor != "sqlite":
+        return
+    if FTS_TABLE not in using.introspection.table_names():
+        return
+    with using.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+        triggers = {row[0] for row in cursor.fetchall()}
+    if not set(SQLITE_TRIGGERS) <= triggers:
+        execute(using, SQLITE_CREATE)
+        execute(using, SQLITE_REBUILD)
+
+
+def ensure_search_index_after_migrate(using, **kwargs):
+    # post_migrate receiver, see TicketsConfig.ready(). Migrations may have
+    # created or dropped the index, so the backend is looked up again
+    _backends.clear()
+    ensure_search_index(connections[using])
+
+
+def rebuild_search_index(using=connection):
+    # Re-create the index objects if they are missing, then re-read every
+    # ticket and follow-up into them
+    if not create_search_index(using):
+        return False
+    if using.vendor == "postgresql":
+        execute(using, POSTGRES_REBUILD)
+    return True
+
+
+def search_terms(query):
+    return re.findall(r"\w+", query)[:16]
+
+
+def visible_tickets_sql(user):
+    # Same rules as the list endpoints: reg users see their own tickets, med
+    # users the open queue (ticket text only) and the tickets they claimed
+    if user.is_med_user:
+        return (
+            "(t.opened_by_med_id = %s OR (t.is_open AND {ticket_hit}))",
+            [user.id],
+        )
+    return "(t.creator_id = %s)", [user.id]
+
+
+def search_tickets(user, query, limit, offset=0):
+    # Ranked ticket ids (best first) whose description or follow-ups match
+    terms = search_terms(query)
+    if not terms:
+        return []
+    backend = search_backend()
+    if backend == "fts5":
+        return search_fts5(user, terms, limit, offset)
+    if backend == "postgres":
+        return search_postgres(user, terms, limit, offset)
+    return search_fallback(user, terms, limit, offset)
+
+
+def search_fts5(user, terms, limit, offset):
+    # Quoted terms are ANDed; the last one also matches as a prefix so
+    # search-as-you-type works
+    match = " ".join(f'"{term}"' for term in terms[:-1])
+    match = f'{match} "{terms[-1]}"*'.strip()
+    visible, params = visible_tickets_sql(user)
+    visible = visible.format(ticket_hit=f"{FTS_TABLE}.rowid %% 2 = 0")
+    sql = (
+        f"SELECT {FTS_TABLE}.ticket_id FROM {FTS_TABLE} "
+        f"JOIN tickets_ticket t ON t.id = {FTS_TABLE}.ticket_id "
+        f"WHERE {FTS_TABLE} MATCH %s AND {visible} "
+        f"GROUP BY {FTS_TABLE}.ticket_id "
+        f"ORDER BY MIN({FTS_TABLE}.rank), {FTS_TABLE}.ticket_id "
+        "LIMIT %s OFFSET %s"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [match, *params, limit, offset])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_postgres(user, terms, limit, offset):
+    query = " ".join(terms)
+    visible, params = visible_tickets_sql(user)
+    ticket_visible = visible.format(ticket_hit="TRUE")
+    followup_visible = visible.format(ticket_hit="FALSE")
+    document = f"to_tsvector('{TS_CONFIG}', {{table}}.description)"
+    sql = (
+        "WITH q AS (SELECT websearch_to_tsquery(%s::regconfig, %s) AS query) "
+        "SELECT id FROM ("
+        f"  SELECT t.id, ts_rank({document.format(table='t')}, q.query) AS rank"
+        "   FROM tickets_ticket t, q"
+        f"  WHERE {document.format(table='t')} @@ q.query AND {ticket_visible}"
+        "  UNION ALL"
+        f"  SELECT t.id, ts_rank({document.format(table='f')}, q.query)"
+        "   FROM tickets_ticketfollowup f"
+        "   JOIN tickets_ticket t ON t.id = f.root_id, q"
+        f"  WHERE {document.format(table='f')} @@ q.query AND {followup_visible}"
+        ") hits GROUP BY id ORDER BY MAX(rank) DESC, id LIMIT %s OFFSET %s"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [TS_CONFIG, query, *params, *params, limit, offset])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_fallback(user, terms, limit, offset):
+    # No full-text index on this database: unranked, most recent first
+    ticket_match = Q()
+    followup_match = Q()
+    for term in terms:
+        ticket_match &= Q(description__icontains=term)
+        followup_match &= Q(description__icontains=term)
+
+    if user.is_med_user:
+        claimed = Q(opened_by_med_id=user.id)
+        visible = claimed | Q(is_open=True)
+    else:
+        claimed = visible = Q(creator_id=user.id)
+    followup_hit = Exists(
+        TicketFollowUp.objects.filter(followup_match, root=OuterRef("pk"))
+    )
+    return list(
+        Ticket.objects.filter(visible)
+        .filter(ticket_match | (claimed & Q(followup_hit)))
+        .order_by("-last_activity_at", "-id")
+        .values_list("id", flat=True)[offset : offset + limit]
+    )
@@ -1,7 +1,32 @@
+from django.db import transaction
 from rest_framework import serializers
 from .models import *
 
 
+class TicketAttachmentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = TicketAttachment
+        fields = ("id", "name", "size", "file", "created_at")
+
+    file = serializers.FileField(use_url=False, read_only=True)
+
+
+class AttachmentsField(serializers.ListField):
+    # Writes take the repeated multipart "attachments" parts; reads list the
+    # (prefetched) TicketAttachment rows of the instance.
+    child = serializers.FileField(
+        allow_empty_file=False, use_url=False, validators=[validate_file_size]
+    )
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("required", False)
+        kwargs.setdefault("max_length", MAX_ATTACHMENTS_PER_REQUEST)
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return TicketAttachmentSerializer(value.all(), many=True).data
+
+
 class TicketSerializer(serializers.ModelSerializer):
     class Meta:
         model = Ticket
@@ -12,13 +37,36 @@ class TicketSerializer(serializers.ModelSerializer):
             "files",
             "is_open",
             "opened_by_med_id",
+            "attachments",
+            "followup_count",
+            "last_followup_at",
+            "last_followup_by_med",
+            "last_activity_at",
+            "specialization",
+            "offered_to_id",
         )  # Include other fields as needed
+        read_only_fields = (
+            "followup_count",
+            "last_followup_at",
+            "last_followup_by_med",
+            "last_activity_at",
+            "specialization",
+            "offered_to_id",
+        )
 
     creator_id = serializers.CharField(required=True)
     files = serializers.FileField(
         max_length=None, allow_empty_file=False, use_url=False, required=False
     )
     opened_by_med_id = serializers.CharField(required=False)
+    attachments = AttachmentsField()
+
+    def create(self, validated_data):
+        attachments = validated_data.pop("attachments", [])
+        with transaction.atomic():
+            instance = super().create(validated_data)
+            create_attachments(attachments, ticket=instance)
+        return instance
 
 
 class TicketUpdateSerializer(serializers.Serializer):
@@ -30,14 +78,24 @@ class TicketUpdateSerializer(serializers.Serializer):
     files = serializers.FileField(required=False)
 
     def update(self, instance, validated_data):
-        # Update the instance with validated data
+        # Update the instance with validated data. Only the edited columns
+        # are written: the row was loaded before a possibly slow upload, and
+        # claims or follow-ups committed meanwhile must not be overwritten.
+        update_fields = ["updated_at"]
         if validated_data.get("description"):
             instance.description = validated_data["description"]
-        if validated_data.get("files"):
-            instance.files = validated_data["files"]
-        # else:
-        #     instance.files = None
-        instance.save()
+            update_fields.append("description")
+        with transaction.atomic():
+            if validated_data.get("files"):
+                # The replaced attachment is released by the background
+                # sweeper, only if the row really stops pointing at it
+                if instance.files:
+                    queue_attachment_deletions([instance.files.name])
+                instance.files = validated_data["files"]
+                update_fields.append("files")
+            # else:
+            #     instance.files = None
+            instance.save(update_fields=update_fields)
         return instance
 
 
@@ -50,12 +108,28 @@ class TicketFollowUpSerializer(serializers.ModelSerializer):
             "is_medUser",
             "description",
             "files",
+            "attachments",
         )  # Include other fields as needed
 
     creator_id = serializers.CharField(required=True)
     files = serializers.FileField(
         max_length=None, allow_empty_file=True, use_url=False, required=False
     )
+    attachments = AttachmentsField()
+
+    def create(self, validated_data):
+        attachments = validated_data.pop("attachments", [])
+        with transaction.atomic():
+            instance = super().create(validated_data)
+            create_attachments(attachments, followup=instance)
+        return instance
+
+
+class TicketFollowUpBatchItemSerializer(serializers.ModelSerializer):
+    # One item of a batch follow-up request (JSON, so no files)
+    class Meta:
+        model = TicketFollowUp
+        fields = ("description",)
 
 
 class TicketFollowupUpdateSerializer(serializers.Serializer):
@@ -67,12 +141,22 @@ class TicketFollowupUpdateSerializer(serializers.Serializer):
     files = serializers.FileField(required=False)
 
     def update(self, instance, validated_data):
-        # Update the instance with validated data
+        # Update the instance with validated data. Only the edited columns
+        # are written: the row was loaded before a possibly slow upload, and
+        # claims or follow-ups committed meanwhile must not be overwritten.
+        update_fields = ["updated_at"]
         if validated_data.get("description"):
             instance.description = validated_data["description"]
-        if validated_data.get("files"):
-            instance.files = validated_data["files"]
-        # else:
-        #     instance.files = None
-        instance.save()
+            update_fields.append("description")
+        with transaction.atomic():
+            if validated_data.get("files"):
+                # The replaced attachment is released by the background
+                # sweeper, only if the row really stops pointing at it
+                if instance.files:
+                    queue_attachment_deletions([instance.files.name])
+                instance.files = validated_data["files"]
+                update_fields.append("files")
+            # else:
+            #     instance.files = None
+            instance.save(update_fields=update_fields)
         return instance
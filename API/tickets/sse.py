@@ -0,0 +1,222 @@
+import asyncio
+import json
+import re
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from accounts.authentication import ClaimsJWTAuthentication
+
+from .events import SubscriberOverflow, followup_message, get_broker, ticket_channel
+from .models import Ticket, TicketFollowUp
+
+EVENTS_PATH_RE = re.compile(r"^/api/ticket/(?P<ticket_id>\d+)/events/$")
+# Follow-ups replayed on reconnect; clients further behind re-read the list
+REPLAY_LIMIT = 100
+RETRY_MS = 3000
+ERRORS = {
+    401: {"detail": "Given token not valid for any token type"},
+    403: {"error": "Access Denied"},
+    404: {"error": "Ticket not found."},
+}
+
+
+def database_sync_to_async(func):
+    # The router bypasses Django's request signals, so manage the thread's
+    # connection the way a request would
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(wrapper)
+
+
+def authorize(raw_token, ticket_id):
+    # Same rule as the follow-up list: the ticket's creator or its med user.
+    # Returns an error status, or None when the subscriber may listen.
+    authentication = ClaimsJWTAuthentication()
+    try:
+        user = authentication.get_user(authentication.get_validated_token(raw_token))
+    except (InvalidToken, AuthenticationFailed):
+        return 401
+
+    ticket = (
+        Ticket.objects.filter(pk=ticket_id)
+        .values("creator_id", "opened_by_med_id")
+        .first()
+    )
+    if ticket is None:
+        return 404
+    if user.id != ticket["creator_id"] and user.id != ticket["opened_by_med_id"]:
+        return 403
+    return None
+
+
+def replay_followups(ticket_id, since):
+    followups = (
+        TicketFollowUp.objects.filter(root_id=ticket_id, sequence_number__gt=since)
+        .prefetch_related("attachments")
+        .order_by("sequence_number")[:REPLAY_LIMIT]
+    )
+    return [followup_message(followup) for followup in followups]
+
+
+def encode_event(message):
+    data = json.dumps(message["data"], cls=JSONEncoder)
+    return f"id: {message['id']}\nevent: {message['event']}\ndata: {data}\n\n".encode()
+
+
+def request_token(headers, query):
+    # EventSource cannot set headers, so ?token= is accepted as well
+    authorization = headers.get(b"authorization", b"").decode("latin-1").split()
+    if len(authorization) == 2 and authorization[0] == "Bearer":
+        return authorization[1]
+    return query.get("token", [None])[0]
+
+
+def last_event_id(headers, query):
+    value = (
+        headers.get(b"last-event-id", b"").decode("latin-1")
+        or query.get("since", [""])[0]
+    )
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+async def send_json(send, status, data):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json")],
+        }
+    )
+    await send({"type": "http.response.body", "body": json.dumps(data).encode()})
+
+
+async def wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def ticket_events(scope, receive, send, ticket_id):
+    # GET /api/ticket/<id>/events/ -- one long-lived text/event-stream per
+    # open thread instead of polling the follow-up list. Every follow-up
+    # created on the ticket is pushed as a "followup" event whose id is its
+    # sequence number; reconnecting with Last-Event-ID (or ?since=) replays
+    # what was missed.
+    if scope["method"] != "GET":
+        await send_json(
+            send, 405, {"detail": 'Method "%s" not allowed.' % scope["method"]}
+        )
+        return
+
+    headers = dict(scope["headers"])
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    raw_token = request_token(headers, query)
+    if not raw_token:
+        await send_json(
+            send, 401, {"detail": "Authentication credentials were not provided."}
+        )
+        return
+    error = await database_sync_to_async(authorize)(raw_token, ticket_id)
+    if error:
+        await send_json(send, error, ERRORS[error])
+        return
+
+    since = last_event_id(headers, query)
+    heartbeat = settings.TICKET_EVENTS_HEARTBEAT
+
+    # Subscribe before reading the backlog so nothing created in between is
+    # lost; the sequence numbers drop the duplicates.
+    async with get_broker().subscribe(ticket_channel(ticket_id)) as subscription:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-cache"),
+                    # keep nginx from buffering the stream
+                    (b"x-accel-buffering", b"no"),
+                ],
+            }
+        )
+        await send(
+            {
+                "type": "http.response.body",
+                "body": f"retry: {RETRY_MS}\n\n".encode(),
+                "more_body": True,
+            }
+        )
+
+        last_sent = since or 0
+        if since is not None:
+            for message in await database_sync_to_async(replay_followups)(
+                ticket_id, since
+            ):
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": encode_event(message),
+                        "more_body": True,
+                    }
+                )
+                last_sent = message["id"]
+
+        disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+        try:
+            while True:
+                get = asyncio.ensure_future(subscription.get())
+                done, _ = await asyncio.wait(
+                    {get, disconnect},
+                    timeout=heartbeat,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if disconnect in done:
+                    get.cancel()
+                    return
+                if get not in done:
+                    get.cancel()
+                    body = b": keepalive\n\n"
+                else:
+                    message = get.result()
+                    if message["id"] <= last_sent:
+                        continue
+                    last_sent = message["id"]
+                    body = encode_event(message)
+                await send(
+                    {"type": "http.response.body", "body": body, "more_body": True}
+                )
+        except SubscriberOverflow:
+            # Too far behind: end the stream, the client reconnects with
+            # Last-Event-ID and catches up from the database
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            disconnect.cancel()
+
+
+def ticket_events_router(application):
+    # Wraps the Django ASGI application: the event streams are served here,
+    # every other request goes to Django unchanged
+    async def router(scope, receive, send):
+        if scope["type"] == "http":
+            match = EVENTS_PATH_RE.match(scope["path"])
+            if match:
+                await ticket_events(scope, receive, send, int(match["ticket_id"]))
+                return
+        await application(scope, receive, send)
+
+    return router
@@ -0,0 +1,200 @@
+import math
+import random
+from collections import Counter
+
+from django.apps import apps
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+
+OPEN_QUEUE = "open_queue"
+CLAIMED_PREFIX = "claimed:"
+
+# Every counter is spread over a few rows so concurrent writers rarely wait
+# on the same row lock; reads sum the shards.
+COUNTER_SHARDS = 8
+
+# Time to first response is kept as a DDSketch: counts per logarithmic
+# bucket, every quantile within RELATIVE_ACCURACY of the true value. A
+# sample costs one UPDATE, a read is a few hundred rows at most, however
+# many tickets there are.
+RELATIVE_ACCURACY = 0.02
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+MIN_SECONDS = 1.0
+
+
+def claimed_counter(med_user_id):
+    return f"{CLAIMED_PREFIX}{med_user_id}"
+
+
+def bump_counter(name, delta=1):
+    StatCounter = apps.get_model("tickets", "StatCounter")
+    shard = random.randrange(COUNTER_SHARDS)
+    counter = StatCounter.objects.filter(name=name, shard=shard)
+    if counter.update(value=F("value") + delta):
+        return
+    try:
+        with transaction.atomic():
+            StatCounter.objects.create(name=name, shard=shard, value=delta)
+    except IntegrityError:
+        # Created concurrently
+        counter.update(value=F("value") + delta)
+
+
+def ticket_opened(ticket):
+    if ticket.is_open:
+        bump_counter(OPEN_QUEUE)
+    elif ticket.opened_by_med_id:
+        bump_counter(claimed_counter(ticket.opened_by_med_id))
+
+
+def ticket_claimed(med_user_id):
+    bump_counter(OPEN_QUEUE, -1)
+    bump_counter(claimed_counter(med_user_id))
+
+
+def ticket_removed(ticket):
+    if ticket.is_open:
+        bump_counter(OPEN_QUEUE, -1)
+    elif ticket.opened_by_med_id:
+        bump_counter(claimed_counter(ticket.opened_by_med_id), -1)
+
+
+def bucket_index(seconds):
+    return math.ceil(math.log(max(seconds, MIN_SECONDS), GAMMA))
+
+
+def bucket_value(index):
+    # Midpoint (in relative terms) of (GAMMA ** (index - 1), GAMMA ** index]
+    return 2 * GAMMA**index / (GAMMA + 1)
+
+
+def record_response_time(seconds):
+    ResponseTimeBucket = apps.get_model("tickets", "ResponseTimeBucket")
+    index = bucket_index(seconds)
+    bucket = ResponseTimeBucket.objects.filter(index=index)
+    if bucket.update(count=F("count") + 1):
+        return
+    try:
+        with transaction.atomic():
+            ResponseTimeBucket.objects.create(index=index, count=1)
+    except IntegrityError:
+        bucket.update(count=F("count") + 1)
+
+
+def response_time_quantiles(quantiles=(0.5, 0.9, 0.99)):
+    ResponseTimeBucket = apps.get_model("tickets", "ResponseTimeBucket")
+    buckets = list(
+        ResponseTimeBucket.objects.filter(count__gt=0)
+        .order_by("index")
+        .values_list("index", "count")
+    )
+    total = sum(count for _, count in buckets)
+    result = {"count": total}
+    for quantile in quantiles:
+        key = f"p{round(quantile * 100)}"
+        if not total:
+            result[key] = None
+            continue
+        rank = quantile * (total - 1)
+        seen = 0
+        for index, count in buckets:
+            seen += count
+            if seen > rank:
+                result[key] = round(bucket_value(index), 1)
+                break
+    return result
+
+
+def dashboard_stats(med_user_id):
+    StatCounter = apps.get_model("tickets", "StatCounter")
+    open_queue = StatCounter.objects.filter(name=OPEN_QUEUE).aggregate(
+        total=Sum("value")
+    )["total"]
+    claimed = (
+        StatCounter.objects.filter(name__startswith=CLAIMED_PREFIX)
+        .values("name")
+        .annotate(total=Sum("value"))
+        .filter(total__gt=0)
+        .order_by("-total", "name")
+    )
+    per_med_user = [
+        {
+            "med_user_id": int(row["name"][len(CLAIMED_PREFIX) :]),
+            "claimed": row["total"],
+        }
+        for row in claimed
+    ]
+    return {
+        "open_queue": open_queue or 0,
+        "claimed_by_me": next(
+            (
+                row["claimed"]
+                for row in per_med_user
+                if row["med_user_id"] == med_user_id
+            ),
+            0,
+        ),
+        "claimed_per_med_user": per_med_user,
+        "first_response_seconds": response_time_quantiles(),
+    }
+
+
+def reconcile_counters():
+    # Recompute every counter from the ticket table. The counter rows are
+    # locked first: writers that already bumped are committed and counted,
+    # writers that bump later wait and then add on top of the exact value.
+    Ticket = apps.get_model("tickets", "Ticket")
+    StatCounter = apps.get_model("tickets", "StatCounter")
+
+    with transaction.atomic():
+        list(StatCounter.objects.select_for_update().order_by("pk"))
+        expected = {OPEN_QUEUE: Ticket.objects.filter(is_open=True).count()}
+        claimed = (
+            Ticket.objects.filter(is_open=False, opened_by_med_id__isnull=False)
+            .values("opened_by_med_id")
+            .annotate(n=Count("id"))
+            .values_list("opened_by_med_id", "n")
+        )
+        for med_user_id, count in claimed:
+            expected[claimed_counter(med_user_id)] = count
+
+        current = dict(
+            StatCounter.objects.values("name")
+            .annotate(total=Sum("value"))
+            .values_list("name", "total")
+        )
+        changed = 0
+        for name in set(current) | set(expected):
+            value = expected.get(name, 0)
+            if current.get(name) == value:
+                continue
+            StatCounter.objects.filter(name=name).delete()
+            if value:
+                StatCounter.objects.create(name=name, shard=0, value=value)
+            changed += 1
+    return changed
+
+
+def rebuild_response_time_sketch(chunk_size=2000):
+    # Full pass over Ticket.first_response_at; only for repairs
+    Ticket = apps.get_model("tickets", "Ticket")
+    ResponseTimeBucket = apps.get_model("tickets", "ResponseTimeBucket")
+
+    counts = Counter()
+    rows = (
+        Ticket.objects.filter(first_response_at__isnull=False)
+        .values_list("created_at", "first_response_at")
+        .iterator(chunk_size=chunk_size)
+    )
+    for created_at, first_response_at in rows:
+        counts[bucket_index((first_response_at - created_at).total_seconds())] += 1
+
+    with transaction.atomic():
+        ResponseTimeBucket.objects.all().delete()
+        ResponseTimeBucket.objects.bulk_create(
+            [
+                ResponseTimeBucket(index=index, count=count)
+                for index, count in counts.items()
+            ]
+        )
+    return sum(counts.values())
@@ -0,0 +1,89 @@
+import hashlib
+import os
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    # Stores every attachment once under the SHA-256 of its content
+    # (ticket_files/ab/abcdef....pdf) and keeps a reference count per blob in
+    # AttachmentBlob. Re-sending the same file costs no disk write, and a blob
+    # is only removed from disk when the last reference goes away.
+    chunk_size = 64 * 1024
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is the content digest, decided in _save()
+        return name
+
+    def digest_name(self, name, content):
+        sha256 = hashlib.sha256()
+        if hasattr(content, "seek"):
+            content.seek(0)
+        for chunk in content.chunks(self.chunk_size):
+            sha256.update(chunk)
+        if hasattr(content, "seek"):
+            content.seek(0)
+        digest = sha256.hexdigest()
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(directory, digest[:2], digest + extension).replace(
+            "\\", "/"
+        )
+
+    def _save(self, name, content):
+        AttachmentBlob = apps.get_model("tickets", "AttachmentBlob")
+        name = self.digest_name(name, content)
+
+        with transaction.atomic():
+            blob = self.lock_blob(name)
+            if blob is None:
+                try:
+                    with transaction.atomic():
+                        AttachmentBlob.objects.create(
+                            name=name, size=content.size, ref_count=1
+                        )
+                except IntegrityError:
+                    # Someone stored the same content concurrently
+                    blob = self.lock_blob(name)
+
+            if blob is not None:
+                AttachmentBlob.objects.filter(pk=blob.pk).update(
+                    ref_count=F("ref_count") + 1
+                )
+
+            # Only the first reference (or a blob missing on disk) is written.
+            # The row lock keeps a concurrent delete from racing the write.
+            if not super().exists(name):
+                name = super()._save(name, content)
+            return name
+
+    def lock_blob(self, name):
+        AttachmentBlob = apps.get_model("tickets", "AttachmentBlob")
+        return AttachmentBlob.objects.select_for_update().filter(name=name).first()
+
+    def delete(self, name):
+        # Drop one reference; only the last one removes the file. Files stored
+        # before this backend existed have no blob row and are removed as-is.
+        AttachmentBlob = apps.get_model("tickets", "AttachmentBlob")
+        if not name:
+            raise ValueError("The name must be given to delete().")
+
+        with transaction.atomic():
+            blob = self.lock_blob(name)
+            if blob is None:
+                return super().delete(name)
+            if blob.ref_count > 1:
+                AttachmentBlob.objects.filter(pk=blob.pk).update(
+                    ref_count=F("ref_count") - 1
+                )
+                return
+            blob.delete()
+            super().delete(name)
+
+
+attachment_storage = ContentAddressedStorage()
@@ -0,0 +1,145 @@
+import logging
+import os
+import time
+from collections import Counter
+
+from django.db import connection, transaction
+from django.db.models import Count
+
+from .models import (
+    ArchivedFile,
+    AttachmentBlob,
+    AttachmentDeletion,
+    Ticket,
+    TicketAttachment,
+    TicketFollowUp,
+)
+from .storage import attachment_storage
+
+logger = logging.getLogger(__name__)
+
+ATTACHMENT_DIR = "ticket_files"
+
+
+def attachment_fields():
+    # Every (model, field name) whose column points into attachment_storage
+    return [
+        (Ticket, "files"),
+        (TicketFollowUp, "files"),
+        (TicketAttachment, "file"),
+        (ArchivedFile, "name"),
+    ]
+
+
+def sweep_deletion_queue(batch_size=500):
+    # Release queued attachment references in batches. Concurrent sweepers
+    # skip each other's rows where the backend supports SKIP LOCKED.
+    released = 0
+    while True:
+        with transaction.atomic():
+            queue = AttachmentDeletion.objects.order_by("id")
+            if connection.features.has_select_for_update_skip_locked:
+                queue = queue.select_for_update(skip_locked=True)
+            batch = list(queue[:batch_size])
+            if not batch:
+                break
+
+            done = []
+            for item in batch:
+                try:
+                    attachment_storage.delete(item.name)
+                except OSError:
+                    # Left in the queue and retried on the next run
+                    logger.exception("Could not delete attachment %s", item.name)
+                    continue
+                done.append(item.pk)
+            AttachmentDeletion.objects.filter(pk__in=done).delete()
+
+        released += len(done)
+        if len(done) < len(batch):
+            break
+    return released
+
+
+def iter_attachment_files(min_age):
+    root = attachment_storage.path(ATTACHMENT_DIR)
+    cutoff = time.time() - min_age
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            try:
+                if os.path.getmtime(path) > cutoff:
+                    # Possibly an upload still in flight
+                    continue
+            except FileNotFoundError:
+                continue
+            name = os.path.relpath(path, attachment_storage.location)
+            yield name.replace("\\", "/")
+
+
+def sweep_orphans(min_age=3600, batch_size=500):
+    # Remove files under ticket_files/ that no row references any more and
+    # repair blob reference counts that drifted (e.g. a failed insert after
+    # the upload was stored). Returns the number of files removed.
+    removed = 0
+    batch = []
+    for name in iter_attachment_files(min_age):
+        batch.append(name)
+        if len(batch) >= batch_size:
+            removed += sweep_orphan_batch(batch)
+            batch = []
+    if batch:
+        removed += sweep_orphan_batch(batch)
+    return removed
+
+
+def sweep_orphan_batch(names):
+    blobs = dict(
+        AttachmentBlob.objects.filter(name__in=names).values_list("name", "ref_count")
+    )
+    references = Counter()
+    for model, field in attachment_fields():
+        references.update(
+            dict(
+                model.objects.filter(**{f"{field}__in": names})
+                .values(field)
+                .annotate(n=Count("id"))
+                .values_list(field, "n")
+            )
+        )
+    # Queued deletions still own their reference until the queue is swept
+    references.update(
+        dict(
+            AttachmentDeletion.objects.filter(name__in=names)
+            .values("name")
+            .annotate(n=Count("id"))
+            .values_list("name", "n")
+        )
+    )
+
+    removed = 0
+    for name in names:
+        expected = references[name]
+        snapshot = blobs.get(name)
+        with transaction.atomic():
+            if snapshot is not None:
+                # A concurrent upload of the same content bumps ref_count;
+                # only act if the row is still what we counted against.
+                blob = attachment_storage.lock_blob(name)
+                if blob is None or blob.ref_count != snapshot:
+                    continue
+                if expected:
+                    if blob.ref_count != expected:
+                        AttachmentBlob.objects.filter(pk=blob.pk).update(
+                            ref_count=expected
+                        )
+                    continue
+                blob.delete()
+            elif expected:
+                continue
+            try:
+                os.remove(attachment_storage.path(name))
+            except FileNotFoundError:
+                continue
+            removed += 1
+    return removed
@@ -1,3 +1,1151 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, connection, connections
+from django.test import (
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from accounts.models import MedUser, RegUser
+from accounts.serializers import MyTokenObtainPairSerializer
+from tickets.archive import archive_tickets
+from tickets.events import get_broker, reset_broker
+from tickets.models import (
+    CLAIM_CONTENDED,
+    MAX_ATTACHMENT_SIZE,
+    AttachmentBlob,
+    AttachmentDeletion,
+    Ticket,
+    TicketFollowUp,
+    claim_next_ticket,
+    claim_ticket,
+    create_attachments,
+    queue_attachment_deletions,
+)
+from tickets.routing import personal_queues, reset_classifier
+from tickets.search import FTS_TABLE, search_backend, search_fallback
+from tickets.serializers import TicketFollowupUpdateSerializer, TicketUpdateSerializer
+from tickets.sse import ticket_events_router
+from tickets.stats import dashboard_stats, reconcile_counters
+from tickets.storage import attachment_storage
+from tickets.sweeper import sweep_deletion_queue, sweep_orphans
+from tickets.uploadhandlers import (
+    AttachmentTooLarge,
+    AttachmentTypeNotAllowed,
+    LimitedAttachmentUploadHandler,
+    get_upload_bytes,
+)
+
+
+def streamed_body(response):
+    content = b"".join(response.streaming_content)
+    # response.close() would also fire request_finished
+    if getattr(response, "file_to_stream", None):
+        response.file_to_stream.close()
+    return content
+
+
+class TemporaryMediaMixin:
+    # Attachments are written to a throwaway MEDIA_ROOT
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_override = override_settings(MEDIA_ROOT=media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+
+class TicketFollowUpSequenceTest(TestCase):
+    def setUp(self):
+        self.user = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+        self.ticket = Ticket.objects.create(creator=self.user, description="help")
+
+    def test_sequence_numbers_increase_per_ticket(self):
+        other = Ticket.objects.create(creator=self.user, description="other")
+        for _ in range(3):
+            TicketFollowUp.objects.create(
+                root=self.ticket, creator=self.user, is_medUser=False, description="x"
+            )
+        followup = TicketFollowUp.objects.create(
+            root=other, creator=self.user, is_medUser=False, description="y"
+        )
+
+        numbers = list(
+            TicketFollowUp.objects.filter(root=self.ticket)
+            .order_by("sequence_number")
+            .values_list("sequence_number", flat=True)
+        )
+        self.assertEqual(numbers, [1, 2, 3])
+        self.assertEqual(followup.sequence_number, 1)
+        self.ticket.refresh_from_db()
+        self.assertEqual(self.ticket.last_sequence_number, 3)
+
+
+class TicketThreadSummaryTest(TestCase):
+    def setUp(self):
+        self.user = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+        self.ticket = Ticket.objects.create(creator=self.user, description="help")
+
+    def test_summary_follows_creates_and_deletes(self):
+        first = TicketFollowUp.objects.create(
+            root=self.ticket, creator=self.user, is_medUser=False, description="x"
+        )
+        last = TicketFollowUp.objects.create(
+            root=self.ticket, creator=self.user, is_medUser=True, description="y"
+        )
+        self.ticket.refresh_from_db()
+        self.assertEqual(self.ticket.followup_count, 2)
+        self.assertEqual(self.ticket.last_followup_at, last.created_at)
+        self.assertTrue(self.ticket.last_followup_by_med)
+        self.assertEqual(self.ticket.last_activity_at, last.created_at)
+
+        last.delete()
+        self.ticket.refresh_from_db()
+        self.assertEqual(self.ticket.followup_count, 1)
+        self.assertEqual(self.ticket.last_followup_at, first.created_at)
+        self.assertFalse(self.ticket.last_followup_by_med)
+
+        first.delete()
+        self.ticket.refresh_from_db()
+        self.assertEqual(self.ticket.followup_count, 0)
+        self.assertIsNone(self.ticket.last_followup_at)
+        self.assertEqual(self.ticket.last_activity_at, self.ticket.created_at)
+
+
+class TicketFileReplaceTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+        self.ticket = Ticket.objects.create(
+            creator=self.user,
+            description="help",
+            files=ContentFile(b"old scan", name="old.txt"),
+        )
+        self.followup = TicketFollowUp.objects.create(
+            root=self.ticket,
+            creator=self.user,
+            is_medUser=False,
+            description="x",
+            files=ContentFile(b"old photo", name="old.txt"),
+        )
+
+    def replace(self, serializer_class, instance):
+        serializer = serializer_class(
+            instance,
+            data={"files": SimpleUploadedFile("new.txt", b"new")},
+            partial=True,
+        )
+        serializer.is_valid(raise_exception=True)
+        return serializer.save()
+
+    def test_failed_save_does_not_release_the_old_file(self):
+        for serializer_class, instance in (
+            (TicketUpdateSerializer, self.ticket),
+            (TicketFollowupUpdateSerializer, self.followup),
+        ):
+            with mock.patch.object(
+                type(instance), "save", side_effect=DatabaseError("boom")
+            ):
+                with self.assertRaises(DatabaseError):
+                    self.replace(serializer_class, instance)
+        self.assertFalse(AttachmentDeletion.objects.exists())
+
+    def test_replaced_file_is_queued_for_release(self):
+        old_name = self.ticket.files.name
+        self.replace(TicketUpdateSerializer, self.ticket)
+        self.assertEqual(
+            list(AttachmentDeletion.objects.values_list("name", flat=True)),
+            [old_name],
+        )
+
+    def test_edit_keeps_a_claim_made_during_the_upload(self):
+        med = MedUser.objects.create_meduser(
+            "doc@example.com",
+            "Doc",
+            "pass1234",
+            is_med_user=True,
+            qualification="MBBS",
+            specialization="GP",
+        )
+        file_complete = LimitedAttachmentUploadHandler.file_complete
+
+        def claim_during_upload(handler, file_size):
+            claim_ticket(self.ticket.id, med.id)
+            TicketFollowUp.objects.create(
+                root=self.ticket, creator=med, is_medUser=True, description="seen"
+            )
+            return file_complete(handler, file_size)
+
+        token = MyTokenObtainPairSerializer.get_token(self.user).access_token
+        with mock.patch.object(
+            LimitedAttachmentUploadHandler, "file_complete", claim_during_upload
+        ):
+            response = self.client.put(
+                f"/api/ticket/{self.ticket.id}/update/",
+                encode_multipart(
+                    BOUNDARY,
+                    {
+                        "description": "edited",
+                        "files": SimpleUploadedFile("scan.pdf", b"%PDF-new"),
+                    },
+                ),
+                content_type=MULTIPART_CONTENT,
+                HTTP_AUTHORIZATION=f"Bearer {token}",
+            )
+        self.assertEqual(response.status_code, 200)
+
+        self.ticket.refresh_from_db()
+        self.assertEqual(self.ticket.description, "edited")
+        self.assertTrue(self.ticket.files.name.endswith(".pdf"))
+        self.assertFalse(self.ticket.is_open)
+        self.assertEqual(self.ticket.opened_by_med_id, med.id)
+        # followup in setUp plus the med reply
+        self.assertEqual(self.ticket.last_sequence_number, 2)
+        self.assertEqual(self.ticket.followup_count, 2)
+        self.assertTrue(self.ticket.last_followup_by_med)
+        followup = TicketFollowUp.objects.create(
+            root=self.ticket, creator=self.user, is_medUser=False, description="ok"
+        )
+        self.assertEqual(followup.sequence_number, 3)
+
+    def test_followup_edit_writes_only_the_edited_columns(self):
+        stale = TicketFollowUp.objects.get(pk=self.followup.pk)
+        TicketFollowUp.objects.filter(pk=self.followup.pk).update(is_medUser=True)
+        with CaptureQueriesContext(connection) as queries:
+            self.replace(TicketFollowupUpdateSerializer, stale)
+        update = next(q["sql"] for q in queries if q["sql"].startswith("UPDATE"))
+        self.assertNotIn("is_medUser", update)
+        self.followup.refresh_from_db()
+        self.assertTrue(self.followup.is_medUser)
+        self.assertTrue(self.followup.files.name.endswith(".txt"))
+
+
+class AttachmentStorageTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+
+    def create_ticket(self, content, name="scan.pdf"):
+        return Ticket.objects.create(
+            creator=self.user,
+            description="help",
+            files=ContentFile(content, name=name),
+        )
+
+    def test_same_content_is_stored_once(self):
+        first = self.create_ticket(b"%PDF- same scan")
+        second = self.create_ticket(b"%PDF- same scan", name="copy.PDF")
+        other = self.create_ticket(b"%PDF- other scan")
+
+        digest = hashlib.sha256(b"%PDF- same scan").hexdigest()
+        self.assertEqual(first.files.name, f"ticket_files/{digest[:2]}/{digest}.pdf")
+        self.assertEqual(second.files.name, first.files.name)
+        self.assertNotEqual(other.files.name, first.files.name)
+        self.assertEqual(
+            dict(AttachmentBlob.objects.values_list("name", "ref_count")),
+            {first.files.name: 2, other.files.name: 1},
+        )
+        self.assertEqual(len(os.listdir(os.path.dirname(first.files.path))), 1)
+
+    def test_last_reference_removes_the_file(self):
+        first = self.create_ticket(b"%PDF- same scan")
+        second = self.create_ticket(b"%PDF- same scan")
+        name, path = first.files.name, first.files.path
+
+        first.delete()
+        # Nothing leaves the disk until the sweeper runs
+        self.assertEqual(AttachmentBlob.objects.get(name=name).ref_count, 2)
+        self.assertEqual(sweep_deletion_queue(), 1)
+        self.assertEqual(AttachmentBlob.objects.get(name=name).ref_count, 1)
+        self.assertTrue(os.path.exists(path))
+
+        second.delete()
+        self.assertEqual(sweep_deletion_queue(), 1)
+        self.assertFalse(AttachmentBlob.objects.filter(name=name).exists())
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(AttachmentDeletion.objects.exists())
+
+    def test_file_without_blob_row_is_removed_as_is(self):
+        name = attachment_storage.save("ticket_files/legacy.pdf", ContentFile(b"%PDF-"))
+        AttachmentBlob.objects.filter(name=name).delete()
+        attachment_storage.delete(name)
+        self.assertFalse(attachment_storage.exists(name))
+
+
+class OrphanSweepTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+
+    def backdate(self, path, age=2 * 3600):
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+
+    def store(self, content, age=2 * 3600):
+        # A blob on disk (and in AttachmentBlob) last written `age` seconds ago
+        name = attachment_storage.save("ticket_files/scan.pdf", ContentFile(content))
+        path = attachment_storage.path(name)
+        self.backdate(path, age)
+        return name, path
+
+    def test_unreferenced_old_file_is_removed(self):
+        name, path = self.store(b"%PDF- orphan")
+        legacy = attachment_storage.path("ticket_files/legacy.pdf")
+        with open(legacy, "wb") as f:
+            f.write(b"%PDF- no blob row")
+        self.backdate(legacy)
+
+        self.assertEqual(sweep_orphans(min_age=3600), 2)
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(legacy))
+        self.assertFalse(AttachmentBlob.objects.filter(name=name).exists())
+
+    def test_referenced_file_is_kept(self):
+        ticket = Ticket.objects.create(
+            creator=self.user,
+            description="help",
+            files=ContentFile(b"%PDF- kept", name="scan.pdf"),
+        )
+        path = ticket.files.path
+        self.backdate(path)
+        # A queued deletion still owns its reference too
+        queued, queued_path = self.store(b"%PDF- queued")
+        queue_attachment_deletions([queued])
+
+        self.assertEqual(sweep_orphans(min_age=3600), 0)
+        self.assertTrue(os.path.exists(path))
+        self.assertTrue(os.path.exists(queued_path))
+        self.assertEqual(
+            AttachmentBlob.objects.get(name=ticket.files.name).ref_count, 1
+        )
+
+    def test_young_orphan_is_skipped(self):
+        name, path = self.store(b"%PDF- uploading", age=0)
+        self.assertEqual(sweep_orphans(min_age=3600), 0)
+        self.assertTrue(os.path.exists(path))
+        self.assertTrue(AttachmentBlob.objects.filter(name=name).exists())
+
+    def test_drifted_ref_count_is_repaired(self):
+        first = Ticket.objects.create(
+            creator=self.user,
+            description="help",
+            files=ContentFile(b"%PDF- shared", name="scan.pdf"),
+        )
+        Ticket.objects.create(
+            creator=self.user,
+            description="again",
+            files=ContentFile(b"%PDF- shared", name="scan.pdf"),
+        )
+        name, path = first.files.name, first.files.path
+        self.backdate(path)
+        AttachmentBlob.objects.filter(name=name).update(ref_count=5)
+
+        self.assertEqual(sweep_orphans(min_age=3600), 0)
+        self.assertEqual(AttachmentBlob.objects.get(name=name).ref_count, 2)
+        self.assertTrue(os.path.exists(path))
+
+
+class LimitedUploadTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+        token = MyTokenObtainPairSerializer.get_token(self.user).access_token
+        self.auth = {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+
+    def stream(self, chunks):
+        # Feeds the chunks one by one; self.consumed counts those read
+        request = RequestFactory().post("/")
+        request.user = self.user
+        handler = LimitedAttachmentUploadHandler(request)
+        handler.new_file("attachments", "scan.pdf", "application/pdf", None)
+        self.consumed = 0
+        for chunk in chunks:
+            self.consumed += 1
+            handler.receive_data_chunk(chunk, 0)
+        handler.file_complete(handler.received)
+
+    def create(self, content, name="scan.pdf"):
+        return self.client.post(
+            "/api/ticket/create/",
+            {
+                "description": "help",
+                "attachments": [SimpleUploadedFile(name, content)],
+            },
+            **self.auth,
+        )
+
+    def usage(self):
+        return self.client.get("/api/ticket/upload-usage/", **self.auth).json()
+
+    def test_oversized_file_is_rejected_mid_stream(self):
+        chunk = b"%PDF-" + b"x" * (1024 * 1024 - 5)
+        with self.assertRaises(AttachmentTooLarge):
+            self.stream([chunk] * 10)
+        # The fifth megabyte crosses the 4MB limit; the rest is never read
+        self.assertEqual(self.consumed, MAX_ATTACHMENT_SIZE // len(chunk) + 1)
+
+    def test_unknown_type_is_rejected_on_the_first_chunk(self):
+        with self.assertRaises(AttachmentTypeNotAllowed):
+            self.stream([b"MZ" + b"x" * 1024] * 4)
+        self.assertEqual(self.consumed, 1)
+
+        # Files shorter than the sniffed prefix are checked when they end
+        with self.assertRaises(AttachmentTypeNotAllowed):
+            self.stream([b"hello"])
+        self.stream([b"%PDF-1.7"])
+        self.assertEqual(get_upload_bytes(self.user.id)["rejected"], 1024 + 2 + 5)
+
+    def test_declared_body_over_the_limit_is_rejected_before_reading(self):
+        handler = LimitedAttachmentUploadHandler(RequestFactory().post("/"))
+        with self.assertRaises(AttachmentTooLarge):
+            handler.handle_raw_input(
+                None, {}, handler.max_body_size + 1, b"boundary", "utf-8"
+            )
+        handler.handle_raw_input(None, {}, handler.max_body_size, b"boundary", "utf-8")
+
+    def test_create_answers_413_and_415(self):
+        response = self.create(b"%PDF-" + b"x" * MAX_ATTACHMENT_SIZE)
+        self.assertEqual(response.status_code, 413)
+        response = self.create(b"MZ" + b"x" * 200, name="scan.pdf")
+        self.assertEqual(response.status_code, 415)
+        self.assertFalse(Ticket.objects.exists())
+        self.assertFalse(AttachmentBlob.objects.exists())
+
+        usage = self.usage()
+        self.assertEqual(usage["accepted"], 0)
+        # Only the bytes read before each rejection are counted
+        self.assertLessEqual(usage["rejected"], MAX_ATTACHMENT_SIZE + 64 * 1024 + 202)
+        self.assertGreater(usage["rejected"], MAX_ATTACHMENT_SIZE)
+
+        response = self.create(b"%PDF-1.7 scan")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.usage()["accepted"], len(b"%PDF-1.7 scan"))
+
+
+class AttachmentDownloadTest(TemporaryMediaMixin, TestCase):
+    content = b"%PDF-0123456789"
+
+    def setUp(self):
+        super().setUp()
+        self.user = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+        token = MyTokenObtainPairSerializer.get_token(self.user).access_token
+        self.auth = {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+        ticket = Ticket.objects.create(
+            creator=self.user,
+            description="help",
+            files=ContentFile(self.content, name="scan.pdf"),
+        )
+        self.url = f"/api/ticket/{ticket.id}/file/"
+        self.etag = '"%s"' % hashlib.sha256(self.content).hexdigest()
+
+    def get(self, **headers):
+        return self.client.get(self.url, **self.auth, **headers)
+
+    def body(self, response):
+        return streamed_body(response)
+
+    def test_full_download(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.content)
+        self.assertEqual(response["ETag"], self.etag)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(response["Content-Type"], "application/pdf")
+
+    def test_ranges(self):
+        size = len(self.content)
+        for header, start, end in (
+            ("bytes=5-8", 5, 8),
+            ("bytes=10-", 10, size - 1),
+            ("bytes=-4", size - 4, size - 1),
+            ("bytes=12-999", 12, size - 1),
+        ):
+            with self.subTest(header=header):
+                response = self.get(HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(self.body(response), self.content[start : end + 1])
+                self.assertEqual(
+                    response["Content-Range"], f"bytes {start}-{end}/{size}"
+                )
+                self.assertEqual(response["Content-Length"], str(end - start + 1))
+
+    def test_unsatisfiable_range(self):
+        for header in (f"bytes={len(self.content)}-", "bytes=8-5", "bytes=-0"):
+            with self.subTest(header=header):
+                response = self.get(HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 416)
+                self.assertEqual(
+                    response["Content-Range"], f"bytes */{len(self.content)}"
+                )
+
+        # Malformed or multi-range headers are ignored
+        response = self.get(HTTP_RANGE="bytes=0-1,4-5")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.content)
+
+    def test_if_range(self):
+        response = self.get(HTTP_RANGE="bytes=0-4", HTTP_IF_RANGE=self.etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.body(response), b"%PDF-")
+
+        # A stale validator gets the whole current file
+        response = self.get(HTTP_RANGE="bytes=0-4", HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.content)
+
+    def test_not_modified(self):
+        for header in (self.etag, f'"stale", {self.etag}', "*"):
+            with self.subTest(header=header):
+                response = self.get(HTTP_IF_NONE_MATCH=header)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response["ETag"], self.etag)
+
+        response = self.get(HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.content)
+
+
+class TicketAttachmentTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+        token = MyTokenObtainPairSerializer.get_token(self.user).access_token
+        self.auth = {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+
+    def attach(self, names, **owner):
+        return create_attachments(
+            [SimpleUploadedFile(name, b"%PDF-" + name.encode()) for name in names],
+            **owner,
+        )
+
+    def add_ticket(self, count=3):
+        ticket = Ticket.objects.create(creator=self.user, description="help")
+        self.attach([f"scan {ticket.id}-{i}.pdf" for i in range(count)], ticket=ticket)
+        followup = TicketFollowUp.objects.create(
+            root=ticket, creator=self.user, is_medUser=False, description="x"
+        )
+        self.attach([f"photo {followup.id}.pdf"], followup=followup)
+        return ticket
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()
+
+    def test_lists_do_not_query_per_attachment(self):
+        ticket = self.add_ticket()
+        list_queries, data = self.count_queries("/api/ticket/reg-user-list/")
+        self.assertEqual(
+            [row["name"] for row in data["results"][0]["attachments"]],
+            [f"scan {ticket.id}-{i}.pdf" for i in range(3)],
+        )
+        thread_url = f"/api/ticket/{ticket.id}/followup-list/"
+        thread_queries, _ = self.count_queries(thread_url)
+
+        for _ in range(3):
+            self.add_ticket()
+        for _ in range(3):
+            followup = TicketFollowUp.objects.create(
+                root=ticket, creator=self.user, is_medUser=False, description="y"
+            )
+            self.attach(["a.pdf", "b.pdf"], followup=followup)
+
+        queries, data = self.count_queries("/api/ticket/reg-user-list/")
+        self.assertEqual(queries, list_queries)
+        self.assertEqual(len(data["results"]), 4)
+        queries, data = self.count_queries(thread_url)
+        self.assertEqual(queries, thread_queries)
+        self.assertEqual(
+            [len(row["attachments"]) for row in data["results"]["followup_data"]],
+            [2, 2, 2, 1],
+        )
+
+    def test_download_offers_the_client_file_name(self):
+        ticket = Ticket.objects.create(creator=self.user, description="help")
+        plain, quoted, accented = self.attach(
+            ["report.pdf", 'say "hi".pdf', "résumé.pdf"], ticket=ticket
+        )
+        for attachment, disposition in (
+            (plain, 'attachment; filename="report.pdf"'),
+            (quoted, 'attachment; filename="say \\"hi\\".pdf"'),
+            (accented, "attachment; filename*=utf-8''r%C3%A9sum%C3%A9.pdf"),
+        ):
+            url = f"/api/ticket/attachment/{attachment.id}/"
+            for headers in ({}, {"HTTP_RANGE": "bytes=0-4"}):
+                with self.subTest(name=attachment.name, **headers):
+                    response = self.client.get(url, **self.auth, **headers)
+                    streamed_body(response)
+                    self.assertEqual(response["Content-Disposition"], disposition)
+                    self.assertEqual(response["Content-Type"], "application/pdf")
+
+    def test_archived_download_keeps_the_client_file_name(self):
+        med = MedUser.objects.create_meduser(
+            "doc@example.com",
+            "Doc",
+            "pass1234",
+            is_med_user=True,
+            qualification="MBBS",
+            specialization="GP",
+        )
+        ticket = self.add_ticket(count=1)
+        claim_ticket(ticket.id, med.id)
+        attachment = ticket.attachments.get()
+        self.assertEqual(archive_tickets(timezone.now() + timedelta(days=1)), 1)
+
+        response = self.client.get(
+            f"/api/ticket/attachment/{attachment.id}/",
+            HTTP_RANGE="bytes=0-4",
+            **self.auth,
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(streamed_body(response), b"%PDF-")
+        self.assertEqual(
+            response["Content-Disposition"], f'attachment; filename="{attachment.name}"'
+        )
+
+
+class TicketSearchTest(TestCase):
+    def setUp(self):
+        self.patient = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+        self.other_patient = RegUser.objects.create_reguser(
+            "other@example.com", "Other", "pass1234", is_med_user=False
+        )
+        self.doctor, self.other_doctor = [
+            MedUser.objects.create_meduser(
+                email,
+                "Doc",
+                "pass1234",
+                is_med_user=True,
+                qualification="MBBS",
+                specialization="GP",
+            )
+            for email in ("doc@example.com", "doc2@example.com")
+        ]
+        self.chest = Ticket.objects.create(
+            creator=self.patient, description="chest pain after running"
+        )
+        self.rash = Ticket.objects.create(
+            creator=self.patient, description="rash on the arm"
+        )
+        TicketFollowUp.objects.create(
+            root=self.rash, creator=self.patient, is_medUser=False, description="pain"
+        )
+        self.other = Ticket.objects.create(
+            creator=self.other_patient, description="back pain"
+        )
+
+    def get(self, user, params):
+        token = MyTokenObtainPairSerializer.get_token(user).access_token
+        return self.client.get(
+            "/api/ticket/search/", params, HTTP_AUTHORIZATION=f"Bearer {token}"
+        )
+
+    def search(self, user, query):
+        response = self.get(user, {"q": query})
+        self.assertEqual(response.status_code, 200)
+        return [row["id"] for row in response.json()["results"]]
+
+    def test_index_is_fts5(self):
+        self.assertEqual(search_backend(), "fts5")
+
+    def test_results(self):
+        self.assertEqual(self.search(self.patient, "chest pain"), [self.chest.id])
+        # Follow-up bodies find their ticket; the last term matches as a prefix
+        self.assertCountEqual(
+            self.search(self.patient, "pain"), [self.chest.id, self.rash.id]
+        )
+        self.assertEqual(self.search(self.patient, "runs"), [self.chest.id])
+        self.assertEqual(self.search(self.patient, "ar"), [self.rash.id])
+        self.assertEqual(self.search(self.patient, "fever"), [])
+
+        self.assertEqual(self.get(self.patient, {"q": " "}).status_code, 400)
+
+    def test_visibility(self):
+        self.assertEqual(self.search(self.other_patient, "pain"), [self.other.id])
+
+        # The open queue is searchable by ticket text, not by follow-ups
+        self.assertCountEqual(
+            self.search(self.doctor, "pain"), [self.chest.id, self.other.id]
+        )
+
+        # A claimed ticket leaves the queue, follow-ups included for its doctor
+        claim_ticket(self.rash.id, self.doctor.id)
+        claim_ticket(self.chest.id, self.doctor.id)
+        self.assertCountEqual(
+            self.search(self.doctor, "pain"),
+            [self.chest.id, self.rash.id, self.other.id],
+        )
+        self.assertEqual(self.search(self.other_doctor, "pain"), [self.other.id])
+
+        for user in (self.patient, self.doctor, self.other_doctor):
+            with self.subTest(user=user.email):
+                self.assertCountEqual(
+                    search_fallback(user, ["pain"], 10, 0),
+                    self.search(user, "pain"),
+                )
+
+    def test_triggers_keep_the_index_in_sync(self):
+        followup = TicketFollowUp.objects.create(
+            root=self.chest, creator=self.patient, is_medUser=False, description="dizzy"
+        )
+        self.assertEqual(self.search(self.patient, "dizzy"), [self.chest.id])
+
+        followup.description = "nausea"
+        followup.save()
+        Ticket.objects.filter(pk=self.rash.id).update(description="itchy skin")
+        self.assertEqual(self.search(self.patient, "dizzy"), [])
+        self.assertEqual(self.search(self.patient, "nausea"), [self.chest.id])
+        self.assertEqual(self.search(self.patient, "rash"), [])
+        self.assertEqual(self.search(self.patient, "itchy"), [self.rash.id])
+
+        followup.delete()
+        self.assertEqual(self.search(self.patient, "nausea"), [])
+        # The cascade removes the ticket's follow-ups from the index too
+        self.rash.delete()
+        self.assertEqual(self.search(self.patient, "pain"), [self.chest.id])
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM {FTS_TABLE}")
+            indexed = cursor.fetchone()[0]
+        self.assertEqual(
+            indexed, Ticket.objects.count() + TicketFollowUp.objects.count()
+        )
+
+
+class TicketStatsTest(TestCase):
+    def setUp(self):
+        self.user = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+        self.med = MedUser.objects.create_meduser(
+            "doc@example.com",
+            "Doc",
+            "pass1234",
+            is_med_user=True,
+            qualification="MBBS",
+            specialization="GP",
+        )
+
+    def test_counters_follow_ticket_lifecycle(self):
+        tickets = [
+            Ticket.objects.create(creator=self.user, description=str(i))
+            for i in range(3)
+        ]
+        self.assertTrue(claim_ticket(tickets[0].id, self.med.id))
+        TicketFollowUp.objects.create(
+            root=tickets[0], creator=self.med, is_medUser=True, description="hi"
+        )
+        tickets[1].delete()
+
+        stats = dashboard_stats(self.med.id)
+        self.assertEqual(stats["open_queue"], 1)
+        self.assertEqual(stats["claimed_by_me"], 1)
+        self.assertEqual(
+            stats["claimed_per_med_user"], [{"med_user_id": self.med.id, "claimed": 1}]
+        )
+        self.assertEqual(stats["first_response_seconds"]["count"], 1)
+        self.assertEqual(reconcile_counters(), 0)
+
+    def test_reconcile_repairs_drift(self):
+        Ticket.objects.create(creator=self.user, description="a")
+        Ticket.objects.filter(creator=self.user).update(is_open=False)
+        self.assertEqual(reconcile_counters(), 1)
+        self.assertEqual(dashboard_stats(self.med.id)["open_queue"], 0)
+
+
+class TicketClaimNextTest(TestCase):
+    def setUp(self):
+        self.user = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+        self.med = MedUser.objects.create_meduser(
+            "doc@example.com",
+            "Doc",
+            "pass1234",
+            is_med_user=True,
+            qualification="MBBS",
+            specialization="GP",
+        )
+        token = MyTokenObtainPairSerializer.get_token(self.med).access_token
+        self.auth = {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+
+    def claim(self):
+        return self.client.post("/api/ticket/med-user-claim-next/", **self.auth)
+
+    def test_empty_queue_is_not_found(self):
+        self.assertIsNone(claim_next_ticket(self.med.id))
+        self.assertEqual(self.claim().status_code, 404)
+
+    def test_lost_races_are_reported_as_contended(self):
+        ticket = Ticket.objects.create(creator=self.user, description="help")
+        # Every conditional UPDATE loses to another claimer
+        with mock.patch("tickets.models.claim_ticket", return_value=False):
+            self.assertIs(claim_next_ticket(self.med.id), CLAIM_CONTENDED)
+            response = self.claim()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "1")
+
+        response = self.claim()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["id"], ticket.id)
+
+
+@override_settings(TICKET_SPECIALIZATION_KEYWORDS={"dermatology": ["rash", "skin"]})
+class TicketRoutingTest(TestCase):
+    def setUp(self):
+        reset_classifier()
+        self.addCleanup(reset_classifier)
+        self.user = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+        self.derms = [
+            MedUser.objects.create_meduser(
+                f"derm{i}@example.com",
+                "Derm",
+                "pass1234",
+                is_med_user=True,
+                qualification="MD",
+                specialization="Dermatology",
+            )
+            for i in range(2)
+        ]
+        self.gp = MedUser.objects.create_meduser(
+            "gp@example.com",
+            "GP",
+            "pass1234",
+            is_med_user=True,
+            qualification="MBBS",
+            specialization="General practice",
+        )
+
+    def test_tickets_are_tagged_and_spread_over_the_specialization(self):
+        first = Ticket.objects.create(creator=self.user, description="Itchy rash")
+        second = Ticket.objects.create(creator=self.user, description="Dry skin")
+        other = Ticket.objects.create(creator=self.user, description="Headache")
+
+        self.assertEqual(first.specialization, "dermatology")
+        self.assertEqual(
+            {first.offered_to_id, second.offered_to_id},
+            {med.id for med in self.derms},
+        )
+        self.assertEqual(other.specialization, "")
+        self.assertIsNone(other.offered_to_id)
+
+    def test_claim_next_takes_the_personal_queue_first(self):
+        untagged = Ticket.objects.create(creator=self.user, description="Headache")
+        rash = Ticket.objects.create(creator=self.user, description="Rash")
+
+        ticket = claim_next_ticket(
+            rash.offered_to_id, queues=personal_queues(rash.offered_to_id)
+        )
+        self.assertEqual(ticket.id, rash.id)
+        ticket = claim_next_ticket(self.gp.id, queues=personal_queues(self.gp.id))
+        self.assertEqual(ticket.id, untagged.id)
+
+    def test_open_list_pages_rank_by_rank(self):
+        tickets = [
+            Ticket.objects.create(creator=self.user, description=description)
+            for description in ["Rash", "Headache"] * 6
+        ]
+        derm = self.derms[0]
+        mine = [t.id for t in tickets if t.offered_to_id == derm.id]
+        untagged = [t.id for t in tickets if not t.specialization]
+        elsewhere = [t.id for t in tickets if t.offered_to_id not in (None, derm.id)]
+        self.assertEqual(len(mine), 3)
+
+        token = MyTokenObtainPairSerializer.get_token(derm).access_token
+        auth = {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+        url = "/api/ticket/med-user-open-list/?pagination=cursor"
+        pages = []
+        with CaptureQueriesContext(connection) as queries:
+            while url:
+                pages.append(self.client.get(url, **auth).json())
+                url = pages[-1]["next"]
+        self.assertEqual(
+            [row["id"] for page in pages for row in page["results"]],
+            mine + untagged + elsewhere,
+        )
+        self.assertEqual(len(pages), 2)
+        # Every read is an index-ordered part of the queue, no CASE sort
+        self.assertFalse(any("CASE" in query["sql"] for query in queries))
+
+        back = self.client.get(pages[1]["previous"], **auth).json()
+        self.assertEqual(back["results"], pages[0]["results"])
+
+        numbered = self.client.get(
+            "/api/ticket/med-user-open-list/?page=2", **auth
+        ).json()
+        self.assertEqual(numbered["count"], 12)
+        self.assertEqual(numbered["results"], pages[1]["results"])
+
+
+class TicketArchiveTest(TestCase):
+    def setUp(self):
+        self.user = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+        self.med = MedUser.objects.create_meduser(
+            "doc@example.com",
+            "Doc",
+            "pass1234",
+            is_med_user=True,
+            qualification="MBBS",
+            specialization="GP",
+        )
+        self.ticket = Ticket.objects.create(creator=self.user, description="old")
+        claim_ticket(self.ticket.id, self.med.id)
+        for text in ("first", "second"):
+            TicketFollowUp.objects.create(
+                root=self.ticket, creator=self.med, is_medUser=True, description=text
+            )
+        self.open_ticket = Ticket.objects.create(creator=self.user, description="new")
+
+    def test_thread_reads_the_same_after_archiving(self):
+        token = MyTokenObtainPairSerializer.get_token(self.user).access_token
+        url = f"/api/ticket/{self.ticket.id}/followup-list/"
+        auth = {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+        before = self.client.get(url, **auth).json()
+
+        self.assertEqual(archive_tickets(timezone.now() + timedelta(days=1)), 1)
+        self.assertFalse(Ticket.objects.filter(pk=self.ticket.id).exists())
+        self.assertFalse(TicketFollowUp.objects.exists())
+        self.assertTrue(Ticket.objects.filter(pk=self.open_ticket.id).exists())
+
+        after = self.client.get(url, **auth)
+        self.assertEqual(after.status_code, 200)
+        self.assertEqual(after.json()["results"], before["results"])
+        self.assertEqual(reconcile_counters(), 0)
+
+
+class TicketFollowUpBatchTest(TestCase):
+    def setUp(self):
+        self.user = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+        self.med = MedUser.objects.create_meduser(
+            "doc@example.com",
+            "Doc",
+            "pass1234",
+            is_med_user=True,
+            qualification="MBBS",
+            specialization="GP",
+        )
+        self.ticket = Ticket.objects.create(creator=self.user, description="help")
+        self.url = f"/api/ticket/{self.ticket.id}/followup/batch-create/"
+
+    def post(self, user, items):
+        token = MyTokenObtainPairSerializer.get_token(user).access_token
+        return self.client.post(
+            self.url,
+            items,
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {token}",
+        )
+
+    def test_batch_claims_and_numbers_the_whole_batch(self):
+        self.assertEqual(self.post(self.user, [{"description": "x"}]).status_code, 403)
+
+        response = self.post(
+            self.med,
+            [{"description": "one"}, {"description": ""}, {"description": "two"}],
+        )
+        self.assertEqual(response.status_code, 207)
+        results = response.json()["results"]
+        self.assertEqual([result["status"] for result in results], [201, 400, 201])
+        self.assertIn("description", results[1]["errors"])
+        self.assertEqual(results[2]["data"]["description"], "two")
+
+        followups = TicketFollowUp.objects.filter(root=self.ticket)
+        self.assertEqual(
+            list(
+                followups.order_by("sequence_number").values_list(
+                    "description", "sequence_number"
+                )
+            ),
+            [("one", 1), ("two", 2)],
+        )
+        self.ticket.refresh_from_db()
+        self.assertFalse(self.ticket.is_open)
+        self.assertEqual(self.ticket.opened_by_med_id, self.med.id)
+        self.assertEqual(self.ticket.followup_count, 2)
+        self.assertIsNotNone(self.ticket.first_response_at)
+
+        response = self.post(self.user, [{"description": "thanks"}])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            TicketFollowUp.objects.get(description="thanks").sequence_number, 3
+        )
+        self.assertEqual(reconcile_counters(), 0)
+
+    def test_batch_must_be_a_bounded_array(self):
+        self.assertEqual(self.post(self.med, {"description": "x"}).status_code, 400)
+        too_many = [{"description": "x"}] * 101
+        self.assertEqual(self.post(self.med, too_many).status_code, 400)
+        self.assertFalse(TicketFollowUp.objects.exists())
+
+
+class TicketFollowUpConcurrencyTest(TransactionTestCase):
+    workers = 8
+    per_worker = 5
+
+    def setUp(self):
+        # Writers on SQLite's shared in-memory database fail at once with
+        # "table is locked" instead of waiting
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("needs DJANGO_TEST_DATABASE_NAME set to a file")
+
+    def test_parallel_followups_get_unique_sequence_numbers(self):
+        user = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+        ticket = Ticket.objects.create(creator=user, description="help")
+        barrier = threading.Barrier(self.workers)
+        errors = []
+
+        def create_followups():
+            try:
+                barrier.wait()
+                for _ in range(self.per_worker):
+                    TicketFollowUp.objects.create(
+                        root_id=ticket.id,
+                        creator_id=user.id,
+                        is_medUser=False,
+                        description="parallel",
+                    )
+            except Exception as exc:  # surfaced in the main thread below
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        threads = [
+            threading.Thread(target=create_followups) for _ in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        total = self.workers * self.per_worker
+        numbers = sorted(
+            TicketFollowUp.objects.filter(root=ticket).values_list(
+                "sequence_number", flat=True
+            )
+        )
+        self.assertEqual(numbers, list(range(1, total + 1)))
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.last_sequence_number, total)
+
+
+@override_settings(TICKET_EVENTS_BROKER="tickets.events.RecordingBroker")
+class TicketEventStreamTest(TransactionTestCase):
+    def setUp(self):
+        reset_broker()
+        self.addCleanup(reset_broker)
+        self.user = RegUser.objects.create_reguser(
+            "patient@example.com", "Patient", "pass1234", is_med_user=False
+        )
+        self.other = RegUser.objects.create_reguser(
+            "other@example.com", "Other", "pass1234", is_med_user=False
+        )
+        self.ticket = Ticket.objects.create(creator=self.user, description="help")
+        self.app = ticket_events_router(None)
+
+    def open_stream(self, user, headers=()):
+        token = str(MyTokenObtainPairSerializer.get_token(user).access_token)
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": f"/api/ticket/{self.ticket.id}/events/",
+            "query_string": f"token={token}".encode(),
+            "headers": list(headers),
+        }
+        return ApplicationCommunicator(self.app, scope)
+
+    def create_followup(self, description):
+        return TicketFollowUp.objects.create(
+            root=self.ticket,
+            creator=self.user,
+            is_medUser=False,
+            description=description,
+        )
+
+    async def read_event(self, communicator):
+        while True:
+            body = (await communicator.receive_output(2))["body"].decode()
+            if body.startswith("id:"):
+                lines = dict(line.split(": ", 1) for line in body.strip().split("\n"))
+                return int(lines["id"]), json.loads(lines["data"])
+
+    async def test_new_followups_are_pushed(self):
+        communicator = self.open_stream(self.user)
+        await communicator.send_input({"type": "http.request"})
+        start = await communicator.receive_output(2)
+        self.assertEqual(start["status"], 200)
+
+        await sync_to_async(self.create_followup)("first reply")
+        event_id, data = await self.read_event(communicator)
+        self.assertEqual(event_id, 1)
+        self.assertEqual(data["description"], "first reply")
+        self.assertEqual(len(get_broker().published), 1)
+
+        await communicator.send_input({"type": "http.disconnect"})
+        await communicator.wait(2)
+
+    async def test_reconnect_replays_missed_followups(self):
+        for description in ("one", "two", "three"):
+            await sync_to_async(self.create_followup)(description)
+
+        communicator = self.open_stream(self.user, [(b"last-event-id", b"1")])
+        await communicator.send_input({"type": "http.request"})
+        await communicator.receive_output(2)
+        self.assertEqual((await self.read_event(communicator))[0], 2)
+        self.assertEqual((await self.read_event(communicator))[0], 3)
+
+        await communicator.send_input({"type": "http.disconnect"})
+        await communicator.wait(2)
+
+    async def test_other_users_are_rejected(self):
+        communicator = self.open_stream(self.other)
+        await communicator.send_input({"type": "http.request"})
+        start = await communicator.receive_output(2)
+        self.assertEqual(start["status"], 403)
@@ -0,0 +1,132 @@
+from django.core.cache import cache
+from django.core.files.uploadhandler import FileUploadHandler
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .models import MAX_ATTACHMENT_SIZE, MAX_ATTACHMENTS_PER_REQUEST
+
+# Room for the non-file form fields and multipart boundaries
+FORM_OVERHEAD = 64 * 1024
+
+# Magic bytes of the attachment types we accept (offset, signature)
+ALLOWED_SIGNATURES = {
+    "pdf": [(0, b"%PDF-")],
+    "png": [(0, b"\x89PNG\r\n\x1a\n")],
+    "jpeg": [(0, b"\xff\xd8\xff")],
+    "gif": [(0, b"GIF87a"), (0, b"GIF89a")],
+    "tiff": [(0, b"II*\x00"), (0, b"MM\x00*")],
+    "dicom": [(128, b"DICM")],
+}
+SNIFF_LENGTH = 132
+
+UPLOAD_COUNTER_KEY = "upload-bytes:{user_id}:{kind}"
+UPLOAD_COUNTER_TIMEOUT = 24 * 60 * 60
+
+
+class AttachmentTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = "File size exceeds the maximum limit of 4MB."
+    default_code = "file_too_large"
+
+
+class AttachmentTypeNotAllowed(APIException):
+    status_code = status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+    default_detail = "File type is not allowed."
+    default_code = "file_type_not_allowed"
+
+
+def sniff_attachment_type(head):
+    for kind, signatures in ALLOWED_SIGNATURES.items():
+        for offset, signature in signatures:
+            if head[offset : offset + len(signature)] == signature:
+                return kind
+    return None
+
+
+def add_upload_bytes(user_id, kind, count):
+    key = UPLOAD_COUNTER_KEY.format(user_id=user_id, kind=kind)
+    # add() is a no-op when the key exists, incr() is atomic on shared caches
+    cache.add(key, 0, UPLOAD_COUNTER_TIMEOUT)
+    try:
+        cache.incr(key, count)
+    except ValueError:
+        cache.set(key, count, UPLOAD_COUNTER_TIMEOUT)
+
+
+def get_upload_bytes(user_id):
+    keys = {
+        kind: UPLOAD_COUNTER_KEY.format(user_id=user_id, kind=kind)
+        for kind in ("accepted", "rejected")
+    }
+    values = cache.get_many(keys.values())
+    return {kind: values.get(key, 0) for kind, key in keys.items()}
+
+
+class LimitedAttachmentUploadHandler(FileUploadHandler):
+    # First handler in the chain for attachment uploads: enforces the size
+    # limit and sniffs the file type while the bytes arrive, and aborts the
+    # request on the first violation instead of spooling the whole body.
+    # Accepted/rejected byte counts are kept per user in the cache.
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.max_size = MAX_ATTACHMENT_SIZE
+        self.max_body_size = (
+            MAX_ATTACHMENT_SIZE * (MAX_ATTACHMENTS_PER_REQUEST + 1) + FORM_OVERHEAD
+        )
+        self.received = 0
+        self.head = b""
+        self.accepted = 0
+
+    def handle_raw_input(
+        self, input_data, META, content_length, boundary, encoding=None
+    ):
+        # Reject before reading a single byte when the declared body is
+        # already too big for `files` plus a full batch of attachments
+        if content_length and content_length > self.max_body_size:
+            self.reject(AttachmentTooLarge, content_length)
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+        self.head = b""
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            self.reject(AttachmentTooLarge, self.received)
+
+        if len(self.head) < SNIFF_LENGTH:
+            self.head += raw_data[: SNIFF_LENGTH - len(self.head)]
+            if len(self.head) >= SNIFF_LENGTH and not sniff_attachment_type(self.head):
+                self.reject(AttachmentTypeNotAllowed, self.received)
+        return raw_data
+
+    def file_complete(self, file_size):
+        # Small files end before SNIFF_LENGTH bytes arrive
+        if self.received and not sniff_attachment_type(self.head):
+            self.reject(AttachmentTypeNotAllowed, self.received)
+        self.accepted += self.received
+        return None
+
+    def upload_complete(self):
+        if self.accepted:
+            self.count("accepted", self.accepted)
+
+    def reject(self, exception_class, received):
+        self.count("rejected", received)
+        raise exception_class()
+
+    def count(self, kind, received):
+        user = getattr(self.request, "user", None)
+        if user is not None and user.is_authenticated:
+            add_upload_bytes(user.id, kind, received)
+
+
+class LimitedUploadMixin:
+    # Installs LimitedAttachmentUploadHandler ahead of Django's default
+    # handlers before the request body is parsed.
+
+    def initial(self, request, *args, **kwargs):
+        request.upload_handlers.insert(0, LimitedAttachmentUploadHandler(request))
+        super().initial(request, *args, **kwargs)
@@ -8,6 +8,8 @@ urlpatterns = [
     path(
         "reg-user-list/", RegUserTicketListView.as_view(), name="reg-user-ticket-list"
     ),
+    path("upload-usage/", UploadUsageView.as_view(), name="upload-usage"),
+    path("search/", TicketSearchView.as_view(), name="ticket-search"),
     path(
         "med-user-open-list/",
         MedUserOpenTicketListView.as_view(),
@@ -18,11 +20,22 @@ urlpatterns = [
         MedUserCloseTicketListView.as_view(),
         name="med-user-close-list",
     ),
+    path(
+        "med-user-claim-next/",
+        MedUserClaimTicketView.as_view(),
+        name="med-user-claim-next",
+    ),
+    path("stats/", TicketStatsView.as_view(), name="ticket-stats"),
     path(
         "<int:ticket_id>/followup/create/",
         TicketFollowupCreateView.as_view(),
         name="create-followup-ticket",
     ),  # in this past, ticket_id is the root ticket for all it's the followups
+    path(
+        "<int:ticket_id>/followup/batch-create/",
+        TicketFollowupBatchCreateView.as_view(),
+        name="batch-create-followup-ticket",
+    ),
     path(
         "followup/<int:ticket_fu_id>/update/",
         TicketFollowupUpdateView.as_view(),
@@ -38,4 +51,19 @@ urlpatterns = [
         TicketFollowupListView.as_view(),
         name="followup-list",
     ),
+    path(
+        "<int:ticket_id>/file/",
+        TicketFileDownloadView.as_view(),
+        name="ticket-file-download",
+    ),
+    path(
+        "followup/<int:ticket_fu_id>/file/",
+        TicketFollowupFileDownloadView.as_view(),
+        name="ticket-followup-file-download",
+    ),
+    path(
+        "attachment/<int:attachment_id>/",
+        TicketAttachmentDownloadView.as_view(),
+        name="ticket-attachment-download",
+    ),
 ]
@@ -7,227 +7,287 @@ from .models import *
 from accounts.models import *
 from accounts.serializers import *
 from rest_framework.permissions import IsAuthenticated
+from accounts.permissions import IsMedUser, IsRegUser
 from rest_framework.pagination import PageNumberPagination
 from django.shortcuts import get_object_or_404
+from django.db import transaction
+from api.batch import batch_items, batch_response, validate_batch
+from api.conditional import ConditionalGet
+from api.pagination import select_paginator
+from .uploadhandlers import LimitedUploadMixin, get_upload_bytes
+from .archive import archived_attachment_name, archived_file, archived_thread
+from .downloads import serve_attachment
+from .search import search_tickets
+from .routing import (
+    PERSONAL_ORDERING,
+    med_user_specialization,
+    personal_queues,
+    personal_segments,
+)
+from .stats import dashboard_stats
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+# ?ordering=activity lists the most recently active threads first
+ACTIVITY_ORDERING = ("-last_activity_at", "-id")
+
+
+def ticket_list_ordering(request):
+    if request.query_params.get("ordering") == "activity":
+        return ACTIVITY_ORDERING
+    return ("created_at", "id")
 
 
 ##### TICKET VIEWS #####
 
 
-class TicketCreateView(APIView):
+class TicketCreateView(LimitedUploadMixin, APIView):
     parser_classes = (MultiPartParser, FormParser)
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, IsRegUser]
 
     def post(self, request, format=None):
-        serializer = OnlyUserProfileSerializer(request.user)
-        if not serializer["is_med_user"].value:
-            user_id = serializer["id"].value
-            # Serialize the RegUser data
-            data = request.data.copy()
-            data["creator_id"] = user_id
-            data["is_open"] = True
-
-            serializer = TicketSerializer(data=data)
-
-            if serializer.is_valid():
-                serializer.save()
-                return Response(serializer.data, status=status.HTTP_201_CREATED)
-            else:
-                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        user_id = request.user.id
+        # Serialize the RegUser data
+        data = request.data.copy()
+        data["creator_id"] = user_id
+        data["is_open"] = True
 
+        serializer = TicketSerializer(data=data)
+
+        if serializer.is_valid():
+            serializer.save()
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
         else:
-            return Response(
-                {"detail": "Access Denied"}, status=status.HTTP_403_FORBIDDEN
-            )
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class TicketUpdateView(APIView):
-    permission_classes = [IsAuthenticated]
+class TicketUpdateView(LimitedUploadMixin, APIView):
+    permission_classes = [IsAuthenticated, IsRegUser]
 
     def put(self, request, ticket_id, format=None):
-        serializer = OnlyUserProfileSerializer(request.user)
-        if not serializer["is_med_user"].value:
-            # Check if the ticket exists
-            try:
-                ticket = Ticket.objects.get(pk=ticket_id)
-            except Ticket.DoesNotExist:
-                return Response(
-                    {"error": "Ticket not found."}, status=status.HTTP_404_NOT_FOUND
-                )
-
-            user_id = serializer["id"].value
-            # Ensure that the user is the owner of the ticket (if needed)
-            if ticket.creator_id != user_id:
-                return Response(
-                    {"error": "User does not own this ticket."},
-                    status=status.HTTP_403_FORBIDDEN,
-                )
-
-            # Create the serializer with partial=True to allow partial updates
-            serializer = TicketUpdateSerializer(ticket, data=request.data, partial=True)
+        # Check if the ticket exists
+        try:
+            ticket = Ticket.objects.get(pk=ticket_id)
+        except Ticket.DoesNotExist:
+            return Response(
+                {"error": "Ticket not found."}, status=status.HTTP_404_NOT_FOUND
+            )
 
-            if serializer.is_valid(raise_exception=True):
-                serializer.save()
-                return Response(serializer.data)
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        else:
+        user_id = request.user.id
+        # Ensure that the user is the owner of the ticket (if needed)
+        if ticket.creator_id != user_id:
             return Response(
-                {"detail": "Access Denied"}, status=status.HTTP_403_FORBIDDEN
+                {"error": "User does not own this ticket."},
+                status=status.HTTP_403_FORBIDDEN,
             )
 
+        # Create the serializer with partial=True to allow partial updates
+        serializer = TicketUpdateSerializer(ticket, data=request.data, partial=True)
 
-class TicketDeleteView(APIView):
-    permission_classes = [IsAuthenticated]
+        if serializer.is_valid(raise_exception=True):
+            serializer.save()
+            return Response(serializer.data)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    def delete(self, request, ticket_id, format=None):
-        # Check if the user exists
-        serializer = OnlyUserProfileSerializer(request.user)
-
-        if not serializer["is_med_user"].value:
-            # Check if the ticket exists
-            try:
-                ticket = Ticket.objects.get(pk=ticket_id)
-            except Ticket.DoesNotExist:
-                return Response(
-                    {"error": "Ticket not found."}, status=status.HTTP_404_NOT_FOUND
-                )
 
-            # Ensure that the user is the owner of the ticket (if needed)
-            user_id = serializer["id"].value
-            if ticket.creator_id != user_id:
-                return Response(
-                    {"error": "User does not own this ticket."},
-                    status=status.HTTP_403_FORBIDDEN,
-                )
+class TicketDeleteView(APIView):
+    permission_classes = [IsAuthenticated, IsRegUser]
 
+    def delete(self, request, ticket_id, format=None):
+        # Check if the ticket exists
+        try:
             ticket = Ticket.objects.get(pk=ticket_id)
-            # Delete the associated files (assuming a FileField named 'attachment')
-            if ticket.files:
-                ticket.files.delete(save=True)
-            ticket.delete()
+        except Ticket.DoesNotExist:
             return Response(
-                {"message": "Ticket deleted."}, status=status.HTTP_204_NO_CONTENT
+                {"error": "Ticket not found."}, status=status.HTTP_404_NOT_FOUND
             )
-        else:
+
+        # Ensure that the user is the owner of the ticket (if needed)
+        user_id = request.user.id
+        if ticket.creator_id != user_id:
             return Response(
-                {"detail": "Access Denied"}, status=status.HTTP_403_FORBIDDEN
+                {"error": "User does not own this ticket."},
+                status=status.HTTP_403_FORBIDDEN,
             )
 
+        # Attachments are queued for the background sweeper inside delete()
+        ticket.delete()
+        return Response(
+            {"message": "Ticket deleted."}, status=status.HTTP_204_NO_CONTENT
+        )
+
 
 class RegUserTicketListView(APIView):
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, IsRegUser]
     pagination_class = PageNumberPagination
 
     def get(self, request):
-        serializer = OnlyUserProfileSerializer(request.user)
+        user_id = request.user.id
+        ordering = ticket_list_ordering(request)
+        tickets = (
+            Ticket.objects.filter(creator_id=user_id)
+            .prefetch_related("attachments")
+            .order_by(*ordering)
+        )
 
-        if not serializer["is_med_user"].value:
-            user_id = serializer["id"].value
-            tickets = Ticket.objects.filter(creator_id=user_id)
+        conditional = ConditionalGet.for_queryset(request, tickets)
+        not_modified = conditional.not_modified_response()
+        if not_modified is not None:
+            return not_modified
 
-            paginator = PageNumberPagination()
-            paginator.page_size = 10  # Set the number of items per page
+        paginator = select_paginator(request, ordering=ordering)
+        paginator.page_size = 10  # Set the number of items per page
 
-            page = paginator.paginate_queryset(tickets, request)
+        page = paginator.paginate_queryset(tickets, request)
 
-            # Serialize the paginated data
-            serializer = TicketSerializer(page, many=True)
+        # Serialize the paginated data
+        serializer = TicketSerializer(page, many=True)
 
-            # Return the paginated response
-            return paginator.get_paginated_response(serializer.data)
+        # Return the paginated response
+        return conditional.finish(paginator.get_paginated_response(serializer.data))
 
-        else:
-            return Response(
-                {"error": "Access Denied"}, status=status.HTTP_404_NOT_FOUND
-            )
+
+class UploadUsageView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        # Attachment bytes accepted/rejected for this user (see uploadhandlers)
+        return Response(get_upload_bytes(request.user.id), status=status.HTTP_200_OK)
 
 
 ##### MED-USER TICKET VIEWS #####
 
 
 class MedUserOpenTicketListView(APIView):
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, IsMedUser]
     pagination_class = PageNumberPagination
 
     def get(self, request):
-        serializer = OnlyUserProfileSerializer(request.user)
-        if serializer["is_med_user"].value:
-            tickets = Ticket.objects.filter(
-                is_open=True
-            )  # only showing the opened ticket to med_user
+        # Only open tickets, personalized: offered to this med user first, then
+        # their specialization, untagged ones, and the rest (tickets.routing).
+        # Each rank is its own index-ordered queryset, paged one after the
+        # other.
+        specialization = med_user_specialization(request.user.id)
+        segments = [
+            (rank, queryset.prefetch_related("attachments"))
+            for rank, queryset in personal_segments(request.user.id, specialization)
+        ]
+
+        conditional = ConditionalGet.for_queryset(
+            request,
+            Ticket.objects.filter(is_open=True),
+            request.user.id,
+            specialization,
+        )
+        not_modified = conditional.not_modified_response()
+        if not_modified is not None:
+            return not_modified
 
-            paginator = PageNumberPagination()
-            paginator.page_size = 10  # Set the number of items per page
+        paginator = select_paginator(
+            request, ordering=PERSONAL_ORDERING, segmented=True
+        )
+        paginator.page_size = 10  # Set the number of items per page
 
-            page = paginator.paginate_queryset(tickets, request)
+        page = paginator.paginate_queryset(segments, request)
 
-            # Serialize the paginated data
-            serializer = TicketSerializer(page, many=True)
+        # Serialize the paginated data
+        serializer = TicketSerializer(page, many=True)
 
-            # Return the paginated response
-            return paginator.get_paginated_response(serializer.data)
-        else:
-            return Response(
-                {"error": "Access Denied"}, status=status.HTTP_403_FORBIDDEN
-            )
+        # Return the paginated response
+        return conditional.finish(paginator.get_paginated_response(serializer.data))
 
 
 class MedUserCloseTicketListView(APIView):
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, IsMedUser]
     pagination_class = PageNumberPagination
 
     def get(self, request):
-        serializer = OnlyUserProfileSerializer(request.user)
-        if serializer["is_med_user"].value:
-            tickets = Ticket.objects.filter(
-                opened_by_med_id=serializer["id"].value
-            )  # only showing the opened ticket to med_user
+        ordering = ticket_list_ordering(request)
+        tickets = (
+            Ticket.objects.filter(opened_by_med_id=request.user.id)
+            .prefetch_related("attachments")
+            .order_by(*ordering)
+        )  # only showing the tickets claimed by this med_user
+
+        paginator = select_paginator(request, ordering=ordering)
+        paginator.page_size = 10  # Set the number of items per page
 
-            paginator = PageNumberPagination()
-            paginator.page_size = 10  # Set the number of items per page
+        page = paginator.paginate_queryset(tickets, request)
 
-            page = paginator.paginate_queryset(tickets, request)
+        # Serialize the paginated data
+        serializer = TicketSerializer(page, many=True)
+
+        # Return the paginated response
+        return paginator.get_paginated_response(serializer.data)
 
-            # Serialize the paginated data
-            serializer = TicketSerializer(page, many=True)
 
-            # Return the paginated response
-            return paginator.get_paginated_response(serializer.data)
-        else:
+# Seconds a med user should wait after a contended claim
+CLAIM_RETRY_AFTER = 1
+
+
+class MedUserClaimTicketView(APIView):
+    permission_classes = [IsAuthenticated, IsMedUser]
+
+    def post(self, request, format=None):
+        ticket = claim_next_ticket(
+            request.user.id, queues=personal_queues(request.user.id)
+        )
+        if ticket is None:
+            return Response(
+                {"detail": "No open tickets."}, status=status.HTTP_404_NOT_FOUND
+            )
+        if ticket is CLAIM_CONTENDED:
+            # Open tickets remain, other med users kept getting there first
             return Response(
-                {"error": "Access Denied"}, status=status.HTTP_403_FORBIDDEN
+                {"detail": "Open tickets are being claimed, try again."},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": str(CLAIM_RETRY_AFTER)},
             )
 
+        serializer = TicketSerializer(ticket)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class TicketStatsView(APIView):
+    permission_classes = [IsAuthenticated, IsMedUser]
+
+    def get(self, request):
+        # Read from the counters and the response-time sketch (tickets.stats),
+        # never from a scan of the ticket table
+        return Response(dashboard_stats(request.user.id), status=status.HTTP_200_OK)
+
 
 ##### FOLLOWUP TICKETS VIEW #####
 
 
-class TicketFollowupCreateView(APIView):
+class TicketFollowupCreateView(LimitedUploadMixin, APIView):
     parser_classes = (MultiPartParser, FormParser)
     permission_classes = [IsAuthenticated]
 
     def post(self, request, ticket_id, format=None):
-        serializer = OnlyUserProfileSerializer(request.user)
-        user_id = serializer["id"].value
+        user_id = request.user.id
 
         ticket = get_object_or_404(Ticket, pk=ticket_id)
 
         if ticket.is_open:
             # only medical user can open a ticket
-            if serializer["is_med_user"].value:
+            if request.user.is_med_user:
                 # Serialize the RegUser data
                 data = request.data.copy()
                 data["creator_id"] = user_id
                 data["root"] = ticket_id
-                data["is_medUser"] = serializer["is_med_user"].value
+                data["is_medUser"] = request.user.is_med_user
 
                 serializer = TicketFollowUpSerializer(data=data)
 
                 if serializer.is_valid():
-                    serializer.save()
-                    ticket.is_open = False
-                    ticket.opened_by_med_id = user_id
-                    ticket.save()
+                    with transaction.atomic():
+                        # Another med user may have claimed it since we read it
+                        if not claim_ticket(ticket.id, user_id):
+                            return Response(
+                                {"detail": "Ticket already claimed"},
+                                status=status.HTTP_409_CONFLICT,
+                            )
+                        serializer.save()
                     return Response(serializer.data, status=status.HTTP_201_CREATED)
                 else:
                     return Response(
@@ -246,7 +306,7 @@ class TicketFollowupCreateView(APIView):
                 data = request.data.copy()
                 data["creator_id"] = user_id
                 data["root"] = ticket.id
-                data["is_medUser"] = serializer["is_med_user"].value
+                data["is_medUser"] = request.user.is_med_user
 
                 serializer = TicketFollowUpSerializer(data=data)
 
@@ -265,11 +325,57 @@ class TicketFollowupCreateView(APIView):
                 )
 
 
-class TicketFollowupUpdateView(APIView):
+class TicketFollowupBatchCreateView(APIView):
+    # POST a JSON array of {"description": ...} (at most MAX_BATCH_SIZE):
+    # replayed offline messages in one request, one INSERT and one sequence
+    # number allocation. Files still go through followup/create/.
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, ticket_id, format=None):
+        user_id = request.user.id
+        is_med_user = request.user.is_med_user
+
+        ticket = get_object_or_404(Ticket, pk=ticket_id)
+
+        if ticket.is_open:
+            # only medical user can open a ticket
+            if not is_med_user:
+                return Response(
+                    {"detail": "Access Denied"}, status=status.HTTP_403_FORBIDDEN
+                )
+        elif user_id not in (ticket.creator_id, ticket.opened_by_med_id):
+            return Response(
+                {"detail": "Not allowed to follow-up"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        items, error = batch_items(request)
+        if error is not None:
+            return error
+        validated, errors = validate_batch(
+            TicketFollowUpBatchItemSerializer(data=items, many=True)
+        )
+        descriptions = [item["description"] for item in validated if item]
+        if not descriptions:
+            return batch_response(errors, [])
+
+        with transaction.atomic():
+            # Another med user may have claimed it since we read it
+            if ticket.is_open and not claim_ticket(ticket.id, user_id):
+                return Response(
+                    {"detail": "Ticket already claimed"},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            followups = create_followups(ticket.id, user_id, is_med_user, descriptions)
+        return batch_response(
+            errors, TicketFollowUpSerializer(followups, many=True).data
+        )
+
+
+class TicketFollowupUpdateView(LimitedUploadMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def put(self, request, ticket_fu_id, format=None):
-        serializer = OnlyUserProfileSerializer(request.user)
         # Check if the ticket exists
         try:
             ticket_fu = TicketFollowUp.objects.get(pk=ticket_fu_id)
@@ -278,7 +384,7 @@ class TicketFollowupUpdateView(APIView):
                 {"error": "Ticket not found."}, status=status.HTTP_404_NOT_FOUND
             )
 
-        user_id = serializer["id"].value
+        user_id = request.user.id
         # Ensure that the user is the owner of the ticket (if needed)
         if ticket_fu.creator_id != user_id:
             return Response(
@@ -301,9 +407,6 @@ class TicketFollowupDeleteView(APIView):
     permission_classes = [IsAuthenticated]
 
     def delete(self, request, ticket_fu_id, format=None):
-        # Check if the user exists
-        serializer = OnlyUserProfileSerializer(request.user)
-
         # Check if the ticket exists
         try:
             ticket_fu = TicketFollowUp.objects.get(pk=ticket_fu_id)
@@ -313,17 +416,14 @@ class TicketFollowupDeleteView(APIView):
             )
 
         # Ensure that the user is the owner of the ticket (if needed)
-        user_id = serializer["id"].value
+        user_id = request.user.id
         if ticket_fu.creator_id != user_id:
             return Response(
                 {"error": "Access Denied"},
                 status=status.HTTP_403_FORBIDDEN,
             )
 
-        ticket_fu = TicketFollowUp.objects.get(pk=ticket_fu_id)
-        # Delete the associated files (assuming a FileField named 'attachment')
-        if ticket_fu.files:
-            ticket_fu.files.delete(save=True)
+        # Attachments are queued for the background sweeper inside delete()
         ticket_fu.delete()
         return Response(
             {"message": "Ticket deleted."}, status=status.HTTP_204_NO_CONTENT
@@ -336,28 +436,35 @@ class TicketFollowupListView(APIView):
     pagination_class = PageNumberPagination
 
     def get(self, request, ticket_id):
-        serializer = OnlyUserProfileSerializer(request.user)
-        user_id = serializer["id"].value
+        user_id = request.user.id
         try:
             ticket = Ticket.objects.get(pk=ticket_id)
         except Ticket.DoesNotExist:
-            return Response(
-                {"error": "Ticket not found."}, status=status.HTTP_404_NOT_FOUND
-            )
+            return self.get_archived(request, ticket_id)
 
         # Ensure that the user is the owner of the ticket (if needed)
-        user_id = serializer["id"].value
+        user_id = request.user.id
         if ticket.creator_id != user_id and ticket.opened_by_med_id != user_id:
             return Response(
                 {"error": "Access Denied"},
                 status=status.HTTP_403_FORBIDDEN,
             )
 
-        tickets = TicketFollowUp.objects.filter(root=ticket_id).order_by(
-            "-sequence_number"
+        tickets = (
+            TicketFollowUp.objects.filter(root=ticket_id)
+            .prefetch_related("attachments")
+            .order_by("-sequence_number")
         )
 
-        paginator = PageNumberPagination()
+        # The response embeds the ticket itself, so its row is part of the
+        # validator too
+        conditional = ConditionalGet.for_queryset(request, tickets, ticket.updated_at)
+        not_modified = conditional.not_modified_response()
+        if not_modified is not None:
+            return not_modified
+
+        # newest first, matching the sequence_number ordering above
+        paginator = select_paginator(request, ordering=("-created_at", "-id"))
         paginator.page_size = 10  # Set the number of items per page
 
         page = paginator.paginate_queryset(tickets, request)
@@ -372,4 +479,191 @@ class TicketFollowupListView(APIView):
             "followup_data": followup_serializer.data,
         }
         # Return the paginated response
-        return paginator.get_paginated_response(response_data)
+        return conditional.finish(paginator.get_paginated_response(response_data))
+
+    def get_archived(self, request, ticket_id):
+        # Same response for a ticket moved to the archive (tickets.archive)
+        archived = ArchivedTicket.objects.filter(pk=ticket_id).first()
+        if archived is None:
+            return Response(
+                {"error": "Ticket not found."}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        user_id = request.user.id
+        if archived.creator_id != user_id and archived.opened_by_med_id != user_id:
+            return Response(
+                {"error": "Access Denied"},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+
+        # Archived threads never change
+        conditional = ConditionalGet(
+            request, archived.pk, last_modified=archived.archived_at
+        )
+        not_modified = conditional.not_modified_response()
+        if not_modified is not None:
+            return not_modified
+
+        # The thread is a list here, so always page numbers
+        ticket, followups = archived_thread(archived)
+        paginator = PageNumberPagination()
+        paginator.page_size = 10
+
+        page = paginator.paginate_queryset(followups, request)
+        response_data = {
+            "ticket_details": TicketSerializer(ticket).data,
+            "followup_data": TicketFollowUpSerializer(page, many=True).data,
+        }
+        return conditional.finish(paginator.get_paginated_response(response_data))
+
+
+def serve_archived_file(request, files, not_found):
+    # Download fallback for attachments of archived tickets
+    archived = files.select_related("ticket").first()
+    if archived is None:
+        return Response({"error": not_found}, status=status.HTTP_404_NOT_FOUND)
+
+    user_id = request.user.id
+    ticket = archived.ticket
+    if ticket.creator_id != user_id and ticket.opened_by_med_id != user_id:
+        return Response(
+            {"error": "Access Denied"},
+            status=status.HTTP_403_FORBIDDEN,
+        )
+    filename = None
+    if archived.attachment_id:
+        filename = archived_attachment_name(ticket, archived.attachment_id)
+    return serve_attachment(request, archived_file(archived.name), filename)
+
+
+##### ATTACHMENT DOWNLOADS (SAME RULES AS THE FOLLOWUP LIST) #####
+class TicketFileDownloadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, ticket_id):
+        try:
+            ticket = Ticket.objects.get(pk=ticket_id)
+        except Ticket.DoesNotExist:
+            return serve_archived_file(
+                request,
+                ArchivedFile.objects.filter(
+                    ticket_id=ticket_id, followup_id=None, attachment_id=None
+                ),
+                "Ticket not found.",
+            )
+
+        user_id = request.user.id
+        if ticket.creator_id != user_id and ticket.opened_by_med_id != user_id:
+            return Response(
+                {"error": "Access Denied"},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+
+        if not ticket.files:
+            return Response(
+                {"error": "Ticket has no attachment."},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        return serve_attachment(request, ticket.files)
+
+
+class TicketFollowupFileDownloadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, ticket_fu_id):
+        try:
+            ticket_fu = TicketFollowUp.objects.select_related("root").get(
+                pk=ticket_fu_id
+            )
+        except TicketFollowUp.DoesNotExist:
+            return serve_archived_file(
+                request,
+                ArchivedFile.objects.filter(
+                    followup_id=ticket_fu_id, attachment_id=None
+                ),
+                "Ticket not found.",
+            )
+
+        user_id = request.user.id
+        ticket = ticket_fu.root
+        if ticket.creator_id != user_id and ticket.opened_by_med_id != user_id:
+            return Response(
+                {"error": "Access Denied"},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+
+        if not ticket_fu.files:
+            return Response(
+                {"error": "Follow-up has no attachment."},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        return serve_attachment(request, ticket_fu.files)
+
+
+class TicketAttachmentDownloadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, attachment_id):
+        try:
+            attachment = TicketAttachment.objects.select_related(
+                "ticket", "followup__root"
+            ).get(pk=attachment_id)
+        except TicketAttachment.DoesNotExist:
+            return serve_archived_file(
+                request,
+                ArchivedFile.objects.filter(attachment_id=attachment_id),
+                "Attachment not found.",
+            )
+
+        user_id = request.user.id
+        ticket = attachment.ticket or attachment.followup.root
+        if ticket.creator_id != user_id and ticket.opened_by_med_id != user_id:
+            return Response(
+                {"error": "Access Denied"},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        return serve_attachment(request, attachment.file, attachment.name)
+
+
+##### SEARCH (SAME VISIBILITY AS THE LIST VIEWS) #####
+class TicketSearchView(APIView):
+    permission_classes = [IsAuthenticated]
+    page_size = 10
+
+    def get(self, request):
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            return Response(
+                {"error": "Query parameter 'q' is required."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            page = int(request.query_params.get("page", 1))
+            if page < 1:
+                raise ValueError
+        except ValueError:
+            return Response(
+                {"detail": "Invalid page."}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        # Best match first; one extra id tells whether there is a next page
+        ids = search_tickets(
+            request.user, query, self.page_size + 1, (page - 1) * self.page_size
+        )
+        has_next = len(ids) > self.page_size
+        ids = ids[: self.page_size]
+        tickets = Ticket.objects.prefetch_related("attachments").in_bulk(ids)
+        serializer = TicketSerializer(
+            [tickets[pk] for pk in ids if pk in tickets], many=True
+        )
+
+        url = request.build_absolute_uri()
+        next_url = replace_query_param(url, "page", page + 1) if has_next else None
+        previous_url = None
+        if page == 2:
+            previous_url = remove_query_param(url, "page")
+        elif page > 2:
+            previous_url = replace_query_param(url, "page", page - 1)
+        return Response(
+            {"next": next_url, "previous": previous_url, "results": serializer.data}
+        )